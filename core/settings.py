@@ -102,7 +102,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "core.middleware.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -126,6 +126,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "home.context_processors.profile",
             ],
         },
     },
@@ -168,6 +169,18 @@ else:
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The default in memory cache is per process, set a shared one (Redis, memcached, database) for repo payloads built by
+# other workers and `refresh_repos` to be served before they go stale
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'cs587-dashboard'),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -201,6 +214,84 @@ USE_TZ = True
 # Time in seconds to invalidate cached repos
 CACHE_INVALIDATE = int(os.getenv('CACHE_INVALIDATE', str(60*60)))
 
+# Time in seconds an invalidated repo is still served while it is refreshed in the background,
+# older repos are refreshed before responding
+CACHE_MAX_STALE = int(os.getenv('CACHE_MAX_STALE', str(24*60*60)))
+
+# Concurrent GitHub calls made when loading a profile at login, and the deadline in seconds for all of them
+PROFILE_WORKERS = int(os.getenv('PROFILE_WORKERS', '6'))
+PROFILE_TIMEOUT = float(os.getenv('PROFILE_TIMEOUT', '20'))
+
+# Seconds a stored profile stays in the REPO_CACHE_ALIAS cache, and repositories per page of a profile's repo list
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', str(10*60)))
+PROFILE_REPOS_PAGE_SIZE = int(os.getenv('PROFILE_REPOS_PAGE_SIZE', '30'))
+
+# Seconds a stored profile is served at login instead of being fetched again, seconds between background refreshes
+# of active users' profiles (0 disables them), and seconds since their last login users count as active
+PROFILE_SNAPSHOT_TTL = float(os.getenv('PROFILE_SNAPSHOT_TTL', str(60*60)))
+PROFILE_REFRESH_INTERVAL = float(os.getenv('PROFILE_REFRESH_INTERVAL', str(15*60)))
+PROFILE_ACTIVE_WINDOW = float(os.getenv('PROFILE_ACTIVE_WINDOW', str(24*60*60)))
+
+# Seconds a repo build lock is held at most, and seconds other workers wait for it before building anyway
+BUILD_LOCK_TTL = float(os.getenv('BUILD_LOCK_TTL', str(10*60)))
+BUILD_LOCK_TIMEOUT = float(os.getenv('BUILD_LOCK_TIMEOUT', str(5*60)))
+
+# Ready to serve repo payloads are cached in process (up to REPO_CACHE_SIZE repos for REPO_CACHE_TTL seconds)
+# and in the REPO_CACHE_ALIAS cache below
+REPO_CACHE_SIZE = int(os.getenv('REPO_CACHE_SIZE', '128'))
+REPO_CACHE_TTL = float(os.getenv('REPO_CACHE_TTL', '60'))
+REPO_CACHE_ALIAS = 'default'
+
+# Compression levels of the pre-encoded repo payloads, they are compressed once per refresh
+PAYLOAD_GZIP_LEVEL = int(os.getenv('PAYLOAD_GZIP_LEVEL', '6'))
+PAYLOAD_BROTLI_QUALITY = int(os.getenv('PAYLOAD_BROTLI_QUALITY', '9'))
+
+# GitHub API root, and whether profiles and repo branches, collaborators and pull requests are fetched with batched
+# GraphQL queries instead of one REST listing each
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+GITHUB_GRAPHQL = os.getenv('GITHUB_GRAPHQL', '').lower() in ('1', 'true', 'yes')
+GITHUB_GRAPHQL_URL = os.getenv('GITHUB_GRAPHQL_URL', f'{GITHUB_API_URL}/graphql')
+
+# Pooled GitHub clients: seconds before an unused client is closed, connections kept per client,
+# and seconds the authenticated user is reused before being fetched again
+GITHUB_CLIENT_IDLE_TIMEOUT = float(os.getenv('GITHUB_CLIENT_IDLE_TIMEOUT', str(15*60)))
+GITHUB_CLIENT_POOL_SIZE = int(os.getenv('GITHUB_CLIENT_POOL_SIZE', '10'))
+GITHUB_CLIENT_USER_TTL = float(os.getenv('GITHUB_CLIENT_USER_TTL', '60'))
+
+# Repos built in the background after a login, before the user picks one (0 disables it), and most GitHub requests
+# this warm-up may spend per login
+WARM_REPOS = int(os.getenv('WARM_REPOS', '0'))
+WARM_REPOS_BUDGET = int(os.getenv('WARM_REPOS_BUDGET', '300'))
+
+# Workers building repositories users are waiting on, background repository refresh workers, and seconds a finished
+# job can still be polled
+BUILD_WORKERS = int(os.getenv('BUILD_WORKERS', '8'))
+REFRESH_WORKERS = int(os.getenv('REFRESH_WORKERS', '2'))
+REFRESH_JOB_KEEP = float(os.getenv('REFRESH_JOB_KEEP', str(10*60)))
+
+# Seconds to keep retrying statistics endpoints that answer 202 while GitHub computes them
+STATS_MAX_WAIT = float(os.getenv('STATS_MAX_WAIT', str(5*60)))
+
+# Points sent per chart range by default, and the most a client may ask for
+SERIES_POINTS = int(os.getenv('SERIES_POINTS', '300'))
+SERIES_MAX_POINTS = int(os.getenv('SERIES_MAX_POINTS', '2000'))
+
+# Seconds of commit history sent with a repo, older commits are only counted
+COMMITS_WINDOW = int(os.getenv('COMMITS_WINDOW', str(90*24*60*60)))
+
+# Concurrent page requests when walking a repository's commit history
+COMMIT_PAGE_WORKERS = int(os.getenv('COMMIT_PAGE_WORKERS', '4'))
+
+# Seconds after which a repository's whole commit history is walked again instead of only what is new
+COMMITS_FULL_SYNC = float(os.getenv('COMMITS_FULL_SYNC', str(7*24*60*60)))
+
+# Requests left in a token's hourly budget below which background work is deferred
+RATE_LIMIT_RESERVE = int(os.getenv('RATE_LIMIT_RESERVE', '500'))
+
+# Conditional request (ETag) cache of GitHub responses, size in bytes, 0 to disable
+GITHUB_CACHE_DIR = os.getenv('GITHUB_CACHE_DIR', os.path.join(BASE_DIR, '.cache', 'github'))
+GITHUB_CACHE_MAX_SIZE = int(os.getenv('GITHUB_CACHE_MAX_SIZE', str(256*1024*1024)))
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
@@ -5,6 +5,8 @@ Copyright (c) 2019 - present AppSeed.us
 
 bind = '0.0.0.0:5005'
 workers = 1
+# Async views and streams share one event loop per worker, run with core.asgi
+worker_class = 'uvicorn_worker.UvicornWorker'
 accesslog = '-'
 loglevel = 'debug'
 capture_output = True
@@ -0,0 +1,187 @@
+"""Benchmarks of the ingest, cache and serve hot paths, against the local fake GitHub API
+
+Every benchmark runs a fixed number of times and reports the min, median, mean and max seconds. Results can be
+compared by median against a baseline, regressions only count against one recorded on the same machine, see the
+`benchmark` command. They expect a
+throwaway database, the command runs them on Django's test database.
+"""
+from datetime import datetime, timezone
+from statistics import mean, median
+from time import perf_counter
+from typing import Any, Callable
+import asyncio
+import os
+import platform
+
+import django
+from django.contrib.auth.models import User
+from django.test import Client
+
+from core import settings
+
+from . import github_api, github_async, views
+from .fake_github import REPO_ID_BASE, FakeGitHub
+from .models import GitHubRepositoryModel
+from .payloads import encode_payload
+
+TOKEN = 'benchmark'
+
+# Commits of the synthetic repos built by the ingest benchmarks
+SIZES = {'small': 100, 'medium': 5000, 'huge': 50000}
+
+
+def measure(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] | None = None, number: int = 1) -> dict[str, float]:
+    """Time a call
+
+    Args:
+        fn (Callable[[], Any]): The call to time
+        repeat (int): Times to run it
+        setup (Callable[[], Any] | None, optional): Untimed call before each run. Defaults to None.
+        number (int, optional): Calls per run, averaged, for calls too fast to time one by one. Defaults to 1.
+
+    Returns:
+        dict[str, float]: Runs, and min, median, mean and max seconds
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((perf_counter() - started) / number)
+    return {'runs': repeat, 'min': min(times), 'median': median(times), 'mean': mean(times), 'max': max(times)}
+
+
+def cpu_model() -> str:
+    """Model name of the CPU, as Linux reports it, else what `platform` knows"""
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine() -> dict[str, Any]:
+    """What timings depend on, runs are only comparable on the same machine"""
+    return {'platform': platform.platform(), 'cpu': cpu_model(), 'cpus': os.cpu_count(), 'python': platform.python_version()}
+
+
+def run_benchmarks(repeat: int = 5, sizes: dict[str, int] | None = None, latency: float = 0,
+                   log: Callable[[str], None] = print) -> dict[str, Any]:
+    """Run every benchmark against a fake GitHub API started for the run
+
+    Args:
+        repeat (int, optional): Runs of each benchmark, builds of repos over 10000 commits run at most 3 times.
+            Defaults to 5.
+        sizes (dict[str, int] | None, optional): Commits of the built repos by name. Defaults to SIZES.
+        latency (float, optional): Seconds the fake API adds to every answer. Defaults to 0.
+        log (Callable[[str], None], optional): Progress output. Defaults to print.
+
+    Returns:
+        dict[str, Any]: Run metadata and the result of each benchmark by name
+    """
+    sizes = sizes or SIZES
+    fake = FakeGitHub(repos=300, commits=tuple(sizes.values()), stats_202=0, latency=latency)
+    server = fake.start()
+    # Measure the code, not the conditional request cache, answers would be replayed from disk after the first run
+    saved = settings.GITHUB_API_URL, github_api.CLIENTS.cache, github_async.ASYNC_CLIENTS.cache
+    settings.GITHUB_API_URL = fake.base_url
+    github_api.CLIENTS.cache = github_async.ASYNC_CLIENTS.cache = None
+    github_api.CLIENTS.evict(TOKEN)
+
+    results = {}
+
+    def bench(name: str, fn: Callable[[], Any], runs: int = repeat, setup: Callable[[], Any] | None = None, number: int = 1):
+        log(f"{name}...")
+        results[name] = measure(fn, runs, setup, number)
+
+    # One loop for every async call, as in an ASGI worker, so the pooled async client is reused
+    loop = asyncio.new_event_loop()
+    try:
+        user, _ = User.objects.get_or_create(username='benchmark')
+
+        bench('request_profile', lambda: github_api.request_profile(TOKEN))
+        bench('request_profile_async', lambda: loop.run_until_complete(github_async.request_profile_async(TOKEN)))
+
+        rows = {}
+        for index, (size, commits) in enumerate(sizes.items()):
+            repo_id = REPO_ID_BASE + index
+
+            def build(repo_id=repo_id, size=size):
+                rows[size] = GitHubRepositoryModel(user, repo=github_api.get_repository(TOKEN, repo_id))
+
+            bench(f'build_{size}', build, runs=min(repeat, 3) if commits > 10000 else repeat)
+            rows[size].save()
+            row = GitHubRepositoryModel.objects.get(id=repo_id)
+            bench(f'dump_encode_{size}', lambda row=row: encode_payload(row.dump()))
+
+        small_id = REPO_ID_BASE
+
+        def request_small():
+            loop.run_until_complete(views.request_repository(user, TOKEN, repo_id=small_id))
+
+        def forget_small():
+            views.REPO_CACHE.delete(views.repo_key(small_id))
+
+        def drop_small():
+            forget_small()
+            GitHubRepositoryModel.objects.filter(id=small_id).delete()
+
+        views.get_cached_payload(repo_id=small_id)
+        bench('request_repository_hit', request_small, number=100)
+        bench('request_repository_db', request_small, setup=forget_small)
+        bench('request_repository_miss', request_small, setup=drop_small)
+
+        client = Client()
+        client.force_login(user)
+        chart_id = REPO_ID_BASE + list(sizes).index('medium') if 'medium' in sizes else small_id
+        for metric in ('commits', 'commit_activity', 'code_freq'):
+            bench(f'repo_series_{metric}', lambda metric=metric: client.get(f'/repo_series/{chart_id}/', {'metric': metric}, secure=True))
+    finally:
+        loop.close()
+        server.shutdown()
+        server.server_close()
+        settings.GITHUB_API_URL, github_api.CLIENTS.cache, github_async.ASYNC_CLIENTS.cache = saved
+        github_api.CLIENTS.evict(TOKEN)
+
+    return {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'machine': machine(),
+            'repeat': repeat,
+            'sizes': sizes,
+            'latency': latency,
+        },
+        'results': results,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], threshold: float, min_delta: float = 0.002) -> list[dict[str, Any]]:
+    """Compare the medians of a run to a baseline run
+
+    Args:
+        results (dict[str, Any]): Output of `run_benchmarks`
+        baseline (dict[str, Any]): Output of an earlier `run_benchmarks`
+        threshold (float): Relative slowdown over which a benchmark counts as regressed, e.g. 0.25 for 25%
+        min_delta (float, optional): Seconds of slowdown under which a benchmark never counts as regressed, the noise
+            of millisecond timings. Defaults to 0.002.
+
+    Returns:
+        list[dict[str, Any]]: Name, baseline and current median, ratio and whether it regressed, per benchmark in both
+    """
+    rows = []
+    for name, result in results['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else 1
+        rows.append({'name': name, 'baseline': before['median'], 'median': result['median'], 'ratio': ratio,
+                     'regressed': ratio > 1 + threshold and result['median'] - before['median'] > min_delta})
+    return rows
@@ -0,0 +1,18 @@
+"""Template context shared by every page"""
+from django.utils.functional import SimpleLazyObject
+
+from core import settings
+
+from .profiles import get_profile, get_profile_repos
+
+
+def profile(request) -> dict:
+    """The logged in user's profile and the first page of their repositories, loaded only if a template uses them"""
+    profile_id = request.session.get('profile_id') if request.user.is_authenticated else None
+    if profile_id is None:
+        return {'profile': None, 'profile_repos': []}
+
+    return {
+        'profile': SimpleLazyObject(lambda: get_profile(profile_id) or {}),
+        'profile_repos': SimpleLazyObject(lambda: get_profile_repos(profile_id, 1, settings.PROFILE_REPOS_PAGE_SIZE)[0]),
+    }
@@ -0,0 +1,567 @@
+"""Local stand-in for the GitHub REST API, to load and latency test without a token or network access
+
+It serves a synthetic user and repositories of any size on the endpoints this project calls, with configurable
+latency, 202 answers from the statistics endpoints, pagination, conditional requests and per token rate limits.
+Everything is generated from the repository index, so answers are the same from one run to the next and huge
+repositories cost no memory. Run it with `manage.py fake_github`, then set GITHUB_API_URL to its address and
+CURRENT_TOKEN to any value. With GITHUB_GRAPHQL on, set GITHUB_GRAPHQL_URL to its address followed by /graphql, it
+answers the queries of `github_graphql` with the same data as the REST endpoints.
+"""
+from datetime import datetime, timezone
+from hashlib import sha1, sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlencode, urlparse
+import json
+import random
+import re
+import threading
+
+VIEWER_ID = 1
+USER_ID_BASE = 1000
+REPO_ID_BASE = 100000
+
+# Commits of a repository span at most this many seconds back from the server start
+HISTORY_SPAN = 2 * 365 * 24 * 60 * 60
+WEEK = 7 * 24 * 60 * 60
+
+
+def gh_time(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeGitHub:
+    """Synthetic GitHub data and the HTTP server answering with it
+
+    Args:
+        repos (int, optional): Repositories of the viewer. Defaults to 20.
+        commits (tuple[int, ...], optional): Commit counts, repository `i` gets `commits[i % len(commits)]`.
+            Defaults to (100,).
+        contributors (int, optional): Distinct commit authors per repository. Defaults to 5.
+        branches (int, optional): Branches per repository. Defaults to 3.
+        pulls (int, optional): Open pull requests per repository. Defaults to 5.
+        collaborators (int, optional): Collaborators per repository. Defaults to 3.
+        followers (int, optional): Followers and followed users of the viewer. Defaults to 10.
+        latency (float, optional): Seconds added to every answer. Defaults to 0.
+        stats_202 (int, optional): 202 answers of each statistics endpoint before its data. Defaults to 1.
+        rate_limit (int, optional): Requests per token per window, 304 answers are free as on GitHub. Defaults to 5000.
+        rate_window (float, optional): Seconds before a token's budget resets. Defaults to 3600.
+        login (str, optional): Login of the viewer. Defaults to 'fake-user'.
+    """
+
+    def __init__(self, repos: int = 20, commits: tuple[int, ...] = (100,), contributors: int = 5, branches: int = 3,
+                 pulls: int = 5, collaborators: int = 3, followers: int = 10, latency: float = 0, stats_202: int = 1,
+                 rate_limit: int = 5000, rate_window: float = 3600, login: str = 'fake-user'):
+        self.repos = repos
+        self.commits = tuple(commits) or (0,)
+        self.contributors = max(1, contributors)
+        self.branches = max(1, branches)
+        self.pulls = pulls
+        self.collaborators = collaborators
+        self.followers = followers
+        self.latency = latency
+        self.stats_202 = stats_202
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.login = login
+        self.base_url = ''
+        # Whole hours, so the data doesn't change with every restart within the hour
+        self.now = int(time()) // 3600 * 3600
+        self.requests = 0
+        self._budgets: dict[tuple[str, str], list[float]] = {}
+        self._stats_calls: dict[tuple[int, str], int] = {}
+        self._lock = threading.Lock()
+        self.routes: list[tuple[re.Pattern, Callable]] = [(re.compile(f'^{pattern}$'), handler) for pattern, handler in (
+            (r'/user', self.get_viewer),
+            (r'/user/repos', self.get_viewer_repos),
+            (r'/rate_limit', self.get_rate_limit),
+            (r'/users/(?P<login>[^/]+)', self.get_user),
+            (r'/users/(?P<login>[^/]+)/(?P<kind>followers|following)', self.get_user_follows),
+            (r'/users/(?P<login>[^/]+)/events/public', self.get_user_events),
+            (r'/users/(?P<login>[^/]+)/(?P<kind>starred|subscriptions)', self.get_user_starred),
+            (r'/repositories/(?P<repo_id>\d+)(?P<rest>/.*)?', self.get_repo_by_id),
+            (r'/repos/(?P<owner>[^/]+)/(?P<name>[^/]+)(?P<rest>/.*)?', self.get_repo_by_name),
+        )]
+
+    # Synthetic data
+
+    def user(self, index: int) -> dict[str, Any]:
+        """Short representation of user `index`, 0 being the viewer"""
+        login = self.login if index == 0 else f'fake-contributor-{index}'
+        url = f'{self.base_url}/users/{login}'
+        return {
+            'login': login, 'id': VIEWER_ID if index == 0 else USER_ID_BASE + index, 'node_id': f'U_{index}',
+            'avatar_url': f'https://avatars.example.com/u/{index}', 'gravatar_id': '', 'url': url,
+            'html_url': f'https://github.example.com/{login}', 'followers_url': f'{url}/followers',
+            'following_url': f'{url}/following{{/other_user}}', 'gists_url': f'{url}/gists{{/gist_id}}',
+            'starred_url': f'{url}/starred{{/owner}}{{/repo}}', 'subscriptions_url': f'{url}/subscriptions',
+            'organizations_url': f'{url}/orgs', 'repos_url': f'{url}/repos', 'events_url': f'{url}/events{{/privacy}}',
+            'received_events_url': f'{url}/received_events', 'type': 'User', 'site_admin': False,
+        }
+
+    def full_user(self, index: int) -> dict[str, Any]:
+        """Full representation of user `index`, with the private fields GitHub adds for the viewer"""
+        user = self.user(index)
+        user.update({
+            'name': user['login'].replace('-', ' ').title(), 'company': None, 'blog': '', 'location': None,
+            'email': None, 'hireable': None, 'bio': 'Synthetic user of the fake GitHub API', 'twitter_username': None,
+            'public_repos': self.repos if index == 0 else 0, 'public_gists': 0, 'followers': self.followers,
+            'following': self.followers, 'created_at': gh_time(self.now - 10 * 365 * 86400),
+            'updated_at': gh_time(self.now - 86400),
+        })
+        if index == 0:
+            user.update({
+                'private_gists': 0, 'total_private_repos': 0, 'owned_private_repos': 0, 'disk_usage': 0,
+                'collaborators': 0, 'two_factor_authentication': False,
+                'plan': {'name': 'free', 'space': 976562499, 'collaborators': 0, 'private_repos': 10000},
+            })
+        return user
+
+    def branch_names(self) -> list[str]:
+        """Branches of every repository, alphabetical as GitHub lists them"""
+        return sorted('main' if i == 0 else f'branch-{i}' for i in range(self.branches))
+
+    def commit_count(self, index: int) -> int:
+        return self.commits[index % len(self.commits)]
+
+    def commit_spacing(self, index: int) -> int:
+        return max(60, HISTORY_SPAN // max(1, self.commit_count(index)))
+
+    def repo(self, index: int, full: bool = False) -> dict[str, Any]:
+        """Representation of repository `index`, newest first by creation date"""
+        name = f'repo-{index}'
+        owner = self.user(0)
+        url = f'{self.base_url}/repos/{owner["login"]}/{name}'
+        created = self.now - HISTORY_SPAN - index * 86400
+        repo = {
+            'id': REPO_ID_BASE + index, 'node_id': f'R_{index}', 'name': name, 'full_name': f'{owner["login"]}/{name}',
+            'private': index % 4 == 3, 'owner': owner, 'html_url': f'https://github.example.com/{owner["login"]}/{name}',
+            'description': f'Synthetic repository {index} with {self.commit_count(index)} commits', 'fork': False,
+            'url': url, 'created_at': gh_time(created), 'updated_at': gh_time(self.now - index * 3600),
+            'pushed_at': gh_time(self.now - index * 3600), 'homepage': None, 'size': self.commit_count(index),
+            'stargazers_count': index, 'watchers_count': index, 'language': ('Python', 'Go', 'TypeScript')[index % 3],
+            'forks_count': index // 2, 'open_issues_count': self.pulls, 'archived': False, 'disabled': False,
+            'default_branch': 'main', 'forks': index // 2, 'open_issues': self.pulls, 'watchers': index,
+            'has_issues': True, 'has_projects': True, 'has_downloads': True, 'has_wiki': True, 'has_pages': False,
+            'mirror_url': None, 'license': None, 'visibility': 'public',
+            'git_url': f'git://github.example.com/{owner["login"]}/{name}.git',
+            'ssh_url': f'git@github.example.com:{owner["login"]}/{name}.git',
+            'clone_url': f'https://github.example.com/{owner["login"]}/{name}.git',
+            'svn_url': f'https://github.example.com/{owner["login"]}/{name}',
+            'permissions': {'admin': True, 'maintain': True, 'push': True, 'triage': True, 'pull': True},
+        }
+        for key, path in (
+                ('archive_url', '/{archive_format}{/ref}'), ('assignees_url', '/assignees{/user}'),
+                ('blobs_url', '/git/blobs{/sha}'), ('branches_url', '/branches{/branch}'),
+                ('collaborators_url', '/collaborators{/collaborator}'), ('comments_url', '/comments{/number}'),
+                ('commits_url', '/commits{/sha}'), ('compare_url', '/compare/{base}...{head}'),
+                ('contents_url', '/contents/{+path}'), ('contributors_url', '/contributors'),
+                ('deployments_url', '/deployments'), ('downloads_url', '/downloads'), ('events_url', '/events'),
+                ('forks_url', '/forks'), ('git_commits_url', '/git/commits{/sha}'), ('git_refs_url', '/git/refs{/sha}'),
+                ('git_tags_url', '/git/tags{/sha}'), ('hooks_url', '/hooks'),
+                ('issue_comment_url', '/issues/comments{/number}'), ('issue_events_url', '/issues/events{/number}'),
+                ('issues_url', '/issues{/number}'), ('keys_url', '/keys{/key_id}'), ('labels_url', '/labels{/name}'),
+                ('languages_url', '/languages'), ('merges_url', '/merges'), ('milestones_url', '/milestones{/number}'),
+                ('notifications_url', '/notifications{?since,all,participating}'), ('pulls_url', '/pulls{/number}'),
+                ('releases_url', '/releases{/id}'), ('stargazers_url', '/stargazers'),
+                ('statuses_url', '/statuses/{sha}'), ('subscribers_url', '/subscribers'),
+                ('subscription_url', '/subscription'), ('tags_url', '/tags'), ('teams_url', '/teams'),
+                ('trees_url', '/git/trees{/sha}')):
+            repo[key] = url + path
+        if full:
+            repo.update({'network_count': index // 2, 'subscribers_count': index})
+        return repo
+
+    def repo_index(self, repo_id: int | None = None, owner: str | None = None, name: str | None = None) -> int | None:
+        if repo_id is not None:
+            index = repo_id - REPO_ID_BASE
+        elif owner == self.login and name.startswith('repo-') and name[5:].isdigit():
+            index = int(name[5:])
+        else:
+            return None
+        return index if 0 <= index < self.repos else None
+
+    def sha(self, index: int, position: int) -> str:
+        """Sha of a repository's commit, the repository and position are readable back from it"""
+        return f'{index:08x}{position:08x}' + sha1(f'{index}:{position}'.encode()).hexdigest()[:24]
+
+    def commit(self, index: int, position: int) -> dict[str, Any]:
+        """Commit at `position` of a repository's history, 0 being the newest"""
+        sha = self.sha(index, position)
+        date = gh_time(self.now - position * self.commit_spacing(index))
+        contributor = (position * 7 + index) % self.contributors + 1
+        author = self.user(contributor)
+        git_author = {'name': author['login'], 'email': f'{author["login"]}@example.com', 'date': date}
+        repo_url = f'{self.base_url}/repos/{self.login}/repo-{index}'
+        return {
+            'sha': sha, 'node_id': f'C_{sha}', 'url': f'{repo_url}/commits/{sha}',
+            'html_url': f'https://github.example.com/{self.login}/repo-{index}/commit/{sha}',
+            'comments_url': f'{repo_url}/commits/{sha}/comments',
+            'commit': {'author': git_author, 'committer': git_author, 'message': f'Commit {position}',
+                       'tree': {'sha': sha, 'url': f'{repo_url}/git/trees/{sha}'}, 'url': f'{repo_url}/git/commits/{sha}',
+                       'comment_count': 0},
+            # Every tenth commit is by an author without a GitHub account
+            'author': None if position % 10 == 9 else author,
+            'committer': None if position % 10 == 9 else author,
+            'parents': [] if position + 1 >= self.commit_count(index) else [{'sha': self.sha(index, position + 1)}],
+        }
+
+    def pull(self, index: int, number: int) -> dict[str, Any]:
+        repo = self.repo(index)
+        user = self.user(number % self.contributors + 1)
+        url = f'{repo["url"]}/pulls/{number}'
+        created = gh_time(self.now - number * 86400)
+
+        def dest(ref: str) -> dict[str, Any]:
+            return {'label': f'{self.login}:{ref}', 'ref': ref, 'sha': self.sha(index, number), 'user': user, 'repo': repo}
+
+        return {
+            'id': index * 10000 + number, 'node_id': f'PR_{index}_{number}', 'number': number, 'state': 'open',
+            'locked': False, 'title': f'Pull request {number}', 'user': user, 'body': f'Changes of pull request {number}',
+            'body_html': f'<p>Changes of pull request {number}</p>', 'body_text': f'Changes of pull request {number}',
+            'created_at': created, 'updated_at': created, 'closed_at': None, 'merged_at': None,
+            'merge_commit_sha': None, 'assignee': None, 'assignees': [], 'requested_reviewers': [],
+            'requested_teams': [], 'labels': [], 'milestone': None, 'draft': False, 'active_lock_reason': None,
+            'url': url, 'html_url': f'{repo["html_url"]}/pull/{number}', 'diff_url': f'{repo["html_url"]}/pull/{number}.diff',
+            'patch_url': f'{repo["html_url"]}/pull/{number}.patch', 'issue_url': f'{repo["url"]}/issues/{number}',
+            'commits_url': f'{url}/commits', 'review_comments_url': f'{url}/comments',
+            'review_comment_url': f'{repo["url"]}/pulls/comments{{/number}}', 'comments_url': f'{repo["url"]}/issues/{number}/comments',
+            'statuses_url': f'{repo["url"]}/statuses/{self.sha(index, number)}',
+            'head': dest(f'feature-{number}'), 'base': dest('main'), '_links': {}, 'author_association': 'OWNER',
+        }
+
+    def commit_activity(self, index: int) -> list[dict[str, Any]]:
+        rng = random.Random(index)
+        week = (self.now // WEEK) * WEEK
+        weeks = []
+        for i in range(52):
+            days = [rng.randint(0, 5) for _ in range(7)]
+            weeks.append({'days': days, 'total': sum(days), 'week': week - (51 - i) * WEEK})
+        return weeks
+
+    def code_frequency(self, index: int) -> list[list[int]]:
+        rng = random.Random(-index)
+        week = (self.now // WEEK) * WEEK
+        count = min(HISTORY_SPAN // WEEK, 260)
+        return [[week - (count - 1 - i) * WEEK, rng.randint(0, 500), -rng.randint(0, 300)] for i in range(count)]
+
+    # Request handlers, each returns a status and a JSON body, lists are paginated by the caller
+
+    def get_viewer(self, query, headers):
+        return 200, self.full_user(0)
+
+    def get_viewer_repos(self, query, headers):
+        return 200, [self.repo(i) for i in range(self.repos)]
+
+    def get_rate_limit(self, query, headers):
+        return 200, {'resources': {'core': {'limit': self.rate_limit}}, 'rate': {'limit': self.rate_limit}}
+
+    def get_user(self, query, headers, login):
+        if login == self.login:
+            return 200, self.full_user(0)
+        if login.startswith('fake-contributor-') and login[17:].isdigit():
+            return 200, self.full_user(int(login[17:]))
+        return 404, None
+
+    def get_user_follows(self, query, headers, login, kind):
+        return 200, [self.user(i % self.contributors + 1) for i in range(self.followers)]
+
+    def get_user_events(self, query, headers, login):
+        events = []
+        for i in range(min(self.repos, 30)):
+            repo = self.repo(i)
+            events.append({
+                'id': str(REPO_ID_BASE * 10 + i), 'type': 'PushEvent', 'public': True,
+                'actor': {k: self.user(0)[k] for k in ('id', 'login', 'url', 'avatar_url')},
+                'repo': {'id': repo['id'], 'name': repo['full_name'], 'url': repo['url']},
+                'payload': {'push_id': i, 'size': 1, 'ref': 'refs/heads/main', 'commits': []},
+                'created_at': gh_time(self.now - i * 3600),
+            })
+        return 200, events
+
+    def get_user_starred(self, query, headers, login, kind):
+        repos = [self.repo(i) for i in range(0, self.repos, 2)]
+        if kind == 'starred' and 'star+json' in headers.get('Accept', ''):
+            # Media type github3 asks for, with the time each repository was starred
+            return 200, [{'starred_at': repo['updated_at'], 'repo': repo} for repo in repos]
+        return 200, repos
+
+    def get_repo_by_id(self, query, headers, repo_id, rest):
+        return self.get_repo(query, self.repo_index(repo_id=int(repo_id)), rest)
+
+    def get_repo_by_name(self, query, headers, owner, name, rest):
+        return self.get_repo(query, self.repo_index(owner=owner, name=name), rest)
+
+    def get_repo(self, query, index, rest):
+        if index is None:
+            return 404, None
+        rest = (rest or '').strip('/')
+        if not rest:
+            return 200, self.repo(index, full=True)
+        if rest == 'commits':
+            return 200, self.list_commits(index, query)
+        if rest.startswith('branches/') and rest[9:] in self.branch_names():
+            head = self.commit(index, 0)
+            return 200, {'name': rest[9:], 'commit': head, 'protected': False, 'protection': {'enabled': False},
+                         'protection_url': f'{self.repo(index)["url"]}/branches/{rest[9:]}/protection',
+                         '_links': {'self': f'{self.repo(index)["url"]}/branches/{rest[9:]}', 'html': ''}}
+        if rest == 'branches':
+            return 200, [{'name': name, 'protected': False,
+                          'commit': {'sha': self.sha(index, i), 'url': f'{self.repo(index)["url"]}/commits/{self.sha(index, i)}'}}
+                         for i, name in enumerate(self.branch_names())]
+        if rest == 'collaborators':
+            return 200, [{**self.user(i + 1), 'permissions': {'admin': False, 'push': True, 'pull': True}}
+                         for i in range(self.collaborators)]
+        if rest == 'pulls':
+            return 200, [self.pull(index, number) for number in range(1, self.pulls + 1)]
+        if rest in ('stats/commit_activity', 'stats/code_frequency'):
+            with self._lock:
+                calls = self._stats_calls[(index, rest)] = self._stats_calls.get((index, rest), 0) + 1
+            if calls <= self.stats_202:
+                return 202, {}
+            return 200, self.commit_activity(index) if rest.endswith('commit_activity') else self.code_frequency(index)
+        if rest.startswith('compare/'):
+            return self.compare(index, rest[8:])
+        return 404, None
+
+    def list_commits(self, index: int, query: dict[str, str]) -> 'CommitList':
+        count = self.commit_count(index)
+        if query.get('since'):
+            since = datetime.strptime(query['since'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+            count = min(count, max(0, int((self.now - since) // self.commit_spacing(index)) + 1))
+        return CommitList(self, index, count)
+
+    def position(self, index: int, ref: str) -> int | None:
+        """Position in a repository's history of a sha or a branch, every branch points at the newest commit"""
+        if ref in self.branch_names():
+            return 0
+        if not re.fullmatch('[0-9a-f]{40}', ref):
+            return None
+        position = int(ref[8:16], 16)
+        return position if position < self.commit_count(index) and ref == self.sha(index, position) else None
+
+    def compare(self, index: int, spec: str):
+        base, _, head = spec.partition('...')
+        base, head = self.position(index, base), self.position(index, head)
+        if base is None or head is None or head > base:
+            return 404, None
+        ahead_by = base - head
+        # Oldest first, at most 250 as on GitHub
+        commits = [self.commit(index, i) for i in range(base - 1, max(head, base - 250) - 1, -1)]
+        return 200, {
+            'url': f'{self.repo(index)["url"]}/compare/{spec}', 'html_url': '', 'permalink_url': '', 'diff_url': '',
+            'patch_url': '', 'base_commit': self.commit(index, ahead_by), 'merge_base_commit': self.commit(index, ahead_by),
+            'status': 'ahead' if ahead_by else 'identical', 'ahead_by': ahead_by, 'behind_by': 0,
+            'total_commits': ahead_by, 'commits': commits, 'files': [],
+        }
+
+    # GraphQL, only the queries of `github_graphql` are understood: the root and its paged connections are read off the
+    # query, and nodes carry every field those queries select
+
+    def gql_user(self, index: int) -> dict[str, Any]:
+        user = self.user(index)
+        return {'databaseId': user['id'], 'login': user['login'], 'avatarUrl': user['avatar_url'], 'url': user['html_url']}
+
+    def gql_repo(self, index: int) -> dict[str, Any]:
+        repo = self.repo(index)
+        return {
+            'databaseId': repo['id'], 'name': repo['name'], 'nameWithOwner': repo['full_name'],
+            'description': repo['description'], 'isPrivate': repo['private'], 'isArchived': repo['archived'],
+            'createdAt': repo['created_at'], 'updatedAt': repo['updated_at'], 'homepageUrl': repo['homepage'],
+            'url': repo['html_url'], 'forkCount': repo['forks_count'], 'stargazerCount': repo['stargazers_count'],
+            'owner': self.gql_user(0), 'primaryLanguage': {'name': repo['language']},
+            # Every open issue is a pull request
+            'openIssues': {'totalCount': 0}, 'openPullRequests': {'totalCount': self.pulls},
+        }
+
+    def gql_pull(self, index: int, number: int) -> dict[str, Any]:
+        pull = self.pull(index, number)
+        return {'databaseId': pull['id'], 'title': pull['title'], 'body': pull['body'], 'createdAt': pull['created_at'],
+                'updatedAt': pull['updated_at'], 'author': {'login': pull['user']['login']}}
+
+    def gql_viewer(self) -> dict[str, Any]:
+        user = self.full_user(0)
+        follows = [self.gql_user(i % self.contributors + 1) for i in range(min(self.followers, 10))]
+        starred = [self.gql_repo(i) for i in range(0, self.repos, 2)][:10]
+        return {
+            'databaseId': user['id'], 'name': user['name'], 'login': user['login'], 'avatarUrl': user['avatar_url'],
+            'url': user['html_url'], 'email': user['email'], 'bio': user['bio'], 'company': user['company'],
+            'followers': {'totalCount': self.followers, 'nodes': follows}, 'following': {'nodes': follows},
+            'starredRepositories': {'nodes': starred}, 'watching': {'nodes': starred},
+            'publicRepositories': {'totalCount': user['public_repos']}, 'gists': {'totalCount': user['public_gists']},
+        }
+
+    def graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        """Answer a query of `github_graphql`, connections are paged with the offset as cursor"""
+        if 'repository(' in query:
+            root = 'repository'
+            index = self.repo_index(owner=variables.get('owner'), name=variables.get('name') or '')
+            if index is None:
+                return {'data': {root: None}, 'errors': [{'type': 'NOT_FOUND', 'path': [root],
+                                                          'message': 'Could not resolve to a Repository'}]}
+            node = {}
+            connections = {
+                'branches': lambda: [{'name': name} for name in self.branch_names()],
+                'collaborators': lambda: [self.gql_user(i + 1) for i in range(self.collaborators)],
+                'pull_requests': lambda: [self.gql_pull(index, number) for number in range(1, self.pulls + 1)],
+            }
+        else:
+            root = 'viewer'
+            # Follow up queries only ask for more pages
+            node = self.gql_viewer() if 'followers(' in query else {}
+            connections = {'repositories': lambda: [self.gql_repo(i) for i in range(self.repos)]}
+
+        cursor = int(variables.get('cursor') or 0)
+        for name, first in re.findall(r'(\w+): \w+\(first: (\d+), after: \$cursor', query):
+            items = connections[name]()
+            end = min(cursor + int(first), len(items))
+            node[name] = {'pageInfo': {'hasNextPage': end < len(items), 'endCursor': str(end)}, 'nodes': items[cursor:end]}
+        return {'data': {root: node}}
+
+    # HTTP
+
+    def spend(self, token: str, free: bool = False, resource: str = 'core') -> tuple[bool, dict[str, str]]:
+        """Take a request from a token's budget of a resource, GraphQL has its own as on GitHub
+
+        Returns:
+            tuple[bool, dict[str, str]]: Whether the request is allowed, and the rate limit headers to send
+        """
+        with self._lock:
+            self.requests += 1
+            budget = self._budgets.get((token, resource))
+            if budget is None or budget[1] <= time():
+                budget = self._budgets[token, resource] = [self.rate_limit, time() + self.rate_window]
+            allowed = budget[0] > 0
+            if allowed and not free:
+                budget[0] -= 1
+            remaining, reset = budget
+        return allowed, {
+            'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Used': str(self.rate_limit - remaining), 'X-RateLimit-Reset': str(int(reset)),
+            'X-RateLimit-Resource': resource,
+        }
+
+    def handler(self) -> type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            server_version = 'FakeGitHub'
+            verbose = False
+
+            def do_GET(self):
+                if fake.latency:
+                    sleep(fake.latency)
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, body = 404, None
+                for pattern, route in fake.routes:
+                    match = pattern.match(url.path.rstrip('/') or '/')
+                    if match:
+                        status, body = route(query, self.headers, **match.groupdict())
+                        break
+
+                links = ''
+                if isinstance(body, (list, CommitList)):
+                    body, links = fake.paginate(url, query, body)
+                encoded = json.dumps(body if body is not None else {'message': 'Not Found'}).encode()
+                etag = f'W/"{sha256(encoded).hexdigest()[:32]}"'
+                not_modified = status == 200 and self.headers.get('If-None-Match') == etag
+
+                allowed, headers = fake.spend(self.headers.get('Authorization', ''), not_modified)
+                if not allowed:
+                    status, encoded, links = 403, json.dumps({'message': 'API rate limit exceeded'}).encode(), ''
+                elif not_modified:
+                    status, encoded = 304, b''
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if status in (200, 304):
+                    self.send_header('ETag', etag)
+                if links:
+                    self.send_header('Link', links)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_POST(self):
+                if fake.latency:
+                    sleep(fake.latency)
+                request = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                headers = {}
+                if urlparse(self.path).path.rstrip('/') != '/graphql':
+                    status, encoded = 404, json.dumps({'message': 'Not Found'}).encode()
+                else:
+                    allowed, headers = fake.spend(self.headers.get('Authorization', ''), resource='graphql')
+                    if allowed:
+                        request = json.loads(request or b'{}')
+                        status, encoded = 200, json.dumps(fake.graphql(request.get('query', ''), request.get('variables') or {})).encode()
+                    else:
+                        status, encoded = 403, json.dumps({'message': 'API rate limit exceeded'}).encode()
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args):
+                if self.verbose:
+                    super().log_message(format, *args)
+
+        return Handler
+
+    def paginate(self, url, query: dict[str, str], items) -> tuple[list, str]:
+        """Cut a page out of a listing as GitHub does, with its Link header"""
+        per_page = min(max(int(query.get('per_page', 30)), 1), 100)
+        page = max(int(query.get('page', 1)), 1)
+        last = max(1, -(-len(items) // per_page))
+
+        def link(number: int, rel: str) -> str:
+            return f'<{self.base_url}{url.path}?{urlencode({**query, "page": number})}>; rel="{rel}"'
+
+        links = []
+        if page < last:
+            links += [link(page + 1, 'next'), link(last, 'last')]
+        if page > 1:
+            links += [link(1, 'first'), link(page - 1, 'prev')]
+        return list(items[(page - 1) * per_page:page * per_page]), ', '.join(links)
+
+    def serve(self, host: str = '127.0.0.1', port: int = 0, verbose: bool = False) -> ThreadingHTTPServer:
+        """Bind the server, port 0 picks a free one, `base_url` is set to its address
+
+        Returns:
+            ThreadingHTTPServer: The server, to `serve_forever` or `shutdown`
+        """
+        handler = self.handler()
+        handler.verbose = verbose
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        self.base_url = f'http://{host}:{server.server_port}'
+        return server
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        """Serve from a daemon thread, e.g. within a benchmark"""
+        server = self.serve(host, port)
+        threading.Thread(target=server.serve_forever, name='fake-github', daemon=True).start()
+        return server
+
+
+class CommitList:
+    """A repository's history, built a page at a time so huge repositories are cheap"""
+
+    def __init__(self, fake: FakeGitHub, index: int, count: int):
+        self.fake = fake
+        self.index = index
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, window: slice) -> list[dict[str, Any]]:
+        return [self.fake.commit(self.index, i) for i in range(*window.indices(self.count))]
@@ -0,0 +1,123 @@
+"""Compact storage for the time series columns of a repository"""
+from array import array
+from base64 import b64decode, b64encode
+from typing import Any, Callable
+import sys
+import zlib
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+FORMAT_VERSION = 1
+
+# How each kind of series maps to and from fixed width rows of ints
+LAYOUTS: dict[str, tuple[int, Callable[[Any], list[int]], Callable[[list[int]], Any]]] = {
+    # [week, additions, deletions]
+    'code_freq': (3, list, list),
+    # {'days': [7 ints], 'total': int, 'week': int}
+    'commit_activity': (9,
+                        lambda x: [x['week'], x['total'], *x['days']],
+                        lambda x: {'days': x[2:], 'total': x[1], 'week': x[0]}),
+}
+
+
+def encode_rows(rows: list[list[int]], columns: int) -> bytes:
+    """Encode rows of ints as column wise deltas in little endian int64, zlib compressed
+
+    Args:
+        rows (list[list[int]]): Rows to encode, each `columns` wide
+        columns (int): Width of every row
+
+    Returns:
+        bytes: Encoded rows
+    """
+    deltas = array('q')
+    previous = [0] * columns
+    for row in rows:
+        deltas.extend(value - last for value, last in zip(row, previous))
+        previous = row
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return bytes([FORMAT_VERSION, columns]) + zlib.compress(deltas.tobytes())
+
+
+def decode_rows(data: bytes) -> list[list[int]]:
+    """Decode rows encoded by `encode_rows`
+
+    Args:
+        data (bytes): Encoded rows
+
+    Returns:
+        list[list[int]]: Decoded rows
+    """
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f"Unknown series format {data[0]}")
+    columns = data[1]
+    deltas = array('q')
+    deltas.frombytes(zlib.decompress(data[2:]))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+
+    rows = []
+    previous = [0] * columns
+    for i in range(0, len(deltas), columns):
+        previous = [last + delta for last, delta in zip(previous, deltas[i:i + columns])]
+        rows.append(previous)
+    return rows
+
+
+class CompactSeriesAttribute(DeferredAttribute):
+    """Keeps the raw bytes loaded from the database and only decodes them the first time the attribute is read"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = self.field.to_python(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompactSeriesField(models.BinaryField):
+    """A list of fixed width integer records, stored delta encoded and compressed instead of as JSON
+
+    Args:
+        layout (str): Key of `LAYOUTS` describing the records
+    """
+
+    descriptor_class = CompactSeriesAttribute
+
+    def __init__(self, *args, layout: str, **kwargs):
+        self.layout = layout
+        self.columns, self.to_row, self.from_row = LAYOUTS[layout]
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['layout'] = self.layout
+        return name, path, args, kwargs
+
+    def encode(self, value: list[Any]) -> bytes:
+        return encode_rows([self.to_row(x) for x in value], self.columns)
+
+    def decode(self, data: bytes) -> list[Any]:
+        return [self.from_row(x) for x in decode_rows(data)]
+
+    def get_prep_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return self.encode(value)
+        return super().get_prep_value(value)
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            value = b64decode(value.encode('ascii'))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self.decode(bytes(value))
+        return value
+
+    def value_to_string(self, obj):
+        return b64encode(self.get_prep_value(self.value_from_object(obj))).decode('ascii')
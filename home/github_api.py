@@ -1,9 +1,16 @@
 """Github API wrapper using the github3 library"""
 from ast import List
 from datetime import datetime
-from typing import Any, Tuple
+from time import monotonic
+from typing import Any, Callable, Tuple
+from urllib.parse import parse_qs, urlparse
+import concurrent.futures
+import threading
 
-from github3 import GitHub, login
+from requests import Response, Session
+
+
+from github3 import GitHub
 from github3.users import AuthenticatedUser
 from github3.users import ShortUser
 from github3.events import Event
@@ -11,6 +18,11 @@ from github3.repos import ShortRepository, Repository
 from github3.repos.commit import ShortCommit
 from github3.pulls import ShortPullRequest
 
+from core import settings
+
+from .http_cache import CachingAdapter, ResponseCache
+from .ratelimit import ContextExecutor, RateLimitScheduler
+
 
 def get_datetime_str(dt: datetime | str | None) -> dict[str, str]:
     """Returns a datetime as a string dictionary with human readable or epoch strings
@@ -43,8 +55,118 @@ class Github3APIError(Exception):
         super().__init__("Generic Github3 API error")
 
 
+class GitHubClientRegistry:
+    """Process wide registry of authenticated GitHub clients, keyed by access token
+
+    Each client keeps its HTTP session alive with a pooled adapter, and the authenticated user is cached alongside it.
+    Clients that have not been used for `idle_timeout` seconds are closed and dropped.
+    """
+
+    def __init__(self, idle_timeout: float, pool_size: int, user_ttl: float, cache: ResponseCache | None = None,
+                 scheduler: RateLimitScheduler | None = None):
+        self.cache = cache
+        self.scheduler = scheduler
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self.user_ttl = user_ttl
+        self._clients: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def new_client(self, token: str) -> GitHub:
+        """Create a GitHub instance with a keep-alive connection pool and conditional request cache
+
+        Args:
+            token (str): OAuth token to use
+
+        Returns:
+            GitHub: The new GitHub instance
+        """
+        gh = GitHub(token=token)
+        # GitHub Enterprise or a local fake, e.g. `manage.py fake_github`
+        gh.session.base_url = settings.GITHUB_API_URL
+        adapter = CachingAdapter(self.cache, self.scheduler, pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        gh.session.mount('https://', adapter)
+        gh.session.mount('http://', adapter)
+        return gh
+
+    def client(self, token: str) -> GitHub:
+        """Get the pooled client for a token without resolving its user
+
+        Args:
+            token (str): OAuth token to use
+
+        Returns:
+            GitHub: The GitHub instance
+        """
+        with self._lock:
+            entry = self._clients.setdefault(token, {'gh': None})
+            if entry['gh'] is None:
+                entry['gh'] = self.new_client(token)
+            entry['used_at'] = monotonic()
+            return entry['gh']
+
+    def get(self, token: str) -> Tuple[GitHub, AuthenticatedUser]:
+        """Get the client and user for a token, logging in only if there is no live client
+
+        Args:
+            token (str): OAuth token to use
+
+        Raises:
+            Github3APIError: Failed to login or resolve user
+
+        Returns:
+            Tuple[GitHub, AuthenticatedUser]: The GitHub instance and its authenticated user
+        """
+        self.evict_idle()
+
+        with self._lock:
+            entry = self._clients.get(token)
+            if entry:
+                entry['used_at'] = monotonic()
+
+        if entry and 'user' in entry and monotonic() - entry['fetched_at'] < self.user_ttl:
+            return entry['gh'], entry['user']
+
+        gh = entry['gh'] if entry and entry['gh'] else self.new_client(token)
+        me = gh.me()
+
+        if me is None:
+            raise Github3APIError
+
+        with self._lock:
+            entry = self._clients.setdefault(token, {'gh': gh})
+            entry.update(gh=entry['gh'] or gh, user=me, fetched_at=monotonic(), used_at=monotonic())
+
+        return entry['gh'], me
+
+    def evict(self, token: str | None):
+        """Close and drop the client for a token, if any
+
+        Args:
+            token (str | None): OAuth token of the client
+        """
+        with self._lock:
+            entry = self._clients.pop(token, None)
+        if entry:
+            entry['gh'].session.close()
+
+    def evict_idle(self):
+        """Close and drop every client that has been idle for too long"""
+        cutoff = monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [token for token, entry in self._clients.items() if entry.get('used_at', cutoff) < cutoff]
+        for token in idle:
+            self.evict(token)
+
+
+RESPONSE_CACHE = ResponseCache(settings.GITHUB_CACHE_DIR, settings.GITHUB_CACHE_MAX_SIZE) if settings.GITHUB_CACHE_MAX_SIZE else None
+SCHEDULER = RateLimitScheduler(settings.RATE_LIMIT_RESERVE, settings.GITHUB_CLIENT_POOL_SIZE)
+CLIENTS = GitHubClientRegistry(settings.GITHUB_CLIENT_IDLE_TIMEOUT, settings.GITHUB_CLIENT_POOL_SIZE, settings.GITHUB_CLIENT_USER_TTL,
+                               RESPONSE_CACHE, SCHEDULER)
+
+
 def get_user(token: str) -> Tuple[GitHub, AuthenticatedUser]:
-    """Get a user instance from the API
+    """Get a user instance from the API, reusing the pooled client for the token
 
     Args:
         token (str): OAuth token to use
@@ -55,17 +177,7 @@ def get_user(token: str) -> Tuple[GitHub, AuthenticatedUser]:
     Returns:
         AuthenticatedUser: Instance of API User
     """
-    gh = login(token=token)
-
-    if gh is None:
-        raise Github3APIError
-
-    me = gh.me()
-
-    if me is None:
-        raise Github3APIError
-
-    return gh, me
+    return CLIENTS.get(token)
 
 
 def str_short_pull_request(pull: ShortPullRequest) -> dict[str, Any]:
@@ -185,6 +297,69 @@ def get_repository(access_token: str, repo_id: str | int | None = None, repo_own
     return repo
 
 
+def fetch_parallel(tasks: dict[str, Callable[[], Any]], max_workers: int, timeout: float | None = None) -> dict[str, Any]:
+    """Run independent API calls concurrently, bounded by a worker count and a single deadline
+
+    Args:
+        tasks (dict[str, Callable[[], Any]]): Named callables to run, each should fully evaluate any github3 iterators
+        max_workers (int): Maximum number of calls in flight at once
+        timeout (float | None, optional): Overall deadline in seconds for every call. Defaults to None.
+
+    Returns:
+        dict[str, Any]: Result of each task by name, None if the task failed or missed the deadline
+    """
+    results = dict.fromkeys(tasks)
+    executor = ContextExecutor(max_workers=max_workers)
+    futures = {executor.submit(task): name for name, task in tasks.items()}
+
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            print(f"Request {futures[future]} failed: {e}")
+    for future in not_done:
+        print(f"Request {futures[future]} timed out")
+
+    return results
+
+
+def fetch_pages(session: Session, url: str, params: dict[str, Any] | None = None, max_workers: int = 4) -> list[Any]:
+    """Fetch every page of a paginated listing, requesting the pages after the first concurrently
+
+    Args:
+        session (Session): Session to request with
+        url (str): URL of the listing
+        params (dict[str, Any] | None, optional): Query parameters. Defaults to None.
+        max_workers (int, optional): Maximum number of pages in flight at once. Defaults to 4.
+
+    Returns:
+        list[Any]: Items of every page, in order
+    """
+    params = {**(params or {}), 'per_page': 100}
+
+    def get_page(page: int) -> Tuple[Response, list[Any]]:
+        response = session.get(url, params={**params, 'page': page})
+        if response.status_code == 409:  # Empty git repository
+            return response, []
+        response.raise_for_status()
+        return response, response.json() or []
+
+    response, items = get_page(1)
+    last = response.links.get('last', {}).get('url')
+    if not last:
+        return items
+
+    # The last page link is the only way to know the page count up front
+    page_count = int(parse_qs(urlparse(last).query)['page'][0])
+    with ContextExecutor(max_workers=max_workers) as executor:
+        for _, page in executor.map(get_page, range(2, page_count + 1)):
+            items.extend(page)
+    return items
+
+
 def request_profile(access_token: str) -> Tuple[GitHub, AuthenticatedUser, dict[str, Any]]:
     """Immediately returns relevant information about a user's profile, given their access token
 
@@ -192,12 +367,27 @@ def request_profile(access_token: str) -> Tuple[GitHub, AuthenticatedUser, dict[
         access_token (str): A user's access token
 
     Returns:
-        Tuple[GitHub, AuthenticatedUser, dict[str, Any]]: The GitHub instance, current user, and a string dictionary of various attributes
+        Tuple[GitHub, AuthenticatedUser, dict[str, Any]]: The GitHub instance, current user, and a string dictionary of various attributes.
+            `missing` names the listings that failed or timed out, `repos` and the counts made from it are None if it is one of them.
+            `plan` is the plan's name, to be stored as JSON
     """
-    # TODO: Parallel requests
     gh, gh_usr = get_user(token=access_token)
-    repos = [str_short_repository(x) for x in gh.repositories('all', 'created', 'desc')]
-    priv_repo_count = len(repos) - gh_usr.public_repos_count
+
+    results = fetch_parallel({
+        "followers": lambda: [str_short_user(x) for x in gh_usr.followers(10)],
+        "following": lambda: [str_short_user(x) for x in gh_usr.following(10)],
+        "events": lambda: [str_event(x) for x in gh_usr.events(True, 10)],
+        "starred_repos": lambda: [str_short_repository(x.repository) for x in gh_usr.starred_repositories(sort='updated', number=10)],
+        "subscriptions": lambda: [str_short_repository(x) for x in gh_usr.subscriptions(number=10)],
+        "repos": lambda: list(gh.repositories('all', 'created', 'desc')),
+    }, max_workers=settings.PROFILE_WORKERS, timeout=settings.PROFILE_TIMEOUT)
+
+    # Listing is sorted by creation date, newest first. A listing that failed or timed out is unknown, not empty
+    repo_list = results["repos"]
+    repos = [str_short_repository(x) for x in repo_list] if repo_list is not None else None
+    priv_repo_count = len(repos) - gh_usr.public_repos_count if repos is not None else None
+    # Asking GitHub costs a request, only done before any answer told the remaining budget
+    remaining = SCHEDULER.report(access_token)['remaining']
     return gh, gh_usr, {
         "id": gh_usr.id,
         "name": gh_usr.name,
@@ -205,22 +395,23 @@ def request_profile(access_token: str) -> Tuple[GitHub, AuthenticatedUser, dict[
         "avatar_url": gh_usr.avatar_url,
         "url": gh_usr.html_url,
         "email": gh_usr.email,
-        "followers": [str_short_user(x) for x in gh_usr.followers(10)],
-        "following": [str_short_user(x) for x in gh_usr.following(10)],
+        "followers": results["followers"] or [],
+        "following": results["following"] or [],
         "bio": gh_usr.bio,
         "company": gh_usr.company,
-        "events": [str_event(x) for x in gh_usr.events(True, 10)],
-        "starred_repos": [str_short_repository(x) for x in gh_usr.starred_repositories(sort='updated', number=10)],
-        "subscriptions": [str_short_repository(x) for x in gh_usr.subscriptions(number=10)],
-        "plan": gh_usr.plan,
+        "events": results["events"] or [],
+        "starred_repos": results["starred_repos"] or [],
+        "subscriptions": results["subscriptions"] or [],
+        "plan": gh_usr.plan.name if gh_usr.plan else None,
         "repos": repos,
         "follower_count": gh_usr.followers_count,
         "repo_pub_count": gh_usr.public_repos_count,
         "repo_priv_count": priv_repo_count,
         "gist_pub_count": gh_usr.public_gists_count,
-        "repo_first": get_datetime_str(gh.repositories('all', 'created', 'asc', 1).next().created_at),
-        "repo_last": get_datetime_str(gh.repositories('all', 'created', 'desc', 1).next().created_at),
-        "api_limit": gh_usr.ratelimit_remaining,
+        "repo_first": get_datetime_str(repo_list[-1].created_at if repo_list else None),
+        "repo_last": get_datetime_str(repo_list[0].created_at if repo_list else None),
+        "api_limit": remaining if remaining is not None else gh_usr.ratelimit_remaining,
+        "missing": [name for name, result in results.items() if result is None],
     }
 
 
@@ -0,0 +1,250 @@
+"""Native async GitHub client for the async views, built on a pooled httpx client
+
+Requests go through the same conditional response cache and rate limit scheduler as the github3 clients. JSON is
+wrapped in github3 classes, so the `str_*` helpers of `github_api` shape it exactly as for the sync views.
+"""
+from typing import Any, Awaitable
+from urllib.parse import parse_qs, urlparse
+import asyncio
+import weakref
+
+import httpx
+
+from github3.events import Event
+from github3.repos import ShortRepository
+from github3.session import GitHubSession
+from github3.users import AuthenticatedUser, ShortUser
+
+from core import settings
+
+from .github_api import RESPONSE_CACHE, SCHEDULER, get_datetime_str, str_event, str_short_repository, str_short_user
+from .http_cache import STORED_HEADERS, ResponseCache
+from .ratelimit import RateLimitScheduler, check_exhausted
+
+
+class AsyncCachingTransport(httpx.AsyncHTTPTransport):
+    """Async counterpart of `CachingAdapter`, conditional GETs admitted through the rate limit scheduler"""
+
+    def __init__(self, cache: ResponseCache | None = None, scheduler: RateLimitScheduler | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.scheduler = scheduler
+
+    async def send_scheduled(self, request: httpx.Request) -> httpx.Response:
+        if self.scheduler is None:
+            response = await super().handle_async_request(request)
+        else:
+            # Waiting for a slot blocks, keep it off the event loop
+            key = await asyncio.to_thread(self.scheduler.acquire, request)
+            response = None
+            try:
+                response = await super().handle_async_request(request)
+            finally:
+                self.scheduler.release(key, response)
+        check_exhausted(response.status_code, response.headers)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        conditional = 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+        if self.cache is None or request.method != 'GET' or conditional:
+            return await self.send_scheduled(request)
+
+        key = self.cache.key(request)
+        entry = await asyncio.to_thread(self.cache.get, key)
+        if entry:
+            headers, _ = entry
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        response = await self.send_scheduled(request)
+
+        if response.status_code == 304 and entry:
+            headers, body = entry
+            replayed = {k: v for k, v in response.headers.items() if k.lower() not in ('content-length', 'content-encoding')}
+            replayed.update(headers)
+            await response.aclose()
+            return httpx.Response(200, headers=replayed, content=body, request=request, extensions={'from_cache': True})
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            await response.aread()
+            stored = httpx.Response(200, headers={x: response.headers[x] for x in STORED_HEADERS if x in response.headers},
+                                    content=response.content)
+            await asyncio.to_thread(self.cache.put, key, stored)
+        return response
+
+
+class AsyncGitHubClients:
+    """One pooled httpx client per event loop, shared by every token
+
+    The token goes with each request, so connections to GitHub are reused across users. Under an ASGI server there is
+    a single long lived loop per worker, clients of loops that are gone are dropped with them.
+    """
+
+    def __init__(self, pool_size: int, timeout: float, cache: ResponseCache | None = None,
+                 scheduler: RateLimitScheduler | None = None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache = cache
+        self.scheduler = scheduler
+        self._clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = weakref.WeakKeyDictionary()
+
+    def get(self) -> httpx.AsyncClient:
+        """Get the client of the running event loop, creating it on first use
+
+        Returns:
+            httpx.AsyncClient: The client
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            transport = AsyncCachingTransport(self.cache, self.scheduler, limits=limits)
+            client = httpx.AsyncClient(base_url=settings.GITHUB_API_URL, transport=transport, timeout=self.timeout,
+                                       headers={'Accept': 'application/vnd.github.v3.full+json'})
+            self._clients[loop] = client
+        return client
+
+
+ASYNC_CLIENTS = AsyncGitHubClients(settings.GITHUB_CLIENT_POOL_SIZE, settings.PROFILE_TIMEOUT, RESPONSE_CACHE, SCHEDULER)
+
+# github3 objects only need a session to be built from JSON, they never use it here
+WRAP_SESSION = GitHubSession()
+
+
+async def get_json(access_token: str, url: str, params: dict[str, Any] | None = None) -> httpx.Response:
+    """GET an API URL as a user
+
+    Args:
+        access_token (str): OAuth token
+        url (str): URL or path relative to the API root
+        params (dict[str, Any] | None, optional): Query parameters. Defaults to None.
+
+    Returns:
+        httpx.Response: The successful response
+    """
+    response = await ASYNC_CLIENTS.get().get(url, params=params, headers={'Authorization': f'token {access_token}'})
+    response.raise_for_status()
+    return response
+
+
+async def fetch_pages_async(access_token: str, url: str, params: dict[str, Any] | None = None) -> list[Any]:
+    """Async counterpart of `fetch_pages`, every page after the first requested at once
+
+    Args:
+        access_token (str): OAuth token
+        url (str): URL of the listing
+        params (dict[str, Any] | None, optional): Query parameters. Defaults to None.
+
+    Returns:
+        list[Any]: Items of every page, in order
+    """
+    params = {**(params or {}), 'per_page': 100}
+    response = await get_json(access_token, url, {**params, 'page': 1})
+    items = response.json() or []
+    last = response.links.get('last', {}).get('url')
+    if not last:
+        return items
+
+    page_count = int(parse_qs(urlparse(last).query)['page'][0])
+    pages = await asyncio.gather(*(get_json(access_token, url, {**params, 'page': page}) for page in range(2, page_count + 1)))
+    for page in pages:
+        items.extend(page.json() or [])
+    return items
+
+
+async def gather_named(tasks: dict[str, Awaitable], timeout: float | None = None) -> dict[str, Any]:
+    """Async counterpart of `fetch_parallel`, run named calls concurrently under a single deadline
+
+    Args:
+        tasks (dict[str, Awaitable]): Named calls to run
+        timeout (float | None, optional): Overall deadline in seconds for every call. Defaults to None.
+
+    Returns:
+        dict[str, Any]: Result of each call by name, None if the call failed or missed the deadline
+    """
+    results = dict.fromkeys(tasks)
+    futures = {asyncio.ensure_future(task): name for name, task in tasks.items()}
+    done, not_done = await asyncio.wait(futures, timeout=timeout)
+
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            print(f"Request {futures[future]} failed: {e}")
+    for future in not_done:
+        future.cancel()
+        print(f"Request {futures[future]} timed out")
+    return results
+
+
+async def request_profile_async(access_token: str) -> dict[str, Any]:
+    """Async counterpart of `request_profile`, the same profile from concurrent requests on the event loop
+
+    Args:
+        access_token (str): A user's access token
+
+    Returns:
+        dict[str, Any]: A string dictionary of various attributes, with the same `missing` listings as `request_profile`
+    """
+    gh_usr = AuthenticatedUser((await get_json(access_token, '/user')).json(), WRAP_SESSION)
+    user_url = f'/users/{gh_usr.login}'
+
+    async def listing(url: str, cls, shape, **params) -> list[dict[str, Any]]:
+        response = await get_json(access_token, url, {'per_page': 10, **params})
+        return [shape(cls(x, WRAP_SESSION)) for x in response.json()]
+
+    results = await gather_named({
+        "followers": listing(f'{user_url}/followers', ShortUser, str_short_user),
+        "following": listing(f'{user_url}/following', ShortUser, str_short_user),
+        "events": listing(f'{user_url}/events/public', Event, str_event),
+        "starred_repos": listing(f'{user_url}/starred', ShortRepository, str_short_repository, sort='updated'),
+        "subscriptions": listing(f'{user_url}/subscriptions', ShortRepository, str_short_repository),
+        "repos": fetch_pages_async(access_token, '/user/repos', {'type': 'all', 'sort': 'created', 'direction': 'desc'}),
+    }, timeout=settings.PROFILE_TIMEOUT)
+
+    # Listing is sorted by creation date, newest first. A listing that failed or timed out is unknown, not empty
+    repo_list = [ShortRepository(x, WRAP_SESSION) for x in results["repos"] or []]
+    repos = [str_short_repository(x) for x in repo_list] if results["repos"] is not None else None
+    priv_repo_count = len(repos) - gh_usr.public_repos_count if repos is not None else None
+    return {
+        "id": gh_usr.id,
+        "name": gh_usr.name,
+        "login": gh_usr.login,
+        "avatar_url": gh_usr.avatar_url,
+        "url": gh_usr.html_url,
+        "email": gh_usr.email,
+        "followers": results["followers"] or [],
+        "following": results["following"] or [],
+        "bio": gh_usr.bio,
+        "company": gh_usr.company,
+        "events": results["events"] or [],
+        "starred_repos": results["starred_repos"] or [],
+        "subscriptions": results["subscriptions"] or [],
+        "plan": gh_usr.plan.name if gh_usr.plan else None,
+        "repos": repos,
+        "follower_count": gh_usr.followers_count,
+        "repo_pub_count": gh_usr.public_repos_count,
+        "repo_priv_count": priv_repo_count,
+        "gist_pub_count": gh_usr.public_gists_count,
+        "repo_first": get_datetime_str(repo_list[-1].created_at if repo_list else None),
+        "repo_last": get_datetime_str(repo_list[0].created_at if repo_list else None),
+        "api_limit": SCHEDULER.report(access_token)['remaining'],
+        "missing": [name for name, result in results.items() if result is None],
+    }
+
+
+async def exchange_code(token_url: str, body: str) -> str:
+    """Exchange an OAuth code for an access token without blocking the event loop
+
+    Args:
+        token_url (str): GitHub's OAuth token URL
+        body (str): Form body prepared by oauthlib
+
+    Returns:
+        str: Body of GitHub's answer, for oauthlib to parse
+    """
+    async with httpx.AsyncClient(timeout=settings.PROFILE_TIMEOUT) as client:
+        response = await client.post(token_url, content=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'})
+    return response.text
@@ -0,0 +1,342 @@
+"""GraphQL batch fetching of profiles and repositories, an optional replacement for the many REST calls they need
+
+Nodes are shaped into exactly the dicts `str_short_user`, `str_short_repository` and `str_short_pull_request` make
+from REST objects. Connections are paged with cursors, a follow up query only asks for the connections that have
+more pages. GitHub has no GraphQL equivalent of the plan, events, statistics and commit listings, those stay on REST.
+"""
+from datetime import datetime, timezone
+from typing import Any
+
+from requests import Session
+
+from github3.events import Event
+
+from core import settings
+
+from .github_api import CLIENTS, SCHEDULER, get_datetime_str, str_event
+from .github_async import WRAP_SESSION, ASYNC_CLIENTS, get_json
+
+USER_FIELDS = '''
+    login avatarUrl url
+    ... on User { databaseId }
+    ... on Organization { databaseId }
+'''
+
+REPOSITORY_FIELDS = f'''
+    databaseId name nameWithOwner description isPrivate isArchived createdAt updatedAt homepageUrl url
+    forkCount stargazerCount
+    owner {{ {USER_FIELDS} }}
+    primaryLanguage {{ name }}
+    openIssues: issues(states: OPEN) {{ totalCount }}
+    openPullRequests: pullRequests(states: OPEN) {{ totalCount }}
+'''
+
+PAGE_INFO = 'pageInfo { hasNextPage endCursor }'
+
+# Connections of a profile and of a repository, by name, with the arguments they are paged with
+PROFILE_CONNECTIONS = {
+    'repositories': ('repositories(first: 100, after: $cursor, ownerAffiliations: [OWNER, COLLABORATOR, ORGANIZATION_MEMBER], '
+                     'orderBy: {field: CREATED_AT, direction: DESC})', REPOSITORY_FIELDS),
+}
+
+REPOSITORY_CONNECTIONS = {
+    'branches': ('refs(first: 100, after: $cursor, refPrefix: "refs/heads/", orderBy: {field: ALPHABETICAL, direction: ASC})',
+                 'name'),
+    'collaborators': ('collaborators(first: 100, after: $cursor, affiliation: ALL)', USER_FIELDS),
+    'pull_requests': ('pullRequests(first: 100, after: $cursor, states: OPEN, orderBy: {field: UPDATED_AT, direction: DESC})',
+                      'databaseId title body createdAt updatedAt author { login }'),
+}
+
+PROFILE_QUERY = f'''
+query($cursor: String) {{
+  viewer {{
+    databaseId name login avatarUrl url email bio company
+    followers(first: 10) {{ totalCount nodes {{ {USER_FIELDS} }} }}
+    following(first: 10) {{ nodes {{ {USER_FIELDS} }} }}
+    starredRepositories(first: 10, orderBy: {{field: STARRED_AT, direction: DESC}}) {{ nodes {{ {REPOSITORY_FIELDS} }} }}
+    watching(first: 10) {{ nodes {{ {REPOSITORY_FIELDS} }} }}
+    publicRepositories: repositories(privacy: PUBLIC, ownerAffiliations: [OWNER]) {{ totalCount }}
+    gists(privacy: PUBLIC) {{ totalCount }}
+    {{connections}}
+  }}
+}}
+'''
+
+REPOSITORY_QUERY = '''
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    {connections}
+  }
+}
+'''
+
+
+class GraphQLError(Exception):
+    """GitHub answered a GraphQL query with errors"""
+
+    def __init__(self, errors: list[dict[str, Any]]):
+        super().__init__('; '.join(str(x.get('message')) for x in errors) or "GraphQL query failed")
+        self.errors = errors
+
+
+def connection_fields(connections: dict[str, tuple[str, str]], names: list[str]) -> str:
+    """Selection of some of the paged connections of a node"""
+    return '\n'.join(f'{name}: {field} {{ {PAGE_INFO} nodes {{ {nodes} }} }}' for name, (field, nodes) in connections.items()
+                     if name in names)
+
+
+def profile_query(names: list[str], first_page: bool) -> str:
+    """Query for the profile, or only for more pages of its connections"""
+    if first_page:
+        return PROFILE_QUERY.replace('{connections}', connection_fields(PROFILE_CONNECTIONS, names))
+    return 'query($cursor: String) { viewer { %s } }' % connection_fields(PROFILE_CONNECTIONS, names)
+
+
+def repository_query(names: list[str]) -> str:
+    return REPOSITORY_QUERY.replace('{connections}', connection_fields(REPOSITORY_CONNECTIONS, names))
+
+
+def check(body: dict[str, Any], allowed: tuple[str, ...] = ()) -> dict[str, Any]:
+    """Get the data of a GraphQL answer
+
+    Args:
+        body (dict[str, Any]): The decoded answer
+        allowed (tuple[str, ...], optional): Error types that only null their field, e.g. FORBIDDEN. Defaults to ().
+
+    Raises:
+        GraphQLError: The answer has no data, or errors not of an allowed type
+
+    Returns:
+        dict[str, Any]: The data
+    """
+    errors = [x for x in body.get('errors') or [] if x.get('type') not in allowed]
+    if errors or body.get('data') is None:
+        raise GraphQLError(errors or body.get('errors') or [])
+    return body['data']
+
+
+def gh_datetime(value: str | None) -> datetime | None:
+    """Parse a GraphQL timestamp as the aware datetime github3 would make of it"""
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+def gql_short_user(node: dict[str, Any]) -> dict[str, str]:
+    """Same as `str_short_user`, from a user or organization node"""
+    return {
+        "id": str(node.get('databaseId')),
+        "login": str(node['login']),
+        "avatar_url": str(node['avatarUrl']),
+        "url": str(node['url']),
+    }
+
+
+def gql_short_repository(node: dict[str, Any]) -> dict[str, str | dict[str, str]]:
+    """Same as `str_short_repository`, from a repository node"""
+    return {
+        "id": node['databaseId'],
+        "name": node['name'],
+        "owner": gql_short_user(node['owner']),
+        "private": node['isPrivate'],
+        "full_name": node['nameWithOwner'],
+        "description": node['description'],
+        "created_at": get_datetime_str(gh_datetime(node['createdAt'])),
+        "updated_at": get_datetime_str(gh_datetime(node['updatedAt'])),
+        "homepage": node['homepageUrl'],
+        "language": (node['primaryLanguage'] or {}).get('name'),
+        "archived": node['isArchived'],
+        "forks_count": node['forkCount'],
+        # REST counts open pull requests as issues, and stars as watchers
+        "open_issues_count": node['openIssues']['totalCount'] + node['openPullRequests']['totalCount'],
+        "watchers_count": node['stargazerCount'],
+        "url": node['url'],
+    }
+
+
+def gql_short_pull_request(node: dict[str, Any]) -> dict[str, Any]:
+    """Same as `str_short_pull_request`, from a pull request node"""
+    created_at, updated_at = gh_datetime(node['createdAt']), gh_datetime(node['updatedAt'])
+    return {
+        'id': node['databaseId'],
+        'user': (node['author'] or {}).get('login', 'ghost'),
+        'title': node['title'],
+        'body': node['body'] or None,
+        'created_at': int(created_at.timestamp()) if created_at else 0,
+        'updated_at': int(updated_at.timestamp()) if updated_at else 0,
+    }
+
+
+def merge_pages(nodes: dict[str, list], cursors: dict[str, str], parent: dict[str, Any], names: list[str]):
+    """Collect the nodes of a page of each connection, and the cursors of those with more pages"""
+    for name in names:
+        connection = parent.get(name)
+        if connection is None:  # Nulled by an allowed error
+            continue
+        nodes.setdefault(name, []).extend(connection['nodes'])
+        if connection['pageInfo']['hasNextPage']:
+            cursors[name] = connection['pageInfo']['endCursor']
+
+
+def shape_profile(viewer: dict[str, Any], repositories: list[dict[str, Any]], events: list[dict[str, Any]] | None,
+                  plan: str | None, api_limit: int | None) -> dict[str, Any]:
+    """The profile dict of `request_profile`, from the viewer node and the events and plan fetched from REST"""
+    repos = [gql_short_repository(x) for x in repositories]
+    public_repos_count = viewer['publicRepositories']['totalCount']
+    return {
+        "id": viewer['databaseId'],
+        "name": viewer['name'],
+        "login": viewer['login'],
+        "avatar_url": viewer['avatarUrl'],
+        "url": viewer['url'],
+        "email": viewer['email'],
+        "followers": [gql_short_user(x) for x in viewer['followers']['nodes']],
+        "following": [gql_short_user(x) for x in viewer['following']['nodes']],
+        "bio": viewer['bio'],
+        "company": viewer['company'],
+        "events": events or [],
+        "starred_repos": [gql_short_repository(x) for x in viewer['starredRepositories']['nodes']],
+        "subscriptions": [gql_short_repository(x) for x in viewer['watching']['nodes']],
+        "plan": plan,
+        "repos": repos,
+        "follower_count": viewer['followers']['totalCount'],
+        "repo_pub_count": public_repos_count,
+        "repo_priv_count": len(repos) - public_repos_count,
+        "gist_pub_count": viewer['gists']['totalCount'],
+        "repo_first": repos[-1]['created_at'] if repos else get_datetime_str(None),
+        "repo_last": repos[0]['created_at'] if repos else get_datetime_str(None),
+        "api_limit": api_limit,
+        "missing": [] if events is not None else ['events'],
+    }
+
+
+def shape_repository(repository: dict[str, list], collaborators_access: bool) -> dict[str, Any]:
+    """Branches, collaborators and open pull requests as `GitHubRepositoryModel` stores them"""
+    pull_requests = [gql_short_pull_request(x) for x in repository.get('pull_requests', [])]
+    return {
+        'branches': [x['name'] for x in repository.get('branches', [])],
+        'collaborators': [gql_short_user(x) for x in repository.get('collaborators', [])] if collaborators_access else [],
+        'collaborators_access': collaborators_access,
+        'pull_requests': pull_requests,
+        'pull_requests_count': len(pull_requests),
+    }
+
+
+def execute(session: Session, query: str, variables: dict[str, Any], allowed: tuple[str, ...] = ()) -> dict[str, Any]:
+    """Run a GraphQL query on a pooled GitHub session
+
+    Returns:
+        dict[str, Any]: The data
+    """
+    response = session.post(settings.GITHUB_GRAPHQL_URL, json={'query': query, 'variables': variables})
+    response.raise_for_status()
+    return check(response.json(), allowed)
+
+
+def fetch_events(session: Session, login: str) -> list[dict[str, Any]] | None:
+    """The latest public events of a user, from REST"""
+    try:
+        response = session.get(f'{settings.GITHUB_API_URL}/users/{login}/events/public', params={'per_page': 10})
+        response.raise_for_status()
+        return [str_event(Event(x, WRAP_SESSION)) for x in response.json()]
+    except Exception as e:
+        print(f"Request events failed: {e}")
+        return None
+
+
+def fetch_plan(session: Session) -> str | None:
+    """Name of the viewer's plan, from REST"""
+    try:
+        response = session.get(f'{settings.GITHUB_API_URL}/user')
+        response.raise_for_status()
+        return (response.json().get('plan') or {}).get('name')
+    except Exception as e:
+        print(f"Request plan failed: {e}")
+        return None
+
+
+def request_profile_graphql(access_token: str) -> dict[str, Any]:
+    """Same profile as `request_profile`, from one GraphQL query per page of repositories
+
+    Args:
+        access_token (str): A user's access token
+
+    Returns:
+        dict[str, Any]: A string dictionary of various attributes
+    """
+    session = CLIENTS.client(access_token).session
+    names = list(PROFILE_CONNECTIONS)
+    viewer = execute(session, profile_query(names, True), {'cursor': None})['viewer']
+
+    nodes, cursors = {}, {}
+    merge_pages(nodes, cursors, viewer, names)
+    # Each connection has its own cursor, one query per connection with more pages
+    while cursors:
+        name, cursor = cursors.popitem()
+        page = execute(session, profile_query([name], False), {'cursor': cursor})['viewer']
+        merge_pages(nodes, cursors, page, [name])
+
+    events = fetch_events(session, viewer['login'])
+    return shape_profile(viewer, nodes.get('repositories', []), events, fetch_plan(session),
+                         SCHEDULER.report(access_token)['remaining'])
+
+
+def fetch_repository_graphql(session: Session, owner: str, name: str) -> dict[str, Any]:
+    """Branches, collaborators and open pull requests of a repository, from one GraphQL query per page
+
+    Args:
+        session (Session): Pooled GitHub session, e.g. the repository's
+        owner (str): Login of the owner
+        name (str): Name of the repository
+
+    Returns:
+        dict[str, Any]: The fields of `GitHubRepositoryModel` they fill
+    """
+    names = list(REPOSITORY_CONNECTIONS)
+    variables = {'owner': owner, 'name': name, 'cursor': None}
+    # Collaborators are only visible with push access, otherwise GitHub nulls them with a FORBIDDEN error
+    repository = execute(session, repository_query(names), variables, ('FORBIDDEN',))['repository']
+    collaborators_access = repository.get('collaborators') is not None
+
+    nodes, cursors = {}, {}
+    merge_pages(nodes, cursors, repository, names)
+    while cursors:
+        connection, cursor = cursors.popitem()
+        page = execute(session, repository_query([connection]), {**variables, 'cursor': cursor})['repository']
+        merge_pages(nodes, cursors, page, [connection])
+
+    return shape_repository(nodes, collaborators_access)
+
+
+async def execute_async(access_token: str, query: str, variables: dict[str, Any], allowed: tuple[str, ...] = ()) -> dict[str, Any]:
+    """Async counterpart of `execute`, on the pooled httpx client"""
+    response = await ASYNC_CLIENTS.get().post(settings.GITHUB_GRAPHQL_URL, json={'query': query, 'variables': variables},
+                                              headers={'Authorization': f'token {access_token}'})
+    response.raise_for_status()
+    return check(response.json(), allowed)
+
+
+async def request_profile_graphql_async(access_token: str) -> dict[str, Any]:
+    """Async counterpart of `request_profile_graphql`"""
+    names = list(PROFILE_CONNECTIONS)
+    viewer = (await execute_async(access_token, profile_query(names, True), {'cursor': None}))['viewer']
+
+    nodes, cursors = {}, {}
+    merge_pages(nodes, cursors, viewer, names)
+    while cursors:
+        name, cursor = cursors.popitem()
+        page = (await execute_async(access_token, profile_query([name], False), {'cursor': cursor}))['viewer']
+        merge_pages(nodes, cursors, page, [name])
+
+    try:
+        response = await get_json(access_token, f"/users/{viewer['login']}/events/public", {'per_page': 10})
+        events = [str_event(Event(x, WRAP_SESSION)) for x in response.json()]
+    except Exception as e:
+        print(f"Request events failed: {e}")
+        events = None
+    try:
+        plan = ((await get_json(access_token, '/user')).json().get('plan') or {}).get('name')
+    except Exception as e:
+        print(f"Request plan failed: {e}")
+        plan = None
+    return shape_profile(viewer, nodes.get('repositories', []), events, plan, SCHEDULER.report(access_token)['remaining'])
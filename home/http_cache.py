@@ -0,0 +1,204 @@
+"""Conditional request cache for the GitHub API session
+
+GitHub does not count `304 Not Modified` answers against the rate limit, so every GET is sent with the ETag or
+Last-Modified of the last body seen for it, and the stored body is replayed when GitHub answers 304.
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from time import monotonic
+import json
+import os
+import threading
+
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .ratelimit import RateLimitScheduler, check_exhausted
+
+# Headers of a cached response that are replayed along with its body
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Link')
+
+
+class ResponseCache:
+    """Size bounded store of GitHub response bodies on disk, evicting the least recently used first
+
+    Each entry is a single file, a JSON header line followed by the raw body. File modification times keep the
+    usage order across restarts. Every worker process writes to the same directory, so the index is rebuilt from it
+    every `rescan` seconds, and the bound holds for the directory as a whole, give or take what the other workers
+    wrote since the last scan.
+    """
+
+    def __init__(self, directory: str | Path, max_size: int, rescan: float = 60):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.rescan = rescan
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, int] | None = None
+        self._size = 0
+        self._scanned_at = 0.0
+
+    @staticmethod
+    def key(request: PreparedRequest) -> str:
+        """Key for a request, unique per URL, media type and credentials
+
+        Args:
+            request (PreparedRequest): The request to key
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        parts = [request.url, request.headers.get('Accept', ''), request.headers.get('Authorization', '')]
+        return sha256('\n'.join(str(x) for x in parts).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f'{key}.cache'
+
+    def _load_index(self):
+        if self._index is not None and monotonic() - self._scanned_at < self.rescan:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for f in self.directory.glob('*.cache'):
+            try:
+                stat = f.stat()
+            except FileNotFoundError:  # Evicted by another worker meanwhile
+                continue
+            files.append((stat.st_mtime, f.stem, stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(files))
+        self._size = sum(self._index.values())
+        self._scanned_at = monotonic()
+
+    def _drop(self, key: str):
+        self._size -= self._index.pop(key, 0)
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> tuple[dict, bytes] | None:
+        """Get a stored response and mark it as recently used
+
+        Args:
+            key (str): Key of the request
+
+        Returns:
+            tuple[dict, bytes] | None: Stored headers and body, None if not cached
+        """
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    headers = json.loads(f.readline())
+                    body = f.read()
+                os.utime(path)
+            except (OSError, ValueError):
+                self._drop(key)
+                return None
+        return headers, body
+
+    def put(self, key: str, response: Response):
+        """Store a response body with its validators, evicting old entries to stay under the size bound
+
+        Args:
+            key (str): Key of the request
+            response (Response): The response to store
+        """
+        headers = {x: response.headers[x] for x in STORED_HEADERS if x in response.headers}
+        data = json.dumps(headers).encode() + b'\n' + response.content
+        if len(data) > self.max_size:
+            return
+
+        with self._lock:
+            self._load_index()
+            self._drop(key)
+            path = self._path(key)
+            tmp = path.with_suffix(f'.{threading.get_ident()}.tmp')
+            try:
+                tmp.write_bytes(data)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"Failed to cache response: {e}")
+                return
+            self._index[key] = len(data)
+            self._size += len(data)
+            while self._size > self.max_size:
+                self._drop(next(iter(self._index)))
+
+
+def replay(headers: dict, body: bytes, not_modified: Response) -> Response:
+    """Build a 200 response from a stored body, given GitHub's 304 answer for it
+
+    Args:
+        headers (dict): Stored headers
+        body (bytes): Stored body
+        not_modified (Response): The 304 response
+
+    Returns:
+        Response: Response carrying the stored body and the live rate limit headers
+    """
+    response = Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.headers = CaseInsensitiveDict(not_modified.headers)
+    response.headers.update(headers)
+    response.headers['Content-Length'] = str(len(body))
+    response.headers.pop('Content-Encoding', None)
+    response._content = body
+    response.encoding = 'utf-8'
+    response.url = not_modified.url
+    response.request = not_modified.request
+    response.connection = not_modified.connection
+    response.elapsed = not_modified.elapsed
+    response.from_cache = True
+    return response
+
+
+class CachingAdapter(HTTPAdapter):
+    """Connection pooling adapter that turns every cacheable GET into a conditional request, and admits every request
+    through the rate limit scheduler"""
+
+    def __init__(self, cache: ResponseCache | None = None, scheduler: RateLimitScheduler | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.scheduler = scheduler
+
+    def send_scheduled(self, request: PreparedRequest, **kwargs) -> Response:
+        if self.scheduler is None:
+            response = super().send(request, **kwargs)
+        else:
+            key = self.scheduler.acquire(request)
+            response = None
+            try:
+                response = super().send(request, **kwargs)
+            finally:
+                self.scheduler.release(key, response)
+        check_exhausted(response.status_code, response.headers)
+        return response
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        conditional = 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+        if self.cache is None or request.method != 'GET' or conditional or kwargs.get('stream'):
+            return self.send_scheduled(request, **kwargs)
+
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        if entry:
+            headers, _ = entry
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        response = self.send_scheduled(request, **kwargs)
+
+        if response.status_code == 304 and entry:
+            return replay(*entry, response)
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.put(key, response)
+        return response
@@ -0,0 +1,239 @@
+"""Background refresh jobs, run on local worker pools instead of inside the HTTP request
+
+Jobs a user waits on and background refreshes run on separate pools, so a queue of refreshes never holds up a build
+someone is waiting for.
+"""
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Iterator
+import asyncio
+import concurrent.futures
+import threading
+import uuid
+
+from django.db import connections
+from django.utils.timezone import now
+
+from core import settings
+
+from .ratelimit import BACKGROUND, INTERACTIVE, RequestAllowance, allowance, priority
+
+_current_job: ContextVar['RefreshJob | None'] = ContextVar('current_job', default=None)
+
+
+def publish(event: str, data: Any):
+    """Publish progress of the job running in this context, if any
+
+    Args:
+        event (str): Name of the event, e.g. a repository section
+        data (Any): Data of the event
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.publish(event, data)
+
+
+class RefreshJob:
+    """A single refresh running in the background, identified by a random id"""
+
+    def __init__(self, key: str, user_id: int | None, level: int = INTERACTIVE, max_requests: int | None = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        # Every user who started or attached to the job may read it
+        self.user_ids: set[int] = {user_id} if user_id is not None else set()
+        self.level = level
+        self.max_requests = max_requests
+        self.allowance: RequestAllowance | None = None
+        self.status = 'pending'
+        self.result: Any = None
+        self.error: str | None = None
+        self.exception: Exception | None = None
+        self.created_at: datetime = now()
+        self.finished_at: datetime | None = None
+        self.future: concurrent.futures.Future | None = None
+        # Progress published while running, kept so late listeners can catch up
+        self.events: list[tuple[str, Any]] = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def readable_by(self, user_id: int | None) -> bool:
+        return user_id in self.user_ids
+
+    def publish(self, event: str, data: Any):
+        with self._cond:
+            self.events.append((event, data))
+            self._cond.notify_all()
+
+    def iter_events(self, poll: float = 1.0) -> Iterator[tuple[str, Any]]:
+        """Yield the events published so far, then each new one as it comes, until the job finishes
+
+        Args:
+            poll (float, optional): Seconds between checks of the job status. Defaults to 1.0.
+
+        Yields:
+            tuple[str, Any]: Name and data of the event
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.events) > sent or self.finished, timeout=poll)
+                events = self.events[sent:]
+                finished = self.finished
+            yield from events
+            sent += len(events)
+            if finished:
+                return
+
+    async def aiter_events(self, poll: float = 0.25) -> AsyncIterator[tuple[str, Any]]:
+        """Async counterpart of `iter_events`, polling so no thread is held while waiting
+
+        Args:
+            poll (float, optional): Seconds between checks for new events. Defaults to 0.25.
+
+        Yields:
+            tuple[str, Any]: Name and data of the event
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                events = self.events[sent:]
+                finished = self.finished
+            for event in events:
+                yield event
+            sent += len(events)
+            if finished:
+                return
+            if not events:
+                await asyncio.sleep(poll)
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Block until the job finishes
+
+        Args:
+            timeout (float | None, optional): Most seconds to wait. Defaults to None.
+
+        Returns:
+            bool: Whether the job finished
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    async def wait(self):
+        """Wait for the job to finish without blocking the event loop"""
+        while self.future is not None and not self.finished:
+            future = self.future
+            try:
+                # Shielded, a caller going away must not cancel the job for everyone attached to it
+                await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Moved to the interactive pool before it started, wait on its new future
+
+    def run(self, fn: Callable, *args, **kwargs):
+        self.status = 'running'
+        token = _current_job.set(self)
+        try:
+            with priority(self.level), allowance(self.max_requests) as self.allowance:
+                self.result = fn(*args, **kwargs)
+            self.status = 'done'
+        except Exception as e:
+            print(f"Job {self.key} failed: {e}")
+            self.error = str(e)
+            self.exception = e
+            self.status = 'failed'
+        finally:
+            _current_job.reset(token)
+            self.finished_at = now()
+            with self._cond:
+                self._cond.notify_all()
+            # Worker threads get their own database connections, don't leave them open
+            connections.close_all()
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class RefreshJobManager:
+    """Runs refresh jobs on bounded thread pools, one for interactive jobs and one for background ones, at most one
+    unfinished job per key"""
+
+    def __init__(self, interactive_workers: int, background_workers: int, keep_for: float):
+        self.keep_for = keep_for
+        self._executors = {
+            INTERACTIVE: concurrent.futures.ThreadPoolExecutor(max_workers=interactive_workers, thread_name_prefix='build'),
+            BACKGROUND: concurrent.futures.ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix='refresh'),
+        }
+        self._jobs: dict[str, RefreshJob] = {}
+        self._active: dict[str, RefreshJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn: Callable, *args, user_id: int | None = None, level: int = INTERACTIVE,
+               max_requests: int | None = None, **kwargs) -> RefreshJob:
+        """Start a job, or attach to the unfinished job with the same key
+
+        A background job still queued is moved to the interactive pool when an interactive job attaches to it.
+
+        Args:
+            key (str): Key identifying what is being refreshed
+            fn (Callable): Function to run, its return value becomes the job result
+            user_id (int | None, optional): User allowed to read the job, added to a running job's users. Defaults to None.
+            level (int, optional): Priority of the job's GitHub requests, and pool it runs on. Defaults to INTERACTIVE.
+            max_requests (int | None, optional): Most GitHub requests a new job may make, lifted when a caller
+                without a cap attaches to it. Defaults to None.
+
+        Returns:
+            RefreshJob: The new or already running job
+        """
+        self.prune()
+        with self._lock:
+            job = self._active.get(key)
+            if job and not job.finished:
+                if user_id is not None:
+                    job.user_ids.add(user_id)
+                if level < job.level and job.future.cancel():
+                    job.level, job.max_requests = level, max_requests
+                    job.future = self._executors[level].submit(job.run, fn, *args, **kwargs)
+                elif max_requests is None and job.allowance is not None:
+                    # Already running, a capped background build must not fail the caller midway
+                    job.allowance.lift()
+                return job
+            job = RefreshJob(key, user_id, level, max_requests)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            job.future = self._executors[level].submit(job.run, fn, *args, **kwargs)
+        return job
+
+    def get(self, job_id: str) -> RefreshJob | None:
+        """Get a job by id
+
+        Args:
+            job_id (str): Id of the job
+
+        Returns:
+            RefreshJob | None: The job, None if unknown or already pruned
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def prune(self):
+        """Forget finished jobs older than `keep_for` seconds"""
+        cutoff = now().timestamp() - self.keep_for
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished and job.finished_at.timestamp() < cutoff:
+                    del self._jobs[job_id]
+                    if self._active.get(job.key) is job:
+                        del self._active[job.key]
+
+
+JOBS = RefreshJobManager(settings.BUILD_WORKERS, settings.REFRESH_WORKERS, settings.REFRESH_JOB_KEEP)
@@ -0,0 +1,74 @@
+from pathlib import Path
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import settings
+from home.benchmarks import SIZES, compare, run_benchmarks
+
+# Recorded with --save-baseline, `meta.machine` tells which machine it is comparable on
+BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+
+class Command(BaseCommand):
+    help = "Time the ingest, cache and serve hot paths against a local fake GitHub API, and compare with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Runs of each benchmark")
+        parser.add_argument('--sizes', default=','.join(str(x) for x in SIZES.values()),
+                            help="Commits of the small, medium and huge repos built")
+        parser.add_argument('--latency', type=float, default=0, help="Seconds the fake API adds to every answer")
+        parser.add_argument('--output', default=None, help="Write the results as JSON to this file, - for stdout")
+        parser.add_argument('--baseline', default=str(BASELINE), help="Results to compare with, or to save as the baseline")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Relative slowdown of a median over which the command fails, e.g. 0.25 for 25%%")
+        parser.add_argument('--min-delta', type=float, default=0.002,
+                            help="Seconds of slowdown of a median under which the command never fails")
+        parser.add_argument('--save-baseline', action='store_true', help="Store the results as the new baseline")
+
+    def handle(self, *args, **options):
+        sizes = dict(zip(SIZES, (int(x) for x in options['sizes'].split(','))))
+
+        # Benchmarks write rows, keep them out of the real database
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(options['repeat'], sizes, options['latency'], log=self.stderr.write)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        encoded = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(encoded)
+        elif options['output']:
+            Path(options['output']).write_text(encoded + '\n')
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(encoded + '\n')
+            self.stderr.write(f"Baseline saved to {baseline_path}")
+
+        if not baseline_path.exists() or options['save_baseline']:
+            for name, result in results['results'].items():
+                self.stderr.write(f"{name:32} {result['median'] * 1000:10.2f}ms")
+            return
+
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get('meta', {}).get('sizes') != results['meta']['sizes']:
+            self.stderr.write(f"Baseline repos have other sizes {baseline.get('meta', {}).get('sizes')}, builds are not comparable")
+        same_machine = baseline.get('meta', {}).get('machine') == results['meta']['machine']
+        if not same_machine:
+            self.stderr.write(f"Baseline recorded on {baseline.get('meta', {}).get('machine')}, this is "
+                              f"{results['meta']['machine']}, regressions are shown but don't fail the run")
+        rows = compare(results, baseline, options['threshold'], options['min_delta'])
+        for row in rows:
+            flag = 'REGRESSED' if row['regressed'] else ''
+            self.stderr.write(f"{row['name']:32} {row['baseline'] * 1000:10.2f}ms -> {row['median'] * 1000:10.2f}ms "
+                              f"{row['ratio']:6.2f}x {flag}")
+        regressed = [x['name'] for x in rows if x['regressed']]
+        if regressed and same_machine:
+            raise CommandError(f"{len(regressed)} benchmarks regressed over {options['threshold']:.0%}: {', '.join(regressed)}")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from home.fake_github import FakeGitHub
+
+
+class Command(BaseCommand):
+    help = "Serve a local fake of the GitHub REST API with synthetic data, for offline load and latency testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--repos', type=int, default=20, help="Repositories of the fake user")
+        parser.add_argument('--commits', default='100',
+                            help="Commits per repository, a comma separated list is cycled through, e.g. 10,1000,100000")
+        parser.add_argument('--contributors', type=int, default=5, help="Commit authors per repository")
+        parser.add_argument('--branches', type=int, default=3, help="Branches per repository")
+        parser.add_argument('--pulls', type=int, default=5, help="Open pull requests per repository")
+        parser.add_argument('--collaborators', type=int, default=3, help="Collaborators per repository")
+        parser.add_argument('--followers', type=int, default=10, help="Followers of the fake user")
+        parser.add_argument('--latency', type=float, default=0, help="Seconds added to every answer")
+        parser.add_argument('--stats-202', type=int, default=1, help="202 answers of each statistics endpoint first")
+        parser.add_argument('--rate-limit', type=int, default=5000, help="Requests per token per window")
+        parser.add_argument('--rate-window', type=float, default=3600, help="Seconds before a token's budget resets")
+        parser.add_argument('--verbose', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        fake = FakeGitHub(
+            repos=options['repos'], commits=tuple(int(x) for x in options['commits'].split(',')),
+            contributors=options['contributors'], branches=options['branches'], pulls=options['pulls'],
+            collaborators=options['collaborators'], followers=options['followers'], latency=options['latency'],
+            stats_202=options['stats_202'], rate_limit=options['rate_limit'], rate_window=options['rate_window'])
+        server = fake.serve(options['host'], options['port'], options['verbose'])
+        self.stdout.write(f"Fake GitHub API on {fake.base_url}, run the app with GITHUB_API_URL={fake.base_url} "
+                          f"and any CURRENT_TOKEN")
+        self.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import settings
+from home.profiles import refresh_profiles
+
+
+class Command(BaseCommand):
+    help = "Refetch the stored profiles of users with a live session, e.g. from cron instead of the in-process refresher"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=float,
+                            default=max(0, settings.PROFILE_SNAPSHOT_TTL - settings.PROFILE_REFRESH_INTERVAL),
+                            help="Seconds after which a stored profile is refetched")
+        parser.add_argument('--limit', type=int, default=None, help="Most profiles to refetch")
+
+    def handle(self, *args, **options):
+        stats = refresh_profiles(options['max_age'], options['limit'])
+        self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
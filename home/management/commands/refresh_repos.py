@@ -0,0 +1,61 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from core import settings
+from home.profiles import session_tokens
+from home.refresh import latency_stats, refresh_rows, stale_repositories
+
+
+class Command(BaseCommand):
+    help = ("Rebuild stale cached repositories, e.g. from cron so users don't wait on cold builds. Web workers serve "
+            "the rebuilt rows once their cached payloads are stale, or right away with a shared CACHE_BACKEND")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=settings.CACHE_INVALIDATE,
+                            help="Only repos cached more than this many seconds ago")
+        parser.add_argument('--owner', action='append', default=[], help="Only repos of this owner, can be repeated")
+        parser.add_argument('--active-days', type=float, default=None,
+                            help="Only repos updated on GitHub within this many days")
+        parser.add_argument('--limit', type=int, default=None, help="Most repos to rebuild")
+        parser.add_argument('--workers', type=int, default=settings.REFRESH_WORKERS, help="Concurrent builds")
+        parser.add_argument('--processes', action='store_true', help="Build in processes instead of threads")
+        parser.add_argument('--batch-size', type=int, default=50, help="Rows saved per bulk upsert")
+        parser.add_argument('--min-remaining', type=int, default=settings.RATE_LIMIT_RESERVE,
+                            help="Stop building with a token once GitHub reports this many requests left for it")
+        parser.add_argument('--token', default=None,
+                            help="Token for every repo, by default the token of a live session of the user who built "
+                                 "the repo, or CURRENT_TOKEN")
+
+    def handle(self, *args, **options):
+        rows = list(stale_repositories(options['older_than'], options['owner'], options['active_days'], options['limit']))
+        if options['token']:
+            tokens = dict.fromkeys({x.user_id for x in rows}, options['token'])
+        else:
+            tokens = session_tokens()
+            if settings.CURRENT_TOKEN:
+                tokens = {**dict.fromkeys({x.user_id for x in rows}, settings.CURRENT_TOKEN), **tokens}
+        self.stdout.write(f"Refreshing {len(rows)} repos with {options['workers']} "
+                          f"{'processes' if options['processes'] else 'threads'}")
+
+        stats = dict.fromkeys(('refreshed', 'failed', 'deferred', 'skipped'), 0)
+        seconds = []
+        started = perf_counter()
+        for result in refresh_rows(rows, tokens, options['workers'], options['processes'], options['min_remaining'],
+                                   options['batch_size']):
+            if result.get('skipped'):
+                stats['skipped'] += 1
+            elif result['row'] is not None:
+                stats['refreshed'] += 1
+                seconds.append(result['seconds'])
+            elif result['deferred']:
+                stats['deferred'] += 1
+            else:
+                stats['failed'] += 1
+                self.stderr.write(f"Repo {result['id']} failed: {result['error']}")
+        elapsed = perf_counter() - started
+
+        latency = latency_stats(seconds)
+        self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+        self.stdout.write(f"elapsed={elapsed:.1f}s throughput={stats['refreshed'] / elapsed if elapsed else 0:.2f} repos/s "
+                          f"latency p50={latency['p50']:.2f}s p95={latency['p95']:.2f}s max={latency['max']:.2f}s")
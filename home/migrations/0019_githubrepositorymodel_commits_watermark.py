@@ -0,0 +1,18 @@
+# Generated by Django 4.1.12 on 2026-10-17 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_githubrepositorymodel_private'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='githubrepositorymodel',
+            name='commits_watermark',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.12 on 2026-10-17 07:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def reset_watermarks(apps, schema_editor):
+    # The old commits blob has no shas to move into the new table, resync every repo from scratch
+    apps.get_model('home', 'GitHubRepositoryModel').objects.update(commits_watermark={})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0019_githubrepositorymodel_commits_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='githubrepositorymodel',
+            name='commits',
+        ),
+        migrations.CreateModel(
+            name='GitHubCommitModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.CharField(max_length=255)),
+                ('sha', models.CharField(max_length=40)),
+                ('timestamp', models.BigIntegerField()),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commit_set', to='home.githubrepositorymodel')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='githubcommitmodel',
+            index=models.Index(fields=['repo', 'timestamp'], name='home_github_repo_id_0ec24d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='githubcommitmodel',
+            index=models.Index(fields=['repo', 'author', 'timestamp'], name='home_github_repo_id_4ae9dd_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='githubcommitmodel',
+            constraint=models.UniqueConstraint(fields=('repo', 'sha'), name='unique_repo_commit'),
+        ),
+    ]
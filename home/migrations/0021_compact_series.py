@@ -0,0 +1,51 @@
+# Generated by Django 4.1.12 on 2026-10-17 07:42
+
+from django.db import migrations
+import home.fields
+
+
+def encode_series(apps, schema_editor):
+    GitHubRepositoryModel = apps.get_model('home', 'GitHubRepositoryModel')
+    for repo in GitHubRepositoryModel.objects.only('id', 'commit_activity', 'code_freq').iterator():
+        repo.commit_activity_compact = repo.commit_activity or []
+        repo.code_freq_compact = repo.code_freq or []
+        repo.save(update_fields=['commit_activity_compact', 'code_freq_compact'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0020_remove_githubrepositorymodel_commits_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='githubrepositorymodel',
+            name='code_freq_compact',
+            field=home.fields.CompactSeriesField(default=list, layout='code_freq'),
+        ),
+        migrations.AddField(
+            model_name='githubrepositorymodel',
+            name='commit_activity_compact',
+            field=home.fields.CompactSeriesField(default=list, layout='commit_activity'),
+        ),
+        migrations.RunPython(encode_series, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='githubrepositorymodel',
+            name='code_freq',
+        ),
+        migrations.RemoveField(
+            model_name='githubrepositorymodel',
+            name='commit_activity',
+        ),
+        migrations.RenameField(
+            model_name='githubrepositorymodel',
+            old_name='code_freq_compact',
+            new_name='code_freq',
+        ),
+        migrations.RenameField(
+            model_name='githubrepositorymodel',
+            old_name='commit_activity_compact',
+            new_name='commit_activity',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.12 on 2026-10-17 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0021_compact_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitHubRepositoryLockModel',
+            fields=[
+                ('key', models.CharField(max_length=600, primary_key=True, serialize=False)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
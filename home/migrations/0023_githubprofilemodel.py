@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-17 07:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0022_githubrepositorylockmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitHubProfileModel',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('login', models.CharField(max_length=255)),
+                ('cached_at', models.DateTimeField()),
+                ('profile', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GitHubProfileRepositoryModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('repo_id', models.BigIntegerField()),
+                ('data', models.JSONField(default=dict)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='repo_set', to='home.githubprofilemodel')),
+            ],
+            options={
+                'ordering': ['position'],
+                'indexes': [models.Index(fields=['profile', 'position'], name='home_github_profile_13a157_idx')],
+            },
+        ),
+    ]
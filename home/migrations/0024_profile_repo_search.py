@@ -0,0 +1,46 @@
+# Generated by Django 4.2.16 on 2026-10-17 08:00
+
+from django.db import migrations, models
+
+
+def fill_search_fields(apps, schema_editor):
+    GitHubProfileRepositoryModel = apps.get_model('home', 'GitHubProfileRepositoryModel')
+    for repo in GitHubProfileRepositoryModel.objects.only('id', 'data').iterator():
+        repo.name = (repo.data.get('name') or '').lower()
+        repo.full_name = (repo.data.get('full_name') or '').lower()
+        repo.description = (repo.data.get('description') or '').lower()
+        repo.save(update_fields=['name', 'full_name', 'description'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0023_githubprofilemodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='githubprofilerepositorymodel',
+            name='description',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='githubprofilerepositorymodel',
+            name='full_name',
+            field=models.CharField(default='', max_length=512),
+        ),
+        migrations.AddField(
+            model_name='githubprofilerepositorymodel',
+            name='name',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(fill_search_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='githubprofilerepositorymodel',
+            index=models.Index(fields=['profile', 'name'], name='home_github_profile_78259e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='githubprofilerepositorymodel',
+            index=models.Index(fields=['profile', 'full_name'], name='home_github_profile_0671cf_idx'),
+        ),
+    ]
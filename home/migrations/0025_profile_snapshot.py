@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-17 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0024_profile_repo_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='githubprofilemodel',
+            name='last_login',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='githubprofilemodel',
+            name='token_digest',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-17 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0025_profile_snapshot'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='githubprofilerepositorymodel',
+            name='home_github_profile_78259e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='githubprofilerepositorymodel',
+            name='home_github_profile_0671cf_idx',
+        ),
+        migrations.RemoveField(
+            model_name='githubprofilerepositorymodel',
+            name='description',
+        ),
+        migrations.AddIndex(
+            model_name='githubprofilerepositorymodel',
+            index=models.Index(fields=['profile', 'name'], name='home_profile_repo_name_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='githubprofilerepositorymodel',
+            index=models.Index(fields=['profile', 'full_name'], name='home_profile_repo_full_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+    ]
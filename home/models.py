@@ -1,16 +1,16 @@
 from datetime import datetime
 import json
-from time import sleep
-from typing import Callable
+from time import sleep, time
+from typing import Any, Callable
 import concurrent.futures
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils.timezone import make_aware, now, utc
 
-from github3 import GitHub, login
+from github3 import GitHub
 import github3
-from github3.exceptions import ForbiddenError
+from github3.exceptions import ForbiddenError, GitHubError
 from github3.users import AuthenticatedUser
 from github3.users import ShortUser
 from github3.events import Event
@@ -18,7 +18,12 @@ from github3.repos import Repository
 from github3.repos.branch import Branch
 from github3.structs import GitHubIterator
 
-from .github_api import str_short_user, str_short_pull_request
+from core import settings
+
+from .fields import CompactSeriesField
+from .ratelimit import ContextExecutor
+from .github_api import fetch_pages, str_short_user, str_short_pull_request
+from .github_graphql import fetch_repository_graphql
 
 
 def get_gh_datetime(dt: str | datetime | None) -> datetime:
@@ -33,17 +38,119 @@ def get_gh_datetime(dt: str | datetime | None) -> datetime:
 
 
 def iter_long(gi: Callable, *args, **kwargs) -> list:
+    """Evaluate a statistics listing, retrying with exponential backoff while GitHub answers 202
+
+    Args:
+        gi (Callable): Function returning the listing iterator
+
+    Returns:
+        list: Items of the listing, empty if GitHub was still computing it after `settings.STATS_MAX_WAIT` seconds
+    """
+    delay, waited = 1, 0
     it = gi(*args, **kwargs)
     fnl = list(it)
     while it.last_status == 202:
-        print('Waiting for 202')
-        sleep(3)  # IMPROVE: sleeping
+        if waited >= settings.STATS_MAX_WAIT:
+            print(f'Gave up waiting for 202 after {waited}s')
+            return []
+        print(f'Waiting {delay}s for 202')
+        sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 30)
         it = gi(*args, **kwargs)
         fnl = list(it)
     # print(fnl)
     return fnl
 
 
+def commits_since(repo: Repository, base: str, head: str) -> list[dict[str, Any]] | None:
+    """List the commits reachable from `head` but not from `base`, including older ones brought in by a merge
+
+    Args:
+        repo (Repository): The repository to compare in
+        base (str): Sha of the head seen at the last sync
+        head (str): Sha of the current head
+
+    Returns:
+        list[dict[str, Any]] | None: Raw commits, None if `base` is no longer an ancestor of `head`, i.e. history was
+        force-pushed, or if there are more commits than GitHub lists in a comparison
+    """
+    try:
+        comparison = repo.compare_commits(base, head)
+    except GitHubError as e:
+        print(e)
+        return None
+    if comparison is None or comparison.status not in ('ahead', 'identical'):
+        return None
+    if comparison.total_commits > len(comparison.original_commits):
+        return None
+    return [x.as_dict() for x in comparison.original_commits]
+
+
+def commit_author(commit: dict[str, Any]) -> str:
+    """Get the login of a raw commit's author, or their git name if they have no GitHub account
+
+    Args:
+        commit (dict[str, Any]): Commit as returned by the API
+
+    Returns:
+        str: Author login or name
+    """
+    if commit.get('author'):
+        return commit['author']['login']
+    return commit['commit']['author']['name']
+
+
+def sync_commits(repo: Repository, watermark: dict[str, Any]) -> tuple[list[tuple[str, str, int]], dict[str, Any], bool]:
+    """Fetch only the commits added to the default branch since the last sync
+
+    The watermark is the sha of the branch's head at the last sync, and the commits reachable from the current head
+    but not from it are the new ones, whatever their dates. The whole history is walked again if there is no watermark
+    yet, history was rewritten since, or the last full walk is `settings.COMMITS_FULL_SYNC` seconds old.
+
+    Args:
+        repo (Repository): The repository to sync
+        watermark (dict[str, Any]): Head sha of the last sync and epoch of the last full walk
+
+    Returns:
+        tuple[list[tuple[str, str, int]], dict[str, Any], bool]: New commits as (author, sha, timestamp), updated
+        watermark, and whether the commits already stored must be replaced
+    """
+    try:
+        head = repo.branch(repo.default_branch).commit.sha
+    except GitHubError as e:  # Empty git repository
+        print(e)
+        return [], watermark, False
+    if head == watermark.get('head'):
+        return [], watermark, False
+
+    history = None
+    if watermark.get('head') and time() - watermark.get('full_sync', 0) < settings.COMMITS_FULL_SYNC:
+        history = commits_since(repo, watermark['head'], head)
+        if history is None:
+            print(f"History of {repo.full_name} was rewritten, resyncing commits")
+    resync = history is None
+    if resync:
+        history = fetch_pages(repo.session, repo._build_url('commits', base_url=repo._api), {'sha': head}, settings.COMMIT_PAGE_WORKERS)
+        watermark = {'full_sync': int(time())}
+
+    new = [(commit_author(x), x['sha'], int(get_gh_datetime(x['commit']['committer']['date']).timestamp())) for x in history]
+    return new, {**watermark, 'head': head}, resync
+
+
+# Parts of a repository that are fetched separately, and the keys of `GitHubRepositoryModel.dump` they fill
+SECTIONS = {
+    'metadata': ('id', 'cached_at', 'owner', 'private', 'name', 'full_name', 'description', 'created_at', 'updated_at',
+                 'homepage', 'language', 'archived', 'forks_count', 'open_issues_count', 'watchers_count', 'url'),
+    'branches': ('branches', 'branch_count'),
+    'pull_requests': ('pull_requests', 'pull_requests_count'),
+    'collaborators': ('collaborators', 'collaborators_access'),
+    'commit_activity': ('commit_activity',),
+    'code_freq': ('code_freq',),
+    'commits': ('commits', 'commit_stats'),
+}
+
+
 class GitHubRepositoryModel(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     id = models.IntegerField(primary_key=True)  # IMPROVE: Only works in context of GitHub
@@ -66,61 +173,30 @@ class GitHubRepositoryModel(models.Model):
     url = models.URLField()
     collaborators = models.JSONField(default=list)
     collaborators_access = models.BooleanField(default=False)
-    commit_activity = models.JSONField(default=list)
-    commits = models.JSONField(default=list)
-    code_freq = models.JSONField(default=list)
+    commit_activity = CompactSeriesField(layout='commit_activity', default=list)
+    code_freq = CompactSeriesField(layout='code_freq', default=list)
     branches = models.JSONField(default=list)
     branch_count = models.IntegerField(default=1)
+    commits_watermark = models.JSONField(default=dict)
 
     def __init__(self,  usr: User, _id=None, cached_at=None, owner=None, private=None, name=None, full_name=None, description=None, created_at=None, updated_at=None, homepage=None,
                  language=None, archived=None, forks_count=None, open_issues_count=None, pull_requests_count=None, pull_requests=None, watchers_count=None, url=None, collaborators=None, collaborators_access=None, commit_activity=None,
-                 commits=None, code_freq=None, branches=None, branch_count=None, repo: Repository | None = None):
+                 code_freq=None, branches=None, branch_count=None, commits_watermark=None, repo: Repository | None = None,
+                 previous: 'GitHubRepositoryModel | None' = None, on_section: Callable[[str, dict[str, Any]], None] | None = None):
         super().__init__()
+        # Commits fetched but not stored yet, and whether they replace the stored ones
+        self.pending_commits: list[tuple[str, str, int]] = []
+        self.resync_commits = False
         if isinstance(usr, User):
             self.user = usr
+        elif usr is not None:
+            # Rows loaded from the database are built with their field values in order, the first being user_id
+            self.user_id = usr
 
         if repo:
-
-            owner = str_short_user(repo.owner)
-
-            def get_colabs():
-                try:
-                    collaborators = [str_short_user(x) for x in repo.collaborators()]
-                    return collaborators, True
-                except ForbiddenError as fe:
-                    collaborators = []
-                    print(fe)
-                    return collaborators, False
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                # Submit the tasks to the executor
-                future1 = executor.submit(iter_long, repo.commit_activity)
-                future2 = executor.submit(iter_long, repo.code_frequency)
-                future3 = executor.submit(get_colabs)
-                future4 = executor.submit(repo.pull_requests, state='open', sort='updated')
-
-                # Wait for all tasks to complete
-                concurrent.futures.wait([future3])
-                collaborators, collaborators_access = future3.result()
-
-                commits = {}
-                for usr in collaborators + [owner]:
-                    commits[usr['login']] = [int(get_gh_datetime(x.commit.committer['date']).timestamp())
-                                             for x in repo.commits(author=usr['login'])]
-                    sleep(1)
-
-                concurrent.futures.wait([future1, future2, future4])
-
-                # Retrieve results
-                commit_activity = future1.result()
-                code_frequency = future2.result()
-                pull_requests = [str_short_pull_request(x) for x in future4.result()]
-                pull_requests_count = len(pull_requests)
-
-            # print('\n'.join(f'{key}: {len(array)}' for key, array in commits.items()))
             self.id = repo.id
             self.cached_at = now()
-            self.owner = owner
+            self.owner = str_short_user(repo.owner)
             self.private = bool(repo.private)
             self.name = repo.name
             self.full_name = repo.full_name
@@ -132,17 +208,62 @@ class GitHubRepositoryModel(models.Model):
             self.archived = bool(repo.archived)
             self.forks_count = int(repo.forks_count)
             self.open_issues_count = int(repo.open_issues_count)
-            self.pull_requests_count = int(pull_requests_count)
-            self.pull_requests = pull_requests
             self.watchers_count = int(repo.watchers_count)
             self.url = str(repo.html_url)
-            self.collaborators = collaborators
-            self.collaborators_access = collaborators_access
-            self.commit_activity = commit_activity
-            self.commits = commits
-            self.code_freq = code_frequency
-            self.branches = [x.name for x in repo.branches()]
-            self.branch_count = len(self.branches)
+            if on_section:
+                on_section('metadata', self.dump_section('metadata'))
+
+            def get_colabs():
+                try:
+                    collaborators = [str_short_user(x) for x in repo.collaborators()]
+                    return collaborators, True
+                except ForbiddenError as fe:
+                    collaborators = []
+                    print(fe)
+                    return collaborators, False
+
+            with ContextExecutor(max_workers=6) as executor:
+                futures = {
+                    executor.submit(iter_long, repo.commit_activity): 'commit_activity',
+                    executor.submit(iter_long, repo.code_frequency): 'code_freq',
+                    # Only fetch commits newer than what the previous cached row already has
+                    executor.submit(sync_commits, repo, previous.commits_watermark if previous else {}): 'commits',
+                }
+                if settings.GITHUB_GRAPHQL:
+                    futures[executor.submit(fetch_repository_graphql, repo.session, self.owner['login'], repo.name)] = 'graphql'
+                else:
+                    futures[executor.submit(get_colabs)] = 'collaborators'
+                    futures[executor.submit(repo.pull_requests, state='open', sort='updated')] = 'pull_requests'
+                    futures[executor.submit(lambda: [x.name for x in repo.branches()])] = 'branches'
+
+                # Store each section as soon as it is fetched
+                for future in concurrent.futures.as_completed(futures):
+                    section = futures[future]
+                    if section == 'graphql':
+                        for key, value in future.result().items():
+                            setattr(self, key, value)
+                        if on_section:
+                            for section in ('branches', 'collaborators', 'pull_requests'):
+                                on_section(section, self.dump_section(section))
+                        continue
+                    if section == 'commit_activity':
+                        self.commit_activity = future.result()
+                    elif section == 'code_freq':
+                        self.code_freq = future.result()
+                    elif section == 'collaborators':
+                        self.collaborators, self.collaborators_access = future.result()
+                    elif section == 'pull_requests':
+                        self.pull_requests = [str_short_pull_request(x) for x in future.result()]
+                        self.pull_requests_count = len(self.pull_requests)
+                    elif section == 'commits':
+                        self.pending_commits, self.commits_watermark, self.resync_commits = future.result()
+                        if previous and not self.resync_commits:
+                            continue  # Only the new commits are known until saved
+                    elif section == 'branches':
+                        self.branches = future.result()
+                        self.branch_count = len(self.branches)
+                    if on_section:
+                        on_section(section, self.dump_section(section))
         else:
             self.id = _id
             self.cached_at = cached_at
@@ -165,12 +286,70 @@ class GitHubRepositoryModel(models.Model):
             self.collaborators = collaborators
             self.collaborators_access = collaborators_access
             self.commit_activity = commit_activity
-            self.commits = commits
             self.code_freq = code_freq
             self.branches = branches
             self.branch_count = branch_count
+            self.commits_watermark = commits_watermark
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.resync_commits:
+                self.commit_set.all().delete()
+            GitHubCommitModel.objects.bulk_create(
+                [GitHubCommitModel(repo=self, author=author, sha=sha, timestamp=timestamp) for author, sha, timestamp in self.pending_commits],
+                batch_size=1000, ignore_conflicts=True)
+        self.pending_commits = []
+        self.resync_commits = False
+
+    def commit_timestamps(self, start: int | None = None, end: int | None = None, author: str | None = None) -> dict[str, list[int]]:
+        """Get commit timestamps grouped by author, newest first
+
+        Args:
+            start (int | None, optional): Earliest epoch to include. Defaults to None.
+            end (int | None, optional): Latest epoch to include. Defaults to None.
+            author (str | None, optional): Only include this author. Defaults to None.
 
-    def dump(self):
+        Returns:
+            dict[str, list[int]]: Commit timestamps per author
+        """
+        if self._state.adding:  # Never stored, e.g. no database connected
+            commits = {}
+            for login, _, timestamp in sorted(self.pending_commits, key=lambda x: x[2], reverse=True):
+                if (start is None or timestamp >= start) and (end is None or timestamp <= end) and author in (None, login):
+                    commits.setdefault(login, []).append(timestamp)
+            return commits
+        return self.commit_set.in_range(start, end).by_author(author).timestamps_by_author()
+
+    def commit_stats(self) -> dict[str, dict[str, int]]:
+        """Get the commit count and latest commit epoch of each author
+
+        Returns:
+            dict[str, dict[str, int]]: Commit count and latest commit per author
+        """
+        if self._state.adding:
+            return {login: {'count': len(x), 'last': x[0]} for login, x in self.commit_timestamps().items()}
+        return self.commit_set.stats_by_author()
+
+    def dump_section(self, section: str, commits_since: int | None = None) -> dict[str, Any]:
+        """Get the part of `dump` making up one section of the repository
+
+        Args:
+            section (str): One of `SECTIONS`
+            commits_since (int | None, optional): Earliest commit epoch to include. Defaults to COMMITS_WINDOW ago.
+
+        Returns:
+            dict[str, Any]: The section's keys of `dump`
+        """
+        if section == 'commits':
+            if commits_since is None:
+                commits_since = int(now().timestamp()) - settings.COMMITS_WINDOW
+            return {'commits': self.commit_timestamps(start=commits_since), 'commit_stats': self.commit_stats()}
+        return {key: getattr(self, key) for key in SECTIONS[section]}
+
+    def dump(self, commits_since: int | None = None):
+        if commits_since is None:
+            commits_since = int(now().timestamp()) - settings.COMMITS_WINDOW
         return {
             "id": self.id,
             "cached_at": self.cached_at,
@@ -193,7 +372,8 @@ class GitHubRepositoryModel(models.Model):
             "collaborators": self.collaborators,
             "collaborators_access": self.collaborators_access,
             "commit_activity": self.commit_activity,
-            "commits": self.commits,
+            "commits": self.commit_timestamps(start=commits_since),
+            "commit_stats": self.commit_stats(),
             "code_freq": self.code_freq,
             "branches": self.branches,
             "branch_count": self.branch_count,
@@ -201,3 +381,106 @@ class GitHubRepositoryModel(models.Model):
 
     def __str__(self):
         return str(self.name)
+
+
+class GitHubCommitQuerySet(models.QuerySet):
+    def in_range(self, start: int | None = None, end: int | None = None) -> 'GitHubCommitQuerySet':
+        """Commits between two epochs, inclusive"""
+        qs = self
+        if start is not None:
+            qs = qs.filter(timestamp__gte=start)
+        if end is not None:
+            qs = qs.filter(timestamp__lte=end)
+        return qs
+
+    def by_author(self, author: str | None) -> 'GitHubCommitQuerySet':
+        """Commits of a single author, or every author if None"""
+        return self.filter(author=author) if author is not None else self
+
+    def timestamps_by_author(self) -> dict[str, list[int]]:
+        """Commit timestamps grouped by author, newest first"""
+        commits = {}
+        for author, timestamp in self.order_by('-timestamp').values_list('author', 'timestamp'):
+            commits.setdefault(author, []).append(timestamp)
+        return commits
+
+    def stats_by_author(self) -> dict[str, dict[str, int]]:
+        """Commit count and latest commit epoch of each author"""
+        rows = self.values('author').annotate(count=models.Count('id'), last=models.Max('timestamp'))
+        return {x['author']: {'count': x['count'], 'last': x['last']} for x in rows}
+
+
+class GitHubCommitModel(models.Model):
+    repo = models.ForeignKey(GitHubRepositoryModel, on_delete=models.CASCADE, related_name='commit_set')
+    author = models.CharField(max_length=255)
+    sha = models.CharField(max_length=40)
+    timestamp = models.BigIntegerField()
+
+    objects = GitHubCommitQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['repo', 'timestamp']),
+            models.Index(fields=['repo', 'author', 'timestamp']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['repo', 'sha'], name='unique_repo_commit'),
+        ]
+
+    def __str__(self):
+        return str(self.sha)
+
+
+class GitHubRepositoryLockModel(models.Model):
+    """Lock row held by the worker building a repository, so other workers wait for it instead of building it too"""
+    key = models.CharField(max_length=600, primary_key=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return str(self.key)
+
+
+class GitHubProfileModel(models.Model):
+    """Profile of a user as `request_profile` returns it, stored apart from the session
+
+    The repository list, which can run into thousands for org members, is kept in `GitHubProfileRepositoryModel` rows
+    and served a page at a time. The row is the snapshot logins are served from while younger than
+    PROFILE_SNAPSHOT_TTL and complete, `token_digest` is the token of the user's last login.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    login = models.CharField(max_length=255)
+    cached_at = models.DateTimeField()
+    last_login = models.DateTimeField(null=True, blank=True)
+    token_digest = models.CharField(max_length=64, default='', blank=True, db_index=True)
+    profile = models.JSONField(default=dict)
+
+    def dump(self) -> dict[str, Any]:
+        return {**self.profile, 'cached_at': self.cached_at}
+
+    def __str__(self):
+        return str(self.login)
+
+
+class GitHubProfileRepositoryModel(models.Model):
+    """A repository of a stored profile, `name` and `full_name` are lowercased copies for search"""
+    profile = models.ForeignKey(GitHubProfileModel, on_delete=models.CASCADE, related_name='repo_set')
+    position = models.IntegerField()
+    repo_id = models.BigIntegerField()
+    name = models.CharField(max_length=255, default='')
+    full_name = models.CharField(max_length=512, default='')
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        ordering = ['position']
+        indexes = [
+            models.Index(fields=['profile', 'position']),
+            # Pattern operator classes let PostgreSQL serve LIKE 'prefix%' from the index under any collation, other
+            # databases ignore them
+            models.Index(fields=['profile', 'name'], name='home_profile_repo_name_idx',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['profile', 'full_name'], name='home_profile_repo_full_idx',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return str(self.data.get('full_name'))
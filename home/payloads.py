@@ -0,0 +1,190 @@
+"""Repository payloads encoded once per refresh, and served as is in whichever content coding the client accepts
+
+Encoding a large repository to JSON costs far more than sending it, so each payload is encoded and compressed when it
+is built and cached as bytes. orjson and brotli are used when installed.
+"""
+from hashlib import sha256
+from typing import Any
+import gzip
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from core import settings
+
+# Every encoded payload starts with its staleness, so the stale variant is a splice away from the fresh one
+FRESH_PREFIX = b'{"stale":false,'
+STALE_PREFIX = b'{"stale":true,'
+
+CODINGS = ('br', 'gzip', 'identity') if brotli else ('gzip', 'identity')
+
+
+def dumps(data: Any) -> bytes:
+    """Encode to compact JSON, with orjson if installed
+
+    Args:
+        data (Any): Data to encode, may contain datetimes
+
+    Returns:
+        bytes: UTF-8 JSON
+    """
+    if orjson:
+        return orjson.dumps(data, default=DjangoJSONEncoder().default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def compress(body: bytes) -> dict[str, bytes]:
+    """Get a body in every supported content coding
+
+    Args:
+        body (bytes): The identity body
+
+    Returns:
+        dict[str, bytes]: Body per content coding
+    """
+    bodies = {'identity': body, 'gzip': gzip.compress(body, settings.PAYLOAD_GZIP_LEVEL)}
+    if brotli:
+        bodies['br'] = brotli.compress(body, quality=settings.PAYLOAD_BROTLI_QUALITY)
+    return bodies
+
+
+def encode_payload(payload: dict[str, Any]) -> dict[str, Any]:
+    """Encode a payload as returned by `GitHubRepositoryModel.dump`
+
+    Args:
+        payload (dict[str, Any]): The payload
+
+    Returns:
+        dict[str, Any]: The repo's id, full name, privacy, cache time and content hash along with the encoded bodies
+    """
+    body = dumps({'stale': False, **payload})
+    return {
+        'id': payload['id'],
+        'full_name': payload['full_name'],
+        'private': payload['private'],
+        'cached_at': payload['cached_at'],
+        'digest': sha256(body).hexdigest()[:16],
+        'bodies': compress(body),
+    }
+
+
+def stale_bodies(encoded: dict[str, Any]) -> dict[str, bytes]:
+    """Get the bodies of an encoded payload flagged as stale, built on first use and kept with the payload
+
+    Args:
+        encoded (dict[str, Any]): Encoded payload
+
+    Returns:
+        dict[str, bytes]: Body per content coding
+    """
+    if 'stale_bodies' not in encoded:
+        body = encoded['bodies']['identity']
+        encoded['stale_bodies'] = compress(STALE_PREFIX + body[len(FRESH_PREFIX):])
+    return encoded['stale_bodies']
+
+
+def accepted_codings(accept_encoding: str) -> dict[str, float]:
+    """Parse an Accept-Encoding header
+
+    Args:
+        accept_encoding (str): The header
+
+    Returns:
+        dict[str, float]: Quality per content coding
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def negotiate(accept_encoding: str) -> str:
+    """Pick the best content coding a client accepts, smallest first
+
+    Args:
+        accept_encoding (str): The request's Accept-Encoding header
+
+    Returns:
+        str: The content coding
+    """
+    accepted = accepted_codings(accept_encoding)
+    for coding in CODINGS[:-1]:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return 'identity'
+
+
+def payload_etag(encoded: dict[str, Any], stale: bool, coding: str) -> str:
+    """Strong ETag of one representation of an encoded payload, from its cache time and content hash
+
+    Args:
+        encoded (dict[str, Any]): Encoded payload
+        stale (bool): Whether the payload is flagged as stale
+        coding (str): Content coding of the representation
+
+    Returns:
+        str: The quoted ETag
+    """
+    digest = encoded.get('digest') or sha256(encoded['bodies']['identity']).hexdigest()[:16]
+    tag = f"{int(encoded['cached_at'].timestamp())}-{digest}"
+    if stale:
+        tag += '-stale'
+    if coding != 'identity':
+        tag += f'-{coding}'
+    return f'"{tag}"'
+
+
+def payload_response(request, encoded: dict[str, Any], stale: bool = False, status: int = 200) -> HttpResponse:
+    """Serve an encoded payload without re-encoding it
+
+    Responses carry validators and are private to the user, GET requests matching them are answered with a 304.
+
+    Args:
+        request: The request, for its Accept-Encoding and conditional headers
+        encoded (dict[str, Any]): Encoded payload
+        stale (bool, optional): Whether to flag the payload as stale. Defaults to False.
+        status (int, optional): Response status. Defaults to 200.
+
+    Returns:
+        HttpResponse: The response
+    """
+    coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = payload_etag(encoded, stale, coding)
+    last_modified = int(encoded['cached_at'].timestamp())
+
+    response = None
+    if request.method in ('GET', 'HEAD'):
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        bodies = stale_bodies(encoded) if stale else encoded['bodies']
+        response = HttpResponse(bodies[coding], content_type='application/json', status=status)
+        if coding != 'identity':
+            response['Content-Encoding'] = coding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Private data, browsers may keep it but must revalidate before every use
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding', 'Cookie'))
+    return response
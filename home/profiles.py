@@ -0,0 +1,280 @@
+"""Profiles of logged in users, stored in their own tables and cached, the session only holds the profile id
+
+Stored profiles are snapshots logins are served from while fresh. `ProfileRefresher` keeps the ones of users with a
+live session warm in the background, so logging in rarely waits on GitHub.
+"""
+from datetime import timedelta
+from hashlib import sha256
+from time import sleep
+from typing import Any, Iterator
+import threading
+
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.utils import OperationalError
+from django.utils.timezone import now
+
+from core import settings
+
+from .github_api import request_profile
+from .github_graphql import request_profile_graphql
+from .models import GitHubProfileModel, GitHubProfileRepositoryModel
+from .ratelimit import BACKGROUND, RateLimitDeferred, RateLimitExceeded, priority
+
+
+def profile_key(profile_id: int) -> str:
+    return f'profile:{profile_id}'
+
+
+def token_digest(access_token: str) -> str:
+    return sha256(access_token.encode()).hexdigest()
+
+
+def store_profile(profile: dict[str, Any], access_token: str | None = None) -> dict[str, Any]:
+    """Store a profile as returned by `request_profile`, replacing the user's previous one
+
+    Args:
+        profile (dict[str, Any]): The profile, with every repository, `repos` is None if they could not be listed, the
+            stored repositories and the counts made from them are then kept
+        access_token (str | None, optional): Token the profile was fetched with, recorded as the user's last one.
+            Defaults to None.
+
+    Returns:
+        dict[str, Any]: The profile without its repositories, as `get_profile` returns it
+    """
+    repos = profile.get('repos')
+    fields = {key: value for key, value in profile.items() if key != 'repos'}
+
+    with transaction.atomic():
+        if repos is None:
+            # The listing failed or timed out, the repositories stored last time are kept, and what was counted from them
+            fields['repo_count'] = GitHubProfileRepositoryModel.objects.filter(profile_id=profile['id']).count()
+            previous = GitHubProfileModel.objects.filter(id=profile['id']).values_list('profile', flat=True).first() or {}
+            fields.update({key: previous[key] for key in ('repo_priv_count', 'repo_first', 'repo_last') if key in previous})
+        else:
+            fields['repo_count'] = len(repos)
+        defaults = {'login': profile['login'], 'cached_at': now(), 'profile': fields}
+        if access_token:
+            defaults['token_digest'] = token_digest(access_token)
+
+        row, _ = GitHubProfileModel.objects.update_or_create(id=profile['id'], defaults=defaults)
+        if repos is not None:
+            row.repo_set.all().delete()
+            GitHubProfileRepositoryModel.objects.bulk_create(
+                [GitHubProfileRepositoryModel(profile=row, position=i, repo_id=repo['id'], name=(repo.get('name') or '').lower(),
+                                              full_name=(repo.get('full_name') or '').lower(), data=repo)
+                 for i, repo in enumerate(repos)],
+                batch_size=1000)
+
+    dumped = row.dump()
+    caches[settings.REPO_CACHE_ALIAS].set(profile_key(row.id), dumped, settings.PROFILE_CACHE_TTL)
+    return dumped
+
+
+def get_profile(profile_id: int | None) -> dict[str, Any] | None:
+    """Get a stored profile, without its repositories
+
+    Args:
+        profile_id (int | None): GitHub id of the user
+
+    Returns:
+        dict[str, Any] | None: The profile, None if not stored
+    """
+    if profile_id is None:
+        return None
+    cache = caches[settings.REPO_CACHE_ALIAS]
+    profile = cache.get(profile_key(profile_id))
+    if profile is None:
+        try:
+            profile = GitHubProfileModel.objects.get(id=profile_id).dump()
+        except (GitHubProfileModel.DoesNotExist, OperationalError):
+            return None
+        cache.set(profile_key(profile_id), profile, settings.PROFILE_CACHE_TTL)
+    return profile
+
+
+def get_profile_repos(profile_id: int, page: int, page_size: int, query: str = '') -> tuple[list[dict[str, Any]], bool]:
+    """Get a page of a profile's repositories, newest first, or best match first when searching
+
+    A repository matches when its name, or its full name, starts with the query, so both are range scans of the
+    (profile, name) and (profile, full_name) indexes over lowercased copies. Matches are ranked exact name first, then
+    name prefix, then owner or full name prefix, and newest first within each rank.
+
+    Args:
+        profile_id (int): GitHub id of the user
+        page (int): Page number, from 1
+        page_size (int): Repositories per page
+        query (str, optional): Start of the names or full names to search for. Defaults to ''.
+
+    Returns:
+        tuple[list[dict[str, Any]], bool]: The repositories, and whether there is a next page
+    """
+    repos = GitHubProfileRepositoryModel.objects.filter(profile_id=profile_id)
+    query = query.strip().lower()
+    if query:
+        repos = repos.filter(Q(name__startswith=query) | Q(full_name__startswith=query))
+        repos = repos.annotate(rank=Case(
+            When(name=query, then=Value(0)),
+            When(name__startswith=query, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        )).order_by('rank', 'position')
+
+    start = (max(page, 1) - 1) * page_size
+    # One extra row tells whether there is a next page without counting
+    rows = list(repos.values_list('data', flat=True)[start:start + page_size + 1])
+    return rows[:page_size], len(rows) > page_size
+
+
+def get_profile_repo_ids(profile_id: int, count: int) -> list[int]:
+    """Ids of the first repositories of a profile, the newest ones the picker shows first"""
+    return list(GitHubProfileRepositoryModel.objects.filter(profile_id=profile_id).values_list('repo_id', flat=True)[:count])
+
+
+def get_snapshot(profile_id: int, access_token: str) -> dict[str, Any] | None:
+    """Get the stored profile of a user, if younger than PROFILE_SNAPSHOT_TTL and none of its listings failed
+
+    OAuth hands out a new token at every login, so the snapshot is found by user, and the row is given the new token.
+
+    Args:
+        profile_id (int): GitHub id of the user
+        access_token (str): The token the user logged in with
+
+    Returns:
+        dict[str, Any] | None: The profile without its repositories, None if not stored, too old or incomplete
+    """
+    cutoff = now() - timedelta(seconds=settings.PROFILE_SNAPSHOT_TTL)
+    if not GitHubProfileModel.objects.filter(id=profile_id, cached_at__gte=cutoff).update(token_digest=token_digest(access_token)):
+        return None
+    profile = get_profile(profile_id)
+    if profile is None or profile.get('missing'):
+        return None
+    return profile
+
+
+def touch_profile(profile_id: int):
+    """Record a login of the profile's user, users who logged in within PROFILE_ACTIVE_WINDOW are kept warm"""
+    GitHubProfileModel.objects.filter(id=profile_id).update(last_login=now())
+
+
+def fetch_profile(access_token: str) -> dict[str, Any]:
+    """Fetch a profile from GitHub with the configured API
+
+    Args:
+        access_token (str): A user's access token
+
+    Returns:
+        dict[str, Any]: The profile, with every repository
+    """
+    if settings.GITHUB_GRAPHQL:
+        return request_profile_graphql(access_token)
+    return request_profile(access_token)[2]
+
+
+def active_logins() -> Iterator[tuple[int, str]]:
+    """Profiles of users with a live session who logged in within PROFILE_ACTIVE_WINDOW, with a token to refresh them
+
+    Tokens are only kept in sessions, so only database backed sessions are seen.
+
+    Yields:
+        tuple[int, str]: Profile id and access token
+    """
+    seen = set()
+    for session in Session.objects.filter(expire_date__gt=now()).iterator():
+        data = session.get_decoded()
+        profile_id, access_token = data.get('profile_id'), data.get('access_token')
+        if profile_id is None or not access_token or profile_id in seen:
+            continue
+        seen.add(profile_id)
+        yield profile_id, access_token
+
+
+def session_tokens() -> dict[int, str]:
+    """Access tokens of users with a live session, for work done on their behalf outside a request
+
+    Returns:
+        dict[int, str]: Access token by user id
+    """
+    tokens = {}
+    for session in Session.objects.filter(expire_date__gt=now()).iterator():
+        data = session.get_decoded()
+        if data.get('_auth_user_id') and data.get('access_token'):
+            tokens[int(data['_auth_user_id'])] = data['access_token']
+    return tokens
+
+
+def refresh_profiles(max_age: float, limit: int | None = None) -> dict[str, int]:
+    """Refetch the profiles of active users older than `max_age` seconds, as background GitHub requests
+
+    Args:
+        max_age (float): Seconds after which a stored profile is refetched
+        limit (int | None, optional): Most profiles to refetch. Defaults to None.
+
+    Returns:
+        dict[str, int]: Count of active, refreshed, fresh, deferred and failed profiles
+    """
+    stats = dict.fromkeys(('active', 'refreshed', 'fresh', 'deferred', 'failed'), 0)
+    logins = dict(active_logins())
+    active_since = now() - timedelta(seconds=settings.PROFILE_ACTIVE_WINDOW)
+    stale_before = now() - timedelta(seconds=max_age)
+    rows = GitHubProfileModel.objects.filter(id__in=logins, last_login__gte=active_since).values_list('id', 'cached_at')
+
+    for profile_id, cached_at in rows.order_by('cached_at'):
+        stats['active'] += 1
+        if cached_at >= stale_before:
+            stats['fresh'] += 1
+            continue
+        if limit is not None and stats['refreshed'] >= limit:
+            continue
+        try:
+            with priority(BACKGROUND):
+                profile = fetch_profile(logins[profile_id])
+            if profile.get('missing'):
+                # The stored profile is better than one with holes
+                print(f"Profile {profile_id} not refreshed, {', '.join(profile['missing'])} failed")
+                stats['failed'] += 1
+                continue
+            store_profile(profile, logins[profile_id])
+            stats['refreshed'] += 1
+        except (RateLimitDeferred, RateLimitExceeded) as e:
+            print(f"Profile {profile_id} not refreshed: {e}")
+            stats['deferred'] += 1
+        except Exception as e:
+            print(f"Profile {profile_id} refresh failed: {e}")
+            stats['failed'] += 1
+    return stats
+
+
+class ProfileRefresher:
+    """Thread refreshing active users' profiles every `interval` seconds, before their snapshot expires"""
+
+    def __init__(self, interval: float, ttl: float):
+        self.interval = interval
+        self.max_age = max(0, ttl - interval)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the thread, unless already running or disabled with a zero interval"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='profile-refresh', daemon=True)
+                self._thread.start()
+
+    def run(self):
+        while True:
+            sleep(self.interval)
+            try:
+                stats = refresh_profiles(self.max_age)
+                print(f"Profiles refreshed: {stats}")
+            except Exception as e:
+                print(f"Profile refresh failed: {e}")
+            finally:
+                connections.close_all()
+
+
+PROFILE_REFRESHER = ProfileRefresher(settings.PROFILE_REFRESH_INTERVAL, settings.PROFILE_SNAPSHOT_TTL)
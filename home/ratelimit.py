@@ -0,0 +1,254 @@
+"""Rate limit aware scheduling of every request made to GitHub
+
+Budgets are tracked per token and rate limit resource (core, search, graphql) from the `X-RateLimit-*` headers of each
+response. Interactive requests, made while a user waits, go ahead of background ones, and background work is deferred
+once a token's budget runs low.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from hashlib import sha256
+from time import time
+from typing import Any, Iterator, Mapping
+from urllib.parse import urlparse
+import threading
+
+from requests import PreparedRequest, Response
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority: ContextVar[int] = ContextVar('priority', default=INTERACTIVE)
+_allowance: ContextVar['RequestAllowance | None'] = ContextVar('allowance', default=None)
+
+
+class RateLimitExceeded(Exception):
+    """The token has no requests left until its budget resets"""
+
+    def __init__(self, reset: float):
+        super().__init__(f"GitHub rate limit exceeded, resets in {max(0, int(reset - time()))}s")
+        self.reset = reset
+
+
+class RateLimitDeferred(Exception):
+    """Background work was put off to leave the remaining budget to interactive requests"""
+
+    def __init__(self, remaining: int):
+        super().__init__(f"Background request deferred, only {remaining} requests left")
+        self.remaining = remaining
+
+
+class AllowanceSpent(RateLimitDeferred):
+    """Background work made every request it was allowed"""
+
+    def __init__(self, limit: int):
+        Exception.__init__(self, f"Background work stopped, its {limit} requests are spent")
+        self.remaining = 0
+
+
+class RequestAllowance:
+    """Most requests a block of work may make, shared by every thread it fans out to"""
+
+    def __init__(self, limit: int):
+        self.limit: int | None = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Count a request
+
+        Raises:
+            AllowanceSpent: No requests are left
+        """
+        with self._lock:
+            if self.limit is not None and self.spent >= self.limit:
+                raise AllowanceSpent(self.limit)
+            self.spent += 1
+
+    def lift(self):
+        """Let the work make as many requests as it needs, e.g. once a user waits on it"""
+        with self._lock:
+            self.limit = None
+
+
+def check_exhausted(status: int, headers: Mapping[str, str]) -> None:
+    """Raise if GitHub refused a request because the token's budget is spent
+
+    Args:
+        status (int): Status code of the response
+        headers (Mapping[str, str]): Headers of the response
+
+    Raises:
+        RateLimitExceeded: A 403 or 429 with no requests left
+    """
+    if status in (403, 429) and headers.get('X-RateLimit-Remaining') == '0':
+        raise RateLimitExceeded(float(headers.get('X-RateLimit-Reset', 0)))
+
+
+def resource(url: str) -> str:
+    """Rate limit resource GitHub counts a request against, from its URL"""
+    path = urlparse(str(url)).path
+    if path.endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in path:
+        return 'search'
+    return 'core'
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Run the requests made within the block, including ones from a `ContextExecutor`, at a priority
+
+    Args:
+        level (int): INTERACTIVE or BACKGROUND
+    """
+    reset = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(reset)
+
+
+@contextmanager
+def allowance(limit: int | None) -> Iterator[RequestAllowance | None]:
+    """Cap the requests made within the block, including ones from a `ContextExecutor`, past it they raise
+    `AllowanceSpent`
+
+    Args:
+        limit (int | None): Most requests, None for no cap
+    """
+    if limit is None:
+        yield None
+        return
+    current = RequestAllowance(limit)
+    reset = _allowance.set(current)
+    try:
+        yield current
+    finally:
+        _allowance.reset(reset)
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    """Thread pool that runs tasks in the context of the submitter, so their requests keep its priority"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(copy_context().run, fn, *args, **kwargs)
+
+
+class TokenBudget:
+    """Known rate limit state and usage of one token for one resource"""
+
+    def __init__(self):
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset: float = 0
+        self.in_flight = [0, 0]
+        self.waiting = [0, 0]
+        self.requests = [0, 0]
+        self.deferred = 0
+
+
+class RateLimitScheduler:
+    """Admits requests per token by priority and remaining budget"""
+
+    def __init__(self, reserve: int, max_concurrent: int):
+        self.reserve = reserve
+        self.max_concurrent = max_concurrent
+        self._budgets: dict[str, TokenBudget] = {}
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def key(authorization: str, resource: str = 'core') -> str:
+        return sha256(f'{authorization}\n{resource}'.encode()).hexdigest()
+
+    def _budget(self, key: str) -> TokenBudget:
+        if key not in self._budgets:
+            self._budgets[key] = TokenBudget()
+        return self._budgets[key]
+
+    def acquire(self, request: PreparedRequest) -> str:
+        """Wait until a request may be sent
+
+        Args:
+            request (PreparedRequest): The request about to be sent
+
+        Raises:
+            RateLimitExceeded: The token has no budget left
+            RateLimitDeferred: A background request while the budget is low, or past the allowance of its block
+
+        Returns:
+            str: Key of the token's budget, to pass to `release`
+        """
+        key = self.key(request.headers.get('Authorization', ''), resource(request.url))
+        level = _priority.get()
+        with self._cond:
+            budget = self._budget(key)
+            if budget.reset and budget.reset < time():
+                budget.remaining, budget.reset = budget.limit, 0
+            if budget.remaining is not None and budget.remaining <= 0:
+                raise RateLimitExceeded(budget.reset)
+            if level == BACKGROUND and budget.remaining is not None and budget.remaining <= self.reserve:
+                budget.deferred += 1
+                raise RateLimitDeferred(budget.remaining)
+            if _allowance.get() is not None:
+                _allowance.get().take()
+
+            budget.waiting[level] += 1
+            try:
+                # Background requests also give way to any interactive request waiting for a slot
+                self._cond.wait_for(lambda: sum(budget.in_flight) < self.max_concurrent and
+                                    (level == INTERACTIVE or budget.waiting[INTERACTIVE] == 0))
+            finally:
+                budget.waiting[level] -= 1
+
+            budget.in_flight[level] += 1
+            budget.requests[level] += 1
+            if budget.remaining is not None:
+                budget.remaining -= 1  # Estimate until the response headers tell
+        return key
+
+    def release(self, key: str, response: Response | None):
+        """Mark a request as finished and update the budget from its response headers
+
+        Args:
+            key (str): Key returned by `acquire`
+            response (Response | None): The response, None if the request failed
+        """
+        level = _priority.get()
+        with self._cond:
+            budget = self._budget(key)
+            budget.in_flight[level] -= 1
+            headers = response.headers if response is not None else {}
+            if 'X-RateLimit-Remaining' in headers:
+                # Requests still in flight were taken from the estimate but not yet counted by GitHub
+                remaining = int(headers['X-RateLimit-Remaining']) - sum(budget.in_flight)
+                reset = float(headers.get('X-RateLimit-Reset', budget.reset))
+                if budget.remaining is None or reset > budget.reset:
+                    # First answer, or the first of a new window
+                    budget.remaining, budget.reset = remaining, reset
+                elif reset == budget.reset:
+                    # Answers come back out of order, a late one must not give back requests already spent
+                    budget.remaining = min(budget.remaining, remaining)
+                budget.limit = int(headers.get('X-RateLimit-Limit', budget.limit or 0))
+            self._cond.notify_all()
+
+    def report(self, token: str, resource: str = 'core') -> dict[str, Any]:
+        """Get the known budget and usage of a token
+
+        Args:
+            token (str): OAuth token
+            resource (str, optional): Rate limit resource. Defaults to 'core'.
+
+        Returns:
+            dict[str, Any]: Limit, remaining requests, reset epoch, and requests made or deferred by this process
+        """
+        with self._cond:
+            budget = self._budget(self.key(f'token {token}', resource))
+            return {
+                'limit': budget.limit,
+                'remaining': budget.remaining,
+                'reset': budget.reset,
+                'interactive_requests': budget.requests[INTERACTIVE],
+                'background_requests': budget.requests[BACKGROUND],
+                'deferred': budget.deferred,
+            }
@@ -0,0 +1,219 @@
+"""Bulk refresh of cached repositories outside of web requests, see the `refresh_repos` command
+
+Repositories are built on a thread or process pool at background priority and saved in batches with bulk upserts.
+Each holds the build lock row web requests take, see `build_repository`, until saved. Payloads are only cached when
+the cache is shared with the web workers, otherwise they find the rebuilt rows through their `cached_at`.
+"""
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from statistics import median, quantiles
+from time import perf_counter
+from typing import Any, Iterable, Iterator
+import os
+
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.utils.timezone import now
+
+from core import settings
+
+from .github_api import SCHEDULER, get_repository
+from .models import GitHubCommitModel, GitHubRepositoryLockModel, GitHubRepositoryModel
+from .ratelimit import BACKGROUND, RateLimitDeferred, RateLimitExceeded, priority
+from .repo_cache import REPO_CACHE, cache_payload, repo_key
+from .singleflight import lock_row
+
+# Columns replaced when a rebuilt repository is upserted, the user who first built it is kept
+UPSERT_FIELDS = [f.name for f in GitHubRepositoryModel._meta.concrete_fields if f.name not in ('id', 'user')]
+
+
+def stale_repositories(older_than: float, owners: Iterable[str] = (), active_days: float | None = None,
+                       limit: int | None = None) -> QuerySet:
+    """Select cached repositories to refresh, stalest first
+
+    Args:
+        older_than (float): Only rows cached more than this many seconds ago
+        owners (Iterable[str], optional): Only repositories of these owners. Defaults to ().
+        active_days (float | None, optional): Only repositories updated on GitHub within this many days. Defaults to None.
+        limit (int | None, optional): Most rows to select. Defaults to None.
+
+    Returns:
+        QuerySet: The rows
+    """
+    rows = GitHubRepositoryModel.objects.filter(cached_at__lt=now() - timedelta(seconds=older_than))
+    if owners:
+        rows = rows.filter(owner__login__in=list(owners))
+    if active_days is not None:
+        rows = rows.filter(updated_at__gte=now() - timedelta(days=active_days))
+    rows = rows.order_by('cached_at')
+    return rows[:limit] if limit else rows
+
+
+def build_row(previous: GitHubRepositoryModel, access_token: str) -> dict[str, Any]:
+    """Rebuild a repository without saving it, in a pool worker
+
+    Args:
+        previous (GitHubRepositoryModel): The cached row, only commits newer than it are fetched
+        access_token (str): Token to fetch the repository with
+
+    Returns:
+        dict[str, Any]: The unsaved row, None on failure, with the build time, error, and the token's remaining budget
+    """
+    started = perf_counter()
+    result = {'id': previous.id, 'row': None, 'error': None, 'deferred': False}
+    try:
+        with priority(BACKGROUND):
+            repo = get_repository(access_token, previous.id)
+            if repo is None:
+                raise ValueError("not found")
+            row = GitHubRepositoryModel(None, repo=repo, previous=previous)
+        row.user_id = previous.user_id
+        result['row'] = row
+    except (RateLimitDeferred, RateLimitExceeded) as e:
+        result['error'], result['deferred'] = str(e), True
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = perf_counter() - started
+    result['remaining'] = SCHEDULER.report(access_token)['remaining']
+    return result
+
+
+def save_rows(rows: list[GitHubRepositoryModel], since: datetime | None = None) -> set[int]:
+    """Upsert rebuilt rows and their new commits, a few statements per batch instead of a few per row
+
+    Args:
+        rows (list[GitHubRepositoryModel]): Rows built by `build_row`
+        since (datetime | None, optional): Skip rows stored again after this time, e.g. by a web request while they
+            were being rebuilt. Defaults to None.
+
+    Returns:
+        set[int]: Ids of the rows skipped
+    """
+    with transaction.atomic():
+        newer = set()
+        if since is not None:
+            newer = set(GitHubRepositoryModel.objects.select_for_update()
+                        .filter(id__in=[x.id for x in rows], cached_at__gt=since).values_list('id', flat=True))
+        rows = [x for x in rows if x.id not in newer]
+        GitHubRepositoryModel.objects.bulk_create(rows, update_conflicts=True, unique_fields=['id'],
+                                                  update_fields=UPSERT_FIELDS)
+        GitHubCommitModel.objects.filter(repo_id__in=[x.id for x in rows if x.resync_commits]).delete()
+        GitHubCommitModel.objects.bulk_create(
+            [GitHubCommitModel(repo_id=x.id, author=author, sha=sha, timestamp=timestamp)
+             for x in rows for author, sha, timestamp in x.pending_commits],
+            batch_size=1000, ignore_conflicts=True)
+    for row in rows:
+        row.pending_commits = []
+        row.resync_commits = False
+    return newer
+
+
+def init_process():
+    """Set up Django in a spawned pool process, forked ones inherit it and only drop the parent's connections"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def make_pool(workers: int, processes: bool = False) -> Executor:
+    if processes:
+        # Connections must not be shared with the children
+        connections.close_all()
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_process)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresh_repos')
+
+
+def refresh_rows(rows: Iterable[GitHubRepositoryModel], tokens: dict[int, str], workers: int, processes: bool = False,
+                 min_remaining: int = 0, batch_size: int = 50) -> Iterator[dict[str, Any]]:
+    """Rebuild rows on a pool, at most `2 * workers` in flight, and save them in batches as they complete
+
+    No new builds are started for a token once GitHub reports `min_remaining` requests or fewer left for it, or once
+    the scheduler defers its background requests. Repositories a web request is building are skipped, and web requests
+    asking for one being refreshed wait for it to be saved.
+
+    Args:
+        rows (Iterable[GitHubRepositoryModel]): Rows to rebuild
+        tokens (dict[int, str]): Token to use by user id, rows of users without one are skipped
+        workers (int): Pool size
+        processes (bool, optional): Use processes instead of threads. Defaults to False.
+        min_remaining (int, optional): Budget left untouched per token. Defaults to 0.
+        batch_size (int, optional): Rows per upsert. Defaults to 50.
+
+    Yields:
+        dict[str, Any]: Result of each row as `build_row` returns it, with `skipped` set for rows not built, or not
+            saved because a web request stored the repository again meanwhile
+    """
+    exhausted = set()
+    pending = []
+    started = now()
+    # Build lock of each row in flight or pending, by id
+    locks: dict[int, ExitStack] = {}
+
+    def lock(repo_id: int) -> bool:
+        stack = ExitStack()
+        if stack.enter_context(lock_row(GitHubRepositoryLockModel, repo_key(repo_id), settings.BUILD_LOCK_TTL, 0)):
+            stack.close()
+            return False
+        locks[repo_id] = stack
+        return True
+
+    def flush() -> list[dict[str, Any]]:
+        newer = save_rows([x['row'] for x in pending], since=started)
+        for result in pending:
+            if result['id'] in newer:
+                result['row'], result['skipped'] = None, 'newer'
+            elif REPO_CACHE.shared:
+                cache_payload(result['row'].dump())
+            locks.pop(result['id']).close()
+        flushed = list(pending)
+        pending.clear()
+        return flushed
+
+    rows = iter(rows)
+    try:
+        with make_pool(workers, processes) as pool:
+            in_flight = {}
+            while True:
+                for row in rows:
+                    token = tokens.get(row.user_id)
+                    if token is None or token in exhausted:
+                        yield {'id': row.id, 'row': None, 'skipped': 'no token' if token is None else 'budget'}
+                        continue
+                    if not lock(row.id):
+                        yield {'id': row.id, 'row': None, 'skipped': 'building'}
+                        continue
+                    in_flight[pool.submit(build_row, row, token)] = token
+                    if len(in_flight) >= 2 * workers:
+                        break
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    token = in_flight.pop(future)
+                    result = future.result()
+                    if result['deferred'] or (result['remaining'] is not None and result['remaining'] <= min_remaining):
+                        exhausted.add(token)
+                    if result['row'] is None:
+                        locks.pop(result['id']).close()
+                        yield result
+                        continue
+                    # Yielded once saved
+                    pending.append(result)
+                    if len(pending) >= batch_size:
+                        yield from flush()
+        if pending:
+            yield from flush()
+    finally:
+        for stack in locks.values():
+            stack.close()
+
+
+def latency_stats(seconds: list[float]) -> dict[str, float]:
+    """Median, 95th percentile and slowest build time"""
+    if not seconds:
+        return {'p50': 0, 'p95': 0, 'max': 0}
+    p95 = quantiles(seconds, n=20)[-1] if len(seconds) > 1 else seconds[0]
+    return {'p50': median(seconds), 'p95': p95, 'max': max(seconds)}
@@ -0,0 +1,134 @@
+"""Two tier cache of ready to serve repository payloads, in process (L1) and through Django's cache framework (L2)"""
+from collections import OrderedDict
+from time import monotonic
+from typing import Any
+import threading
+
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.core.cache.backends.locmem import LocMemCache
+
+from core import settings
+
+from .payloads import encode_payload
+
+
+class LRUCache:
+    """In process cache bounded by entry count and age, evicting the least recently used first"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RepositoryCache:
+    """Repository payloads as returned by `GitHubRepositoryModel.dump`, stored under every key a repo is asked for by
+
+    A payload only ever replaces one with an older `cached_at`, so a slow build can't overwrite a newer one.
+    """
+
+    def __init__(self, l1: LRUCache, alias: str, timeout: float, prefix: str = 'repo'):
+        self.l1 = l1
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+
+    @property
+    def l2(self):
+        try:
+            return caches[self.alias]
+        except InvalidCacheBackendError:
+            return None
+
+    @property
+    def shared(self) -> bool:
+        """Whether L2 is seen by other processes, an in memory one is not"""
+        return self.l2 is not None and not isinstance(self.l2, LocMemCache)
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Get a payload from L1, or from L2 filling L1
+
+        Args:
+            key (str): Key the repo was asked for by
+
+        Returns:
+            dict[str, Any] | None: The payload, None if in neither tier
+        """
+        payload = self.l1.get(key)
+        if payload is not None or self.l2 is None:
+            return payload
+        payload = self.l2.get(f'{self.prefix}:{key}')
+        if payload is not None:
+            self.l1.set(key, payload)
+        return payload
+
+    def put(self, payload: dict[str, Any], *keys: str):
+        """Store a payload in both tiers, unless a newer one is already cached
+
+        Args:
+            payload (dict[str, Any]): The payload
+            keys (str): Every key the repo can be asked for by
+        """
+        for key in keys:
+            current = self.get(key)
+            if current is not None and current['cached_at'] > payload['cached_at']:
+                continue
+            self.l1.set(key, payload)
+            if self.l2 is not None:
+                self.l2.set(f'{self.prefix}:{key}', payload, self.timeout)
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self.l1.delete(key)
+            if self.l2 is not None:
+                self.l2.delete(f'{self.prefix}:{key}')
+
+
+REPO_CACHE = RepositoryCache(LRUCache(settings.REPO_CACHE_SIZE, settings.REPO_CACHE_TTL), settings.REPO_CACHE_ALIAS, settings.CACHE_MAX_STALE)
+
+
+def repo_key(repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None) -> str:
+    """Key identifying a repository by how it was asked for"""
+    if repo_owner:
+        return f'name:{repo_owner}/{repo_name}'.lower()
+    return f'id:{repo_id}'
+
+
+def cache_payload(payload: dict) -> dict:
+    """Encode a repository payload and store it under both its id and its full name
+
+    Returns:
+        dict: The encoded payload
+    """
+    encoded = encode_payload(payload)
+    repo_owner, repo_name = payload['full_name'].split('/', 1)
+    REPO_CACHE.put(encoded, repo_key(payload['id']), repo_key(repo_owner=repo_owner, repo_name=repo_name))
+    return encoded
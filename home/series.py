@@ -0,0 +1,176 @@
+"""Time series bucketing and downsampling for the dashboard charts
+
+A series is a list of points, each an epoch and one value per dataset, sorted by epoch.
+"""
+from datetime import datetime, timezone
+from typing import Any
+
+DAY = 24 * 60 * 60
+
+# Bucket sizes from finest to coarsest
+BUCKETS = ['day', 'week', 'month', 'year']
+BUCKET_SECONDS = {'day': DAY, 'week': 7 * DAY, 'month': 30 * DAY, 'year': 365 * DAY}
+
+Series = list[tuple[int, list[int]]]
+
+
+def commit_activity_series(commit_activity: list[dict[str, Any]]) -> Series:
+    """Flatten GitHub's weekly commit activity into daily points
+
+    Args:
+        commit_activity (list[dict[str, Any]]): Weeks of commit activity, as returned by the API
+
+    Returns:
+        Series: Daily commit counts
+    """
+    return [(week['week'] + i * DAY, [count]) for week in commit_activity for i, count in enumerate(week['days'])]
+
+
+def code_freq_series(code_freq: list[list[int]]) -> Series:
+    """Turn GitHub's weekly code frequency into points
+
+    Args:
+        code_freq (list[list[int]]): Weeks of [epoch, additions, deletions], as returned by the API
+
+    Returns:
+        Series: Weekly additions and deletions
+    """
+    return [(week[0], list(week[1:])) for week in code_freq]
+
+
+def commits_series(timestamps: list[int]) -> Series:
+    """Count commit timestamps per day
+
+    Args:
+        timestamps (list[int]): Commit epochs
+
+    Returns:
+        Series: Daily commit counts
+    """
+    return bucket([(x, [1]) for x in sorted(timestamps)], 'day')
+
+
+def bucket_start(epoch: int, size: str) -> int:
+    """Get the start of the bucket an epoch falls in, weeks start on Sunday like GitHub's
+
+    Args:
+        epoch (int): The epoch
+        size (str): One of `BUCKETS`
+
+    Returns:
+        int: Epoch the bucket starts at
+    """
+    if size == 'day':
+        return epoch - epoch % DAY
+    if size == 'week':
+        day = epoch - epoch % DAY
+        return day - ((day // DAY + 4) % 7) * DAY  # 1970-01-01 was a Thursday
+    dt = datetime.fromtimestamp(epoch, timezone.utc)
+    dt = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if size == 'year':
+        dt = dt.replace(month=1)
+    return int(dt.timestamp())
+
+
+def bucket(points: Series, size: str) -> Series:
+    """Sum the values of every point in the same bucket
+
+    Args:
+        points (Series): Points to bucket
+        size (str): One of `BUCKETS`
+
+    Returns:
+        Series: One point per non empty bucket
+    """
+    buckets: Series = []
+    for epoch, values in points:
+        start = bucket_start(epoch, size)
+        if buckets and buckets[-1][0] == start:
+            buckets[-1] = (start, [a + b for a, b in zip(buckets[-1][1], values)])
+        else:
+            buckets.append((start, list(values)))
+    return buckets
+
+
+def window(points: Series, seconds: int) -> Series:
+    """Keep only the points within some seconds of the last point
+
+    Args:
+        points (Series): Points to filter
+        seconds (int): Width of the window
+
+    Returns:
+        Series: Points in the window
+    """
+    if not points:
+        return points
+    start = points[-1][0] - seconds
+    return [x for x in points if x[0] >= start]
+
+
+def lttb(points: Series, threshold: int) -> Series:
+    """Downsample with Largest-Triangle-Three-Buckets, keeping the visual shape of the sum of every dataset
+
+    Args:
+        points (Series): Points to downsample
+        threshold (int): Maximum number of points to keep
+
+    Returns:
+        Series: At most `threshold` points, including the first and last
+    """
+    if threshold >= len(points) or threshold < 3:
+        return points
+
+    ys = [sum(values) for _, values in points]
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle point
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        avg_x = sum(points[j][0] for j in range(next_start, next_end)) / max(next_end - next_start, 1)
+        avg_y = sum(ys[j] for j in range(next_start, next_end)) / max(next_end - next_start, 1)
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((points[a][0] - avg_x) * (ys[j] - ys[a]) - (points[a][0] - points[j][0]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def prepare(points: Series, seconds: int, max_points: int, size: str | None = None, native: str = 'day') -> tuple[str, Series]:
+    """Window, bucket and downsample a series for a chart
+
+    Args:
+        points (Series): The full series
+        seconds (int): Width of the time range to show
+        max_points (int): Maximum number of points to send
+        size (str | None, optional): Bucket size, picked from the range if None. Defaults to None.
+        native (str, optional): Resolution of the series itself. Defaults to 'day'.
+
+    Returns:
+        tuple[str, Series]: The bucket size used and the resulting points
+    """
+    points = window(points, seconds)
+    span = points[-1][0] - points[0][0] if points else 0
+    if size is None:
+        size = native
+        # Step up to a coarser bucket while the range still holds far more buckets than points to send
+        for coarser in BUCKETS[BUCKETS.index(native) + 1:]:
+            if span // BUCKET_SECONDS[size] <= max_points * 4:
+                break
+            size = coarser
+    if BUCKETS.index(size) > BUCKETS.index(native):
+        points = bucket(points, size)
+    else:
+        size = native
+    return size, lttb(points, max_points)
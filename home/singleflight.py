@@ -0,0 +1,114 @@
+"""Request coalescing, so concurrent callers asking for the same build share a single one"""
+from contextlib import contextmanager
+from datetime import timedelta
+from time import monotonic, sleep
+from typing import Any, Callable, Iterator
+import threading
+
+from django.db import IntegrityError
+from django.db.utils import OperationalError
+from django.utils.timezone import now
+
+
+class Call:
+    """A call in flight, which followers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time within the process, concurrent callers with the same key wait for it
+    and share its result or error"""
+
+    def __init__(self):
+        self._calls: dict[str, Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run a call, or wait for the one already in flight for the key
+
+        Args:
+            key (str): Key identifying the call
+            fn (Callable): Function to run if no call is in flight
+
+        Returns:
+            Any: Result of the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+@contextmanager
+def lock_row(model, key: str, ttl: float, timeout: float, poll: float = 0.5) -> Iterator[bool]:
+    """Hold a lock shared by every worker process, as a row keyed by `key`
+
+    Rows older than `ttl` seconds are considered left behind by a crashed worker and taken over. If the lock can't be
+    had within `timeout` seconds, or there is no database, the block runs without it. The row's `expires_at` tells
+    holders apart: a takeover only deletes the expired row it saw, and a holder only releases its own row, not the one
+    of a worker that took over after its TTL.
+
+    Args:
+        model: Model with a `key` primary key and an `expires_at` datetime
+        key (str): Key of the lock
+        ttl (float): Seconds the lock is held at most
+        timeout (float): Seconds to wait for the lock
+        poll (float, optional): Seconds between attempts. Defaults to 0.5.
+
+    Yields:
+        bool: True if another worker held the lock and this one had to wait for it
+    """
+    start = monotonic()
+    waited = False
+    expires_at = None
+    while True:
+        try:
+            seen = model.objects.filter(key=key).values_list('expires_at', flat=True).first()
+            if seen is not None and seen < now():
+                model.objects.filter(key=key, expires_at=seen).delete()
+            expires_at = now() + timedelta(seconds=ttl)
+            model.objects.create(key=key, expires_at=expires_at)
+            break
+        except IntegrityError:
+            expires_at = None
+            waited = True
+            if monotonic() - start > timeout:
+                print(f"Gave up waiting for lock {key}")
+                break
+            sleep(poll)
+        except OperationalError:
+            expires_at = None
+            print(f"Lock {key} not taken, no Database connected?")
+            break
+
+    try:
+        yield waited
+    finally:
+        if expires_at is not None:
+            try:
+                if not model.objects.filter(key=key, expires_at=expires_at).delete()[0]:
+                    print(f"Lock {key} was taken over after {ttl}s")
+            except OperationalError:
+                pass
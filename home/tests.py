@@ -1,3 +1,689 @@
-from django.test import TestCase
+from datetime import timedelta
+from pathlib import Path
+from time import sleep, time
+from unittest import mock, skipUnless
+import gzip
+import json
+import tempfile
+import threading
+import zlib
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from requests import Request, Response, Session
+from requests.structures import CaseInsensitiveDict
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils.timezone import now
+
+from core import settings
+
+from . import github_api, github_async, payloads, views
+from .fake_github import REPO_ID_BASE, FakeGitHub
+from .fields import CompactSeriesField
+from .github_api import request_profile, str_short_pull_request, str_short_user
+from .github_graphql import fetch_repository_graphql, request_profile_graphql
+from .http_cache import CachingAdapter, ResponseCache
+from .jobs import RefreshJobManager
+from .models import (SECTIONS, GitHubCommitModel, GitHubProfileModel, GitHubRepositoryLockModel,
+                     GitHubRepositoryModel, sync_commits)
+from .payloads import dumps, encode_payload, payload_response
+from .profiles import get_profile_repos, get_snapshot, store_profile, token_digest
+from .ratelimit import (BACKGROUND, INTERACTIVE, AllowanceSpent, RateLimitExceeded, RateLimitScheduler, allowance,
+                        check_exhausted)
+from .refresh import refresh_rows, save_rows
+from .repo_cache import REPO_CACHE, cache_payload, repo_key
+from .singleflight import lock_row
+from .views import build_repository, build_repository_locked, get_cached_payload
+
+DAY = 24 * 60 * 60
+
+
+def make_repository(user: User, repo_id: int = 1, full_name: str = 'owner/repo', save: bool = True,
+                    **fields) -> GitHubRepositoryModel:
+    """Make a repository row without fetching it from GitHub"""
+    owner, name = full_name.split('/')
+    repo = GitHubRepositoryModel(user, **{
+        '_id': repo_id, 'cached_at': now(), 'owner': {'login': owner}, 'private': False, 'name': name,
+        'full_name': full_name, 'description': '', 'created_at': now(), 'updated_at': now(), 'homepage': '',
+        'language': '', 'archived': False, 'forks_count': 0, 'open_issues_count': 0, 'pull_requests_count': 0,
+        'pull_requests': [], 'watchers_count': 0, 'url': '', 'collaborators': [], 'collaborators_access': False,
+        'commit_activity': [], 'code_freq': [], 'branches': [], 'branch_count': 1, 'commits_watermark': {}, **fields})
+    if save:
+        repo.save()
+    return repo
+
+
+class FakeGitHubMixin:
+    """Serve a fake GitHub to the tests of a class, and point the API clients at it without their response caches"""
+    fake_options: dict = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeGitHub(**{'stats_202': 0, **cls.fake_options})
+        cls.server = cls.fake.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.patch(mock.patch.multiple(settings, GITHUB_API_URL=self.fake.base_url, GITHUB_GRAPHQL_URL=f'{self.fake.base_url}/graphql'),
+                   mock.patch.object(github_api.CLIENTS, 'cache', None),
+                   mock.patch.object(github_async.ASYNC_CLIENTS, 'cache', None))
+
+    def patch(self, *patches):
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class RepoSeriesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('series')
+        self.client.force_login(self.user)
+        repo = make_repository(self.user)
+        GitHubCommitModel.objects.bulk_create(GitHubCommitModel(repo=repo, author='a', sha=f'{i:040x}', timestamp=i * DAY)
+                                              for i in range(100))
+
+    def get(self, points: str):
+        return self.client.get('/repo_series/1/', {'metric': 'commits', 'points': points}, secure=True)
+
+    def test_points_clamped_to_three(self):
+        for points in ('0', '1', '-5'):
+            response = self.get(points)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['labels']), 3)
+
+    def test_points_not_an_integer(self):
+        for points in ('abc', '1.5'):
+            self.assertEqual(self.get(points).status_code, 400)
+
+
+class RepoAccessTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        make_repository(self.owner, private=True)
+        cache_payload(GitHubRepositoryModel.objects.get(id=1).dump())
+        self.addCleanup(REPO_CACHE.delete, repo_key(1), repo_key(repo_owner='owner', repo_name='repo'))
+
+    def client_for(self, user: User, profile_id: int | None = None) -> Client:
+        client = Client()
+        client.force_login(user)
+        session = client.session
+        session['access_token'] = f'token-{user.username}'
+        if profile_id is not None:
+            session['profile_id'] = profile_id
+        session.save()
+        return client
+
+    def statuses(self, client: Client) -> list[int]:
+        return [client.get(url, secure=True).status_code for url in ('/repo_series/1/', '/repos/1/', '/repos/owner/repo/')]
+
+    def test_private_repo_hidden_from_other_users(self):
+        self.assertEqual(self.statuses(self.client_for(User.objects.create_user('other'))), [404] * 3)
+
+    def test_private_repo_served_to_its_builder(self):
+        self.assertEqual(self.statuses(self.client_for(self.owner)), [200] * 3)
+
+    def test_private_repo_served_to_users_who_list_it(self):
+        store_profile({'id': 8, 'login': 'member', 'repos': [{'id': 1, 'name': 'repo', 'full_name': 'owner/repo'}],
+                       'missing': []}, 'token')
+        self.assertEqual(self.statuses(self.client_for(User.objects.create_user('member'), profile_id=8)), [200] * 3)
+
+    def test_public_repo_served_to_everyone(self):
+        GitHubRepositoryModel.objects.filter(id=1).update(private=False)
+        cache_payload(GitHubRepositoryModel.objects.get(id=1).dump())
+        self.assertEqual(self.statuses(self.client_for(User.objects.create_user('other'))), [200] * 3)
+
+    def test_stream_of_a_private_repo(self):
+        self.assertEqual(self.client_for(User.objects.create_user('other')).get('/repos/1/stream/', secure=True).status_code, 404)
+
+
+class CompactSeriesFieldTests(TestCase):
+    CODE_FREQ = {
+        'empty': [],
+        'single point': [[1700000000, 5, -3]],
+        'non-monotonic and negative': [[1700604800, -5, 0], [1700000000, 2 ** 40, -(2 ** 40)], [-604800, 0, -1]],
+    }
+
+    def field(self, name: str) -> CompactSeriesField:
+        return GitHubRepositoryModel._meta.get_field(name)
+
+    def test_round_trip(self):
+        activity = [{'days': [3, -1, 0, 0, 0, 0, 9], 'total': 11, 'week': 1700000000}, {'days': [0] * 7, 'total': 0, 'week': 0}]
+        for case, value in self.CODE_FREQ.items():
+            with self.subTest(case):
+                self.assertEqual(self.field('code_freq').to_python(self.field('code_freq').get_prep_value(value)), value)
+        for value in ([], activity[:1], activity, activity[::-1]):
+            self.assertEqual(self.field('commit_activity').to_python(self.field('commit_activity').get_prep_value(value)), value)
+
+    def test_round_trip_through_the_database(self):
+        user = User.objects.create_user('series-field')
+        for case, value in self.CODE_FREQ.items():
+            with self.subTest(case):
+                make_repository(user, code_freq=value)
+                self.assertEqual(GitHubRepositoryModel.objects.get(id=1).code_freq, value)
+
+    def test_decoded_only_when_read(self):
+        make_repository(User.objects.create_user('series-field'), code_freq=self.CODE_FREQ['non-monotonic and negative'])
+        with mock.patch('home.fields.zlib.decompress', wraps=zlib.decompress) as decompress:
+            repo = GitHubRepositoryModel.objects.get(id=1)
+            self.assertEqual(repo.full_name, 'owner/repo')
+            decompress.assert_not_called()
+            self.assertEqual(repo.code_freq, self.CODE_FREQ['non-monotonic and negative'])
+            self.assertEqual(repo.code_freq, self.CODE_FREQ['non-monotonic and negative'])
+            decompress.assert_called_once()
+
+
+class PayloadResponseTests(TestCase):
+    def setUp(self):
+        self.encoded = encode_payload(make_repository(User.objects.create_user('payload'), save=False).dump())
+        self.factory = RequestFactory()
+
+    def get(self, accept_encoding: str | None = None, stale: bool = False, **headers) -> HttpResponse:
+        if accept_encoding is not None:
+            headers['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        return payload_response(self.factory.get('/repos/1/', **headers), self.encoded, stale)
+
+    def body(self, response: HttpResponse) -> dict:
+        content = response.content
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        elif response.get('Content-Encoding') == 'br':
+            content = payloads.brotli.decompress(content)
+        return json.loads(content)
+
+    def test_content_coding_negotiated(self):
+        for accept_encoding, coding in (
+                (None, None), ('', None), ('identity', None), ('gzip', 'gzip'), ('GZIP;q=0.5', 'gzip'),
+                ('gzip;q=0, identity', None), ('gzip;q=0, *', 'br' if payloads.brotli else None), ('*;q=0', None),
+                ('deflate', None)):
+            with self.subTest(accept_encoding):
+                response = self.get(accept_encoding)
+                self.assertEqual(response.get('Content-Encoding'), coding)
+                self.assertEqual(self.body(response)['full_name'], 'owner/repo')
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    @skipUnless(payloads.brotli, "brotli is not installed")
+    def test_brotli_preferred(self):
+        for accept_encoding, coding in (('gzip, deflate, br', 'br'), ('br;q=0, gzip', 'gzip'), ('br;q=0.1, gzip;q=1', 'br')):
+            with self.subTest(accept_encoding):
+                self.assertEqual(self.get(accept_encoding)['Content-Encoding'], coding)
+
+    def test_stale_flag_in_every_coding(self):
+        for accept_encoding in ('identity', 'gzip', 'br'):
+            with self.subTest(accept_encoding):
+                response = self.get(accept_encoding, stale=True)
+                self.assertTrue(self.body(response)['stale'])
+                self.assertNotEqual(response['ETag'], self.get(accept_encoding)['ETag'])
+
+    def test_matching_etag_answered_with_304(self):
+        for accept_encoding in ('identity', 'gzip'):
+            with self.subTest(accept_encoding):
+                etag = self.get(accept_encoding)['ETag']
+                response = self.get(accept_encoding, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual((response.status_code, response.content, response['ETag']), (304, b'', etag))
+                self.assertIn('no-cache', response['Cache-Control'])
+        # Another coding is another representation
+        self.assertEqual(self.get('gzip', HTTP_IF_NONE_MATCH=self.get('identity')['ETag']).status_code, 200)
+
+
+class ProfileSnapshotTests(TestCase):
+    def profile(self, **fields) -> dict:
+        return {'id': 7, 'login': 'snapshot', 'repos': [], 'missing': [], **fields}
+
+    def test_found_by_user_with_a_new_token(self):
+        store_profile(self.profile(), 'first-token')
+        self.assertEqual(get_snapshot(7, 'second-token')['login'], 'snapshot')
+        self.assertEqual(GitHubProfileModel.objects.get(id=7).token_digest, token_digest('second-token'))
+
+    def test_incomplete_profile_not_served(self):
+        store_profile(self.profile(missing=['followers']), 'token')
+        self.assertIsNone(get_snapshot(7, 'token'))
+
+    def test_missing_listing_keeps_the_stored_counts(self):
+        store_profile(self.profile(repos=[{'id': 1, 'name': 'repo', 'full_name': 'owner/repo'}], repo_priv_count=1), 'token')
+        store_profile(self.profile(repos=None, repo_priv_count=None, missing=['repos']), 'token')
+        stored = GitHubProfileModel.objects.get(id=7).profile
+        self.assertEqual((stored['repo_count'], stored['repo_priv_count']), (1, 1))
+
+    def test_old_profile_not_served(self):
+        store_profile(self.profile(), 'token')
+        GitHubProfileModel.objects.filter(id=7).update(cached_at=now() - timedelta(seconds=settings.PROFILE_SNAPSHOT_TTL + 1))
+        self.assertIsNone(get_snapshot(7, 'token'))
+
+
+class ProfileReposSearchTests(TestCase):
+    def setUp(self):
+        # Newest first, as listed
+        names = ['other/chart-tools', 'chart/alpha', 'me/Chart', 'me/charts', 'me/barchart', 'me/plots']
+        store_profile({'id': 9, 'login': 'me', 'missing': [], 'repos': [
+            {'id': i, 'name': x.split('/')[1], 'full_name': x, 'description': 'chart' if x == 'me/plots' else ''}
+            for i, x in enumerate(names)]})
+
+    def search(self, query: str, page: int = 1, page_size: int = 10) -> list[str]:
+        return [x['full_name'] for x in get_profile_repos(9, page, page_size, query)[0]]
+
+    def test_ranked_exact_then_name_then_owner_prefix(self):
+        self.assertEqual(self.search(' CHART '), ['me/Chart', 'other/chart-tools', 'me/charts', 'chart/alpha'])
+
+    def test_full_name_prefix(self):
+        self.assertEqual(self.search('me/ch'), ['me/Chart', 'me/charts'])
+
+    def test_only_prefixes_match(self):
+        self.assertEqual(self.search('tools'), [])
+        self.assertEqual(self.search('%chart'), [])
+
+    def test_pages_of_matches(self):
+        self.assertEqual(self.search('chart', 2, 3), ['chart/alpha'])
+        self.assertEqual(get_profile_repos(9, 1, 4, 'chart')[1], False)
+
+
+class RateLimitSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = RateLimitScheduler(reserve=0, max_concurrent=10)
+        self.reset = int(time()) + 3600
+
+    def acquire(self, url: str = 'https://api.github.com/user') -> str:
+        return self.scheduler.acquire(Request('GET', url, headers={'Authorization': 'token t'}).prepare())
+
+    def response(self, remaining: int, status: int = 200) -> Response:
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': str(remaining),
+                                                'X-RateLimit-Reset': str(self.reset)})
+        return response
+
+    def test_late_headers_never_give_back_requests(self):
+        first, second = self.acquire(), self.acquire()
+        self.scheduler.release(first, self.response(10))
+        # Counted against the request still in flight
+        self.assertEqual(self.scheduler.report('t')['remaining'], 9)
+        self.scheduler.release(second, self.response(20))
+        self.assertEqual(self.scheduler.report('t')['remaining'], 9)
+
+    def test_new_window_resets_the_estimate(self):
+        self.scheduler.release(self.acquire(), self.response(10))
+        self.reset += 3600
+        self.scheduler.release(self.acquire(), self.response(4999))
+        self.assertEqual(self.scheduler.report('t')['remaining'], 4999)
+
+    def test_resources_have_their_own_budget(self):
+        self.scheduler.release(self.acquire('https://api.github.com/graphql'), self.response(0))
+        self.assertIsNone(self.scheduler.report('t')['remaining'])
+        self.assertEqual(self.scheduler.report('t', 'graphql')['remaining'], 0)
+        self.scheduler.release(self.acquire(), self.response(100))
+
+    def test_allowance_stops_work_midway(self):
+        with allowance(2) as current:
+            self.acquire(), self.acquire()
+            with self.assertRaises(AllowanceSpent):
+                self.acquire()
+            current.lift()
+            self.acquire()
+
+    def test_exhausted_budget_raises(self):
+        with self.assertRaises(RateLimitExceeded):
+            check_exhausted(403, self.response(0).headers)
+        check_exhausted(403, self.response(1).headers)
+
+
+class RepoJobTests(TestCase):
+    def client_for(self, username: str) -> Client:
+        client = Client()
+        client.force_login(User.objects.create_user(username))
+        session = client.session
+        session['access_token'] = f'token-{username}'
+        session.save()
+        return client
+
+    def test_attached_user_can_poll(self):
+        first, second, other = self.client_for('first'), self.client_for('second'), self.client_for('other')
+        release = threading.Event()
+        with mock.patch('home.views.build_repository', lambda *args, **kwargs: release.wait(5)):
+            jobs = [x.post('/repo_jobs/', {'repo_id': 4242}, secure=True).json() for x in (first, second)]
+            self.assertEqual(jobs[0]['job_id'], jobs[1]['job_id'])
+            for client in (first, second):
+                self.assertEqual(client.get(f"/repo_jobs/{jobs[0]['job_id']}/", secure=True).status_code, 200)
+            self.assertEqual(other.get(f"/repo_jobs/{jobs[0]['job_id']}/", secure=True).status_code, 404)
+            release.set()
+
+
+class RefreshJobManagerTests(SimpleTestCase):
+    def test_interactive_jobs_skip_the_background_queue(self):
+        jobs = RefreshJobManager(interactive_workers=2, background_workers=1, keep_for=60)
+        release = threading.Event()
+        jobs.submit('busy', release.wait, 5, level=BACKGROUND)
+        queued = jobs.submit('repo', lambda: 'built', level=BACKGROUND)
+        # Promoted to the interactive pool, it doesn't wait for the busy background worker
+        job = jobs.submit('repo', lambda: 'built', level=INTERACTIVE)
+        self.assertIs(job, queued)
+        self.assertTrue(job.join(2))
+        self.assertEqual((job.result, job.level), ('built', INTERACTIVE))
+        release.set()
+
+
+class SaveRowsTests(TestCase):
+    def test_rows_stored_meanwhile_are_kept(self):
+        user = User.objects.create_user('batch')
+        started = now()
+        make_repository(user, description='built by a web request')
+        rebuilt = make_repository(user, save=False, cached_at=started, description='rebuilt')
+        self.assertEqual(save_rows([rebuilt], since=started), {1})
+        self.assertEqual(GitHubRepositoryModel.objects.get(id=1).description, 'built by a web request')
+        self.assertEqual(save_rows([rebuilt], since=now()), set())
+        self.assertEqual(GitHubRepositoryModel.objects.get(id=1).description, 'rebuilt')
+
+
+class BuildKeyTests(TestCase):
+    def test_asked_by_name_and_by_id_share_a_build(self):
+        user = User.objects.create_user('builds')
+        with mock.patch('home.views.get_repository', return_value=mock.Mock(id=1)), \
+                mock.patch('home.views.BUILDS.do') as do:
+            build_repository(user, 'token', repo_owner='Owner', repo_name='Repo')
+            build_repository(user, 'token', repo_id=1)
+        self.assertEqual([x.args[0] for x in do.call_args_list], [repo_key(1), repo_key(1)])
+
+
+class LockRowTests(TransactionTestCase):
+    def test_release_keeps_a_lock_taken_over(self):
+        owner = lock_row(GitHubRepositoryLockModel, 'lock', ttl=0.01, timeout=0)
+        self.assertFalse(owner.__enter__())
+        sleep(0.05)
+        # The owner outlived its TTL, another worker takes over
+        with lock_row(GitHubRepositoryLockModel, 'lock', ttl=60, timeout=0) as waited:
+            self.assertFalse(waited)
+            expires_at = GitHubRepositoryLockModel.objects.get().expires_at
+            owner.__exit__(None, None, None)
+            self.assertEqual(GitHubRepositoryLockModel.objects.get().expires_at, expires_at)
+        self.assertFalse(GitHubRepositoryLockModel.objects.exists())
+
+    def test_takeover_only_deletes_the_expired_row_seen(self):
+        GitHubRepositoryLockModel.objects.create(key='lock', expires_at=now() - timedelta(minutes=1))
+        fresh = now() + timedelta(minutes=1)
+
+        def taken_over_meanwhile():
+            # Another waiter replaced the expired row after this one read it
+            GitHubRepositoryLockModel.objects.all().delete()
+            GitHubRepositoryLockModel.objects.create(key='lock', expires_at=fresh)
+            patch.stop()
+            return now()
+
+        patch = mock.patch('home.singleflight.now', taken_over_meanwhile)
+        patch.start()
+        with lock_row(GitHubRepositoryLockModel, 'lock', ttl=60, timeout=0) as waited:
+            self.assertTrue(waited)
+        self.assertEqual(GitHubRepositoryLockModel.objects.get().expires_at, fresh)
+
+
+class RefreshRowsTests(TransactionTestCase):
+    def test_rows_built_by_a_web_request_are_skipped(self):
+        user = User.objects.create_user('refresh')
+        row = make_repository(user)
+        GitHubRepositoryLockModel.objects.create(key=repo_key(1), expires_at=now() + timedelta(minutes=1))
+        results = list(refresh_rows([row], {user.id: 'token'}, workers=1))
+        self.assertEqual(results, [{'id': 1, 'row': None, 'skipped': 'building'}])
+
+    def test_lock_released_once_saved(self):
+        user = User.objects.create_user('refresh')
+        row = make_repository(user)
+        rebuilt = make_repository(user, save=False, description='rebuilt')
+        result = {'id': 1, 'row': rebuilt, 'error': None, 'deferred': False, 'seconds': 0, 'remaining': None}
+        with mock.patch('home.refresh.build_row', return_value=result):
+            self.assertEqual(next(refresh_rows([row], {user.id: 'token'}, workers=1))['row'], rebuilt)
+        self.assertFalse(GitHubRepositoryLockModel.objects.exists())
+        self.assertEqual(GitHubRepositoryModel.objects.get(id=1).description, 'rebuilt')
+
+    def test_web_workers_serve_refreshed_rows(self):
+        user = User.objects.create_user('refresh')
+        self.addCleanup(REPO_CACHE.delete, repo_key(1), repo_key(repo_owner='owner', repo_name='repo'))
+        old = now() - timedelta(seconds=settings.CACHE_INVALIDATE + 60)
+        row = make_repository(user, cached_at=old)
+        # Cached by a web worker, refresh_repos has its own in memory cache
+        cache_payload(row.dump())
+        rebuilt = make_repository(user, save=False)
+        result = {'id': 1, 'row': rebuilt, 'error': None, 'deferred': False, 'seconds': 0, 'remaining': None}
+        with mock.patch('home.refresh.build_row', return_value=result), \
+                mock.patch.object(type(REPO_CACHE), 'shared', False):
+            list(refresh_rows([row], {user.id: 'token'}, workers=1))
+        self.assertEqual(get_cached_payload(repo_id=1)['cached_at'], rebuilt.cached_at)
+
+
+class GraphQLParityTests(FakeGitHubMixin, SimpleTestCase):
+    """GraphQL answers are shaped exactly as the REST ones, both fetched from the fake GitHub"""
+    # Over a page of repositories
+    fake_options = {'repos': 120, 'commits': (5,)}
+
+    def test_profile(self):
+        rest, graphql = request_profile('parity-profile')[2], request_profile_graphql('parity-profile')
+        del rest['api_limit'], graphql['api_limit']
+        self.assertEqual(len(graphql['repos']), 120)
+        self.assertEqual(graphql, rest)
+
+    def test_repository(self):
+        repo = github_api.get_repository('parity-repo', repo_owner='fake-user', repo_name='repo-1')
+        rest = [x.name for x in repo.branches()], [str_short_user(x) for x in repo.collaborators()], \
+            [str_short_pull_request(x) for x in repo.pull_requests(state='open', sort='updated')]
+        graphql = fetch_repository_graphql(repo.session, 'fake-user', 'repo-1')
+        self.assertEqual((graphql['branches'], graphql['collaborators'], graphql['pull_requests']), rest)
+
+
+class ResponseCacheTests(FakeGitHubMixin, SimpleTestCase):
+    fake_options = {'repos': 3}
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def session(self, max_size: int = 1024 * 1024) -> tuple[Session, ResponseCache]:
+        cache = ResponseCache(self.directory, max_size)
+        session = Session()
+        session.headers['Authorization'] = 'token response-cache'
+        session.mount('http://', CachingAdapter(cache))
+        self.addCleanup(session.close)
+        return session, cache
+
+    def get(self, session: Session, index: int) -> Response:
+        response = session.get(f'{self.fake.base_url}/repositories/{REPO_ID_BASE + index}')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_stored_body_replayed_on_304(self):
+        session, _ = self.session()
+        first = self.get(session, 0)
+        self.assertNotIn('If-None-Match', first.request.headers)
+        requests = self.fake.requests
+        second = self.get(session, 0)
+        self.assertEqual(self.fake.requests - requests, 1)
+        self.assertEqual(second.request.headers['If-None-Match'], first.headers['ETag'])
+        self.assertTrue(second.from_cache)
+        self.assertEqual((second.content, second.json()['id']), (first.content, REPO_ID_BASE))
+        # 304 answers are free
+        self.assertEqual(second.headers['X-RateLimit-Remaining'], first.headers['X-RateLimit-Remaining'])
+
+    def test_least_recently_used_evicted(self):
+        session, cache = self.session()
+        self.get(session, 0)
+        # Room for two entries
+        max_size = int(cache._size * 2.5)
+        for x in self.directory.glob('*.cache'):
+            x.unlink()
+        session, cache = self.session(max_size)
+        keys = [cache.key(self.get(session, i).request) for i in range(3)]
+        self.assertIsNotNone(cache.get(keys[1]))
+        self.assertIsNone(cache.get(keys[0]))
+        # Reading the second made the third the oldest
+        self.get(session, 0)
+        self.assertIsNone(cache.get(keys[2]))
+        self.assertEqual([x is not None for x in map(cache.get, keys)], [True, True, False])
+        self.assertLessEqual(sum(x.stat().st_size for x in self.directory.glob('*.cache')), max_size)
+
+
+class SyncCommitsTests(FakeGitHubMixin, SimpleTestCase):
+    fake_options = {'repos': 1, 'commits': (30,)}
+
+    def setUp(self):
+        super().setUp()
+        self.repo = github_api.get_repository('sync-commits', repo_id=REPO_ID_BASE)
+
+    def sync(self, head: str | None, full_sync: float | None = None) -> tuple[list[str], dict, bool]:
+        new, watermark, resync = sync_commits(self.repo, {'head': head, 'full_sync': time() if full_sync is None else full_sync})
+        return [sha for _, sha, _ in new], watermark, resync
+
+    def test_first_sync_walks_the_history(self):
+        new, watermark, resync = sync_commits(self.repo, {})
+        self.assertEqual((len(new), watermark['head'], resync), (30, self.fake.sha(0, 0), True))
+
+    def test_only_new_commits_fetched(self):
+        # The head was five commits back at the last sync
+        new, watermark, resync = self.sync(self.fake.sha(0, 5))
+        self.assertEqual(new, [self.fake.sha(0, i) for i in range(4, -1, -1)])
+        self.assertEqual((watermark['head'], resync), (self.fake.sha(0, 0), False))
+
+    def test_unchanged_head_fetches_nothing(self):
+        requests = self.fake.requests
+        self.assertEqual(self.sync(self.fake.sha(0, 0))[0], [])
+        self.assertEqual(self.fake.requests - requests, 1)
+
+    def test_force_push_resyncs(self):
+        new, _, resync = self.sync('f' * 40)
+        self.assertEqual((len(new), resync), (30, True))
+
+    def test_old_full_walk_resyncs(self):
+        new, watermark, resync = self.sync(self.fake.sha(0, 5), full_sync=time() - settings.COMMITS_FULL_SYNC - 1)
+        self.assertEqual((len(new), resync), (30, True))
+        self.assertGreater(watermark['full_sync'], time() - 60)
+
+    def test_merged_older_commits_are_new(self):
+        # Authored before the last sync on a branch, merged since
+        merged = {'sha': 'b' * 40, 'author': {'login': 'merged'}, 'commit': {'committer': {'date': '2020-01-01T00:00:00Z'}}}
+        repo = mock.Mock(default_branch='main')
+        repo.branch.return_value.commit.sha = 'c' * 40
+        repo.compare_commits.return_value = mock.Mock(status='ahead', total_commits=1, original_commits=[mock.Mock(as_dict=lambda: merged)])
+        new, _, resync = sync_commits(repo, {'head': 'a' * 40, 'full_sync': time()})
+        self.assertEqual((new, resync), ([('merged', 'b' * 40, 1577836800)], False))
+
+
+class FakeGitHubEndToEndTests(FakeGitHubMixin, TransactionTestCase):
+    """Log in, open a repository and chart it, against the fake GitHub"""
+    fake_options = {'repos': 3, 'commits': (30,)}
+
+    def setUp(self):
+        super().setUp()
+        self.patch(mock.patch.multiple(settings, CURRENT_TOKEN='end-to-end', WARM_REPOS=0),
+                   mock.patch.object(views.PROFILE_REFRESHER, 'start'))
+
+    def test_login_choose_repo_and_series(self):
+        response = self.client.get('/login/', secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(GitHubProfileModel.objects.get().login, 'fake-user')
+
+        response = self.client.post('/choose_repo/', {'repo_id': REPO_ID_BASE}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['full_name'], 'fake-user/repo-0')
+        self.assertEqual(GitHubCommitModel.objects.filter(repo_id=REPO_ID_BASE).count(), 30)
+
+        response = self.client.get(f'/repo_series/{REPO_ID_BASE}/', {'metric': 'commits'}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(response.json()['series'][0]), 30)
+
+    def test_stream_delivers_the_payload(self):
+        self.addCleanup(REPO_CACHE.delete, repo_key(REPO_ID_BASE + 1), repo_key(repo_owner='fake-user', repo_name='repo-1'))
+        self.client.get('/login/', secure=True)
+        response = self.client.get(f'/repos/{REPO_ID_BASE + 1}/stream/', secure=True)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).split(b'\n')
+        # One JSON event per line, the last one terminated too
+        self.assertEqual(lines.pop(), b'')
+        events = [json.loads(x) for x in lines]
+        self.assertEqual({tuple(x) for x in events}, {('event', 'data')})
+        self.assertEqual(events[0]['event'], 'metadata')
+        self.assertEqual(events[-1]['event'], 'repo')
+        self.assertEqual({x['event'] for x in events[:-1]}, set(SECTIONS))
+
+        payload = self.client.get(f'/repos/{REPO_ID_BASE + 1}/', secure=True).json()
+        self.assertEqual(events[-1]['data'], payload)
+        for event in events[:-1]:
+            with self.subTest(event['event']):
+                self.assertEqual(event['data'], {key: payload[key] for key in event['data']})
+        # Served from the cache, the stream is the one payload
+        response = self.client.get(f'/repos/{REPO_ID_BASE + 1}/stream/', secure=True)
+        self.assertEqual(b''.join(response.streaming_content), b'{"event":"repo","data":' + dumps(payload) + b'}\n')
+
+
+class StalePayloadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('stale')
+        self.addCleanup(REPO_CACHE.delete, repo_key(1), repo_key(repo_owner='owner', repo_name='repo'))
+
+    def test_newer_row_replaces_a_stale_payload(self):
+        old = now() - timedelta(seconds=settings.CACHE_INVALIDATE + 60)
+        cache_payload(make_repository(self.user, save=False, cached_at=old).dump())
+        # Rebuilt by another worker, or refresh_repos
+        make_repository(self.user)
+        self.assertGreater(get_cached_payload(repo_id=1)['cached_at'], old)
+
+    def test_fresh_row_not_rebuilt_after_taking_the_lock(self):
+        make_repository(self.user)
+        with mock.patch('home.views.rebuild_repository') as rebuild:
+            self.assertEqual(build_repository_locked(self.user, 'token', repo_id=1)['id'], 1)
+        rebuild.assert_not_called()
+
+
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('revalidate')
+        self.addCleanup(REPO_CACHE.delete, repo_key(7), repo_key(repo_owner='owner', repo_name='revalidate'))
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.jobs = []
+        refresh = views.refresh_in_background
+        self.patches = mock.patch.multiple(views, build_repository=self.build,
+                                         refresh_in_background=lambda *args, **kwargs: self.jobs.append(refresh(*args, **kwargs)) or self.jobs[-1])
+
+    def build(self, user, access_token, **repo_args):
+        self.release.wait(5)
+        return cache_payload(make_repository(self.user, 7, 'owner/revalidate', save=False, description='rebuilt').dump())
+
+    def request(self, age: float) -> tuple[dict, bool]:
+        make_repository(self.user, 7, 'owner/revalidate', cached_at=now() - timedelta(seconds=age))
+        cache_payload(GitHubRepositoryModel.objects.get(id=7).dump())
+        with self.patches:
+            return async_to_sync(views.request_repository)(self.user, 'token', repo_id=7)
+
+    def test_stale_served_now_and_refreshed_in_background(self):
+        encoded, stale = self.request(settings.CACHE_INVALIDATE + 60)
+        self.assertTrue(stale)
+        self.assertNotIn(b'rebuilt', encoded['bodies']['identity'])
+        self.assertEqual((self.jobs[0].level, self.jobs[0].finished), (BACKGROUND, False))
+        self.release.set()
+        self.assertTrue(self.jobs[0].join(5))
+        self.assertIn(b'rebuilt', get_cached_payload(repo_id=7)['bodies']['identity'])
+
+    def test_too_old_rebuilt_before_answering(self):
+        self.release.set()
+        encoded, stale = self.request(settings.CACHE_MAX_STALE + 60)
+        self.assertFalse(stale)
+        self.assertIn(b'rebuilt', encoded['bodies']['identity'])
+        self.assertEqual(self.jobs[0].level, INTERACTIVE)
+
+
+class RequestProfileTests(FakeGitHubMixin, SimpleTestCase):
+    fake_options = {'repos': 3}
+
+    def test_no_requests_left_is_not_unknown(self):
+        requests = self.fake.requests
+        with mock.patch.object(github_api.SCHEDULER, 'report', return_value={'remaining': 0}):
+            profile = request_profile('no-requests-left')[2]
+        self.assertEqual(profile['api_limit'], 0)
+        self.assertEqual(profile['plan'], 'free')
+        # /user and the six listings, /rate_limit is not asked
+        self.assertEqual(self.fake.requests - requests, 7)
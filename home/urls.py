@@ -9,5 +9,14 @@ urlpatterns = [
     path('logout/', views.logout_request, name='logout'),
     path('callback/', views.CallbackView.as_view(), name='callback'),
     path('choose_repo/', views.choose_repo, name='update_context'),
+    path('repos/<int:repo_id>/stream/', views.repo_stream, name='repo_stream'),
+    path('repos/<str:repo_owner>/<str:repo_name>/stream/', views.repo_stream, name='repo_stream_by_name'),
+    path('repos/<int:repo_id>/', views.repo_payload, name='repo_payload'),
+    path('repos/<str:repo_owner>/<str:repo_name>/', views.repo_payload, name='repo_payload_by_name'),
+    path('repo_jobs/', views.refresh_repo, name='refresh_repo'),
+    path('repo_jobs/<str:job_id>/', views.repo_job, name='repo_job'),
+    path('repo_series/<int:repo_id>/', views.repo_series, name='repo_series'),
+    path('profile/repos/', views.profile_repos, name='profile_repos'),
+    path('rate_limit/', views.rate_limit, name='rate_limit'),
     path('', views.index, name='index'),
 ]
@@ -1,101 +1,530 @@
 """View source file"""
 
-from concurrent.futures import InvalidStateError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import json
 import secrets
 from subprocess import TimeoutExpired
-import requests
+
+from asgiref.sync import sync_to_async
 
 from django.shortcuts import render
 from django.utils.timezone import now
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.views.generic.base import TemplateView
 from django.contrib.auth import login, logout
 from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.cache import patch_cache_control
+from django.db.models import Max
+from django.db import connections
 from django.db.utils import OperationalError
 
+from github3.repos import Repository
 from oauthlib.oauth2 import WebApplicationClient
 from core import settings
 
-from .github_api import request_profile, get_repository
-from .models import GitHubRepositoryModel
+from .github_api import CLIENTS, SCHEDULER, get_repository
+from .github_async import exchange_code, get_json, request_profile_async
+from .github_graphql import request_profile_graphql_async
+from .jobs import JOBS, RefreshJob, publish
+from .ratelimit import BACKGROUND, INTERACTIVE, RateLimitDeferred, RateLimitExceeded
+from .payloads import FRESH_PREFIX, STALE_PREFIX, dumps, payload_response
+from .profiles import PROFILE_REFRESHER, get_profile, get_profile_repo_ids, get_profile_repos, get_snapshot, store_profile, touch_profile
+from .models import GitHubCommitModel, GitHubProfileRepositoryModel, GitHubRepositoryLockModel, GitHubRepositoryModel
+from .repo_cache import REPO_CACHE, cache_payload, repo_key
+from .singleflight import SingleFlight, lock_row
+from .series import BUCKETS, code_freq_series, commit_activity_series, commits_series, prepare
 
 
-def request_repository(user, access_token: str, repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None):
-    try:
-        if repo_owner:
-            repo = GitHubRepositoryModel.objects.get(full_name=f'{repo_owner}/{repo_name}').dump()
-        else:
-            repo = GitHubRepositoryModel.objects.get(id=repo_id).dump()
+BUILDS = SingleFlight()
+# Login warm-ups run one at a time, each waiting on its builds, so they never hold more than one refresh worker
+WARMUP = ThreadPoolExecutor(max_workers=1, thread_name_prefix='warmup')
 
-        if now().timestamp()-repo['cached_at'].timestamp() > settings.CACHE_INVALIDATE:
-            raise InvalidStateError()
 
-        print(f"Repo {repo_id} cached!")
-        return repo
+def get_cached_repository(repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None) -> GitHubRepositoryModel | None:
+    """Get the cached row of a repository, however old it is
+
+    Returns:
+        GitHubRepositoryModel | None: The cached row, None if not cached
+    """
+    try:
+        if repo_owner:
+            return GitHubRepositoryModel.objects.get(full_name=f'{repo_owner}/{repo_name}')
+        return GitHubRepositoryModel.objects.get(id=repo_id)
     except GitHubRepositoryModel.DoesNotExist:
         print(f"Repo {repo_id} not found!")
-    except InvalidStateError:
-        print(f"Repo {repo_id} invalidated!")
     except OperationalError:
         print(f"Repo Failed to get, no Database connected?")
-    if repo_owner:
-        repo = get_repository(access_token, repo_owner=repo_owner, repo_name=repo_name)
-    elif repo_id:
-        repo = get_repository(access_token, repo_id)
-    repo = GitHubRepositoryModel(usr=user, repo=repo)
+    return None
+
+
+def cache_age(cached_at: datetime) -> float:
+    return now().timestamp()-cached_at.timestamp()
+
+
+def is_fresh(cached_at: datetime) -> bool:
+    return cache_age(cached_at) <= settings.CACHE_INVALIDATE
+
+
+def stored_at(repo_id: int) -> datetime | None:
+    """When the row of a repository was last stored, by any worker or by `refresh_repos`"""
+    try:
+        return GitHubRepositoryModel.objects.filter(id=repo_id).values_list('cached_at', flat=True).first()
+    except OperationalError:
+        return None
+
+
+def get_cached_payload(repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None) -> dict | None:
+    """Get the encoded payload of a repository from the cache tiers, falling back to its row
+
+    A stale payload is replaced with the row when the row is newer, the cache tiers may be per process while other
+    workers and `refresh_repos` rebuild rows.
+
+    Returns:
+        dict | None: The encoded payload, however old it is, None if not cached
+    """
+    encoded = REPO_CACHE.get(repo_key(repo_id, repo_owner, repo_name))
+    if encoded is not None and not is_fresh(encoded['cached_at']):
+        cached_at = stored_at(encoded['id'])
+        if cached_at is not None and cached_at > encoded['cached_at']:
+            encoded = None
+    if encoded is None:
+        repo = get_cached_repository(repo_id, repo_owner, repo_name)
+        if repo:
+            encoded = cache_payload(repo.dump())
+    return encoded
+
+
+def rebuild_repository(user, access_token: str, repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None,
+                       previous: GitHubRepositoryModel | None = None, repo: Repository | None = None):
+    if repo is None:
+        repo = get_repository(access_token, repo_id, repo_owner, repo_name)
+    # The invalidated row is kept so only new commits have to be fetched
+    previous = previous or get_cached_repository(repo_id, repo_owner, repo_name)
+    repo = GitHubRepositoryModel(usr=user, repo=repo, previous=previous, on_section=publish)
     try:
         repo.save()
     except Exception as e:
         pass
-    return repo.dump()
+    return cache_payload(repo.dump())
+
+
+def build_repository_locked(user, access_token: str, repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None,
+                            previous: GitHubRepositoryModel | None = None, repo: Repository | None = None):
+    key = repo_key(repo_id, repo_owner, repo_name)
+    with lock_row(GitHubRepositoryLockModel, key, settings.BUILD_LOCK_TTL, settings.BUILD_LOCK_TIMEOUT):
+        # Another worker or `refresh_repos` may have built it since it was found stale, the row is loaded anyway as
+        # the previous build
+        cached = get_cached_repository(repo_id, repo_owner, repo_name)
+        if cached and is_fresh(cached.cached_at):
+            print(f"Repo {key} built by another worker")
+            return cache_payload(cached.dump())
+        previous = cached or previous
+        return rebuild_repository(user, access_token, repo_id, repo_owner, repo_name, previous, repo)
+
+
+def build_repository(user, access_token: str, repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None,
+                     previous: GitHubRepositoryModel | None = None):
+    """Build and cache a repository, concurrent callers for the same repository share a single build, across threads
+    through `BUILDS` and across worker processes through a lock row
+
+    Builds are keyed by repository id, a repository asked for by name is looked up first, so callers asking by id and
+    by name share the build.
+    """
+    repo = None
+    if repo_owner:
+        repo = get_repository(access_token, repo_owner=repo_owner, repo_name=repo_name)
+        if repo is not None:
+            repo_id, repo_owner, repo_name = repo.id, None, None
+    return BUILDS.do(repo_key(repo_id, repo_owner, repo_name), build_repository_locked,
+                     user, access_token, repo_id, repo_owner, repo_name, previous, repo)
 
 
-def choose_repo(request):
-    if request.method == 'POST':
-        repo_id = int(request.POST.get('repo_id'))
-        access_token = request.session["access_token"]
+def known_repo_args(encoded: dict | None, repo_args: dict) -> dict:
+    """Refer to a repository by id once it is cached, so jobs asked for by id and by name are shared"""
+    return {'repo_id': encoded['id']} if encoded else repo_args
+
+
+def refresh_in_background(user, access_token: str, level: int = BACKGROUND, max_requests: int | None = None, **repo_args) -> RefreshJob:
+    """Start or attach to a background rebuild of a repository
+
+    Pass the repository by id once known, see `known_repo_args`, jobs are keyed by how it is asked for.
+
+    Returns:
+        RefreshJob: The refresh job
+    """
+    return JOBS.submit(repo_key(**repo_args), build_repository, user, access_token, user_id=user.id, level=level,
+                       max_requests=max_requests, **repo_args)
+
+
+def warm_candidates(user, profile_id: int, count: int) -> list[int]:
+    """Repositories a user most likely opens after logging in: the ones they opened before, last opened first, then the
+    newest of their list
+
+    Returns:
+        list[int]: Up to `count` repository ids
+    """
+    repo_ids = list(GitHubRepositoryModel.objects.filter(user=user).order_by('-cached_at').values_list('id', flat=True)[:count])
+    for repo_id in get_profile_repo_ids(profile_id, count):
+        if len(repo_ids) >= count:
+            break
+        if repo_id not in repo_ids:
+            repo_ids.append(repo_id)
+    return repo_ids
+
+
+def warm_repositories(user, access_token: str, profile_id: int):
+    """Build the repositories a user is likely to open next, one at a time at background priority
+
+    Builds run on the background pool, behind nothing a user waits on. Each may only spend what is left of
+    WARM_REPOS_BUDGET, and like any background work it is stopped midway once the token's budget falls to the reserve
+    of RATE_LIMIT_RESERVE.
+    """
+    try:
+        spent_before = SCHEDULER.report(access_token)['background_requests']
+        for repo_id in warm_candidates(user, profile_id, settings.WARM_REPOS):
+            spent = SCHEDULER.report(access_token)['background_requests'] - spent_before
+            if spent >= settings.WARM_REPOS_BUDGET:
+                print(f"Warm-up of {user.username} stopped, {spent} requests spent")
+                break
+            encoded = get_cached_payload(repo_id=repo_id)
+            if encoded and is_fresh(encoded['cached_at']):
+                continue
+            job = refresh_in_background(user, access_token, max_requests=settings.WARM_REPOS_BUDGET - spent, repo_id=repo_id)
+            job.join()
+            if isinstance(job.exception, (RateLimitDeferred, RateLimitExceeded)):
+                print(f"Warm-up of {user.username} stopped: {job.exception}")
+                break
+    except Exception as e:
+        print(f"Warm-up of {user.username} failed: {e}")
+    finally:
+        connections.close_all()
+
+
+async def request_repository(user, access_token: str, repo_id: int | None = None, repo_owner: str | None = None,
+                             repo_name: str | None = None) -> tuple[dict, bool]:
+    """Get the encoded payload of a repository, building it if it isn't cached
+
+    The build runs as a refresh job, which is awaited without holding a thread.
+
+    Returns:
+        tuple[dict, bool]: The encoded payload, and whether it is stale
+    """
+    repo_args = {'repo_owner': repo_owner, 'repo_name': repo_name} if repo_owner else {'repo_id': repo_id}
+    encoded = await sync_to_async(get_cached_payload)(**repo_args)
+    if encoded and is_fresh(encoded['cached_at']):
+        print(f"Repo {repo_id} cached!")
+        return encoded, False
+    if encoded and cache_age(encoded['cached_at']) <= settings.CACHE_MAX_STALE:
+        # Stale while revalidate, serve the old payload now and rebuild it in the background
+        print(f"Repo {repo_id} stale, refreshing in background")
+        refresh_in_background(user, access_token, **known_repo_args(encoded, repo_args))
+        return encoded, True
+    if encoded:
+        print(f"Repo {repo_id} invalidated!")
+    job = refresh_in_background(user, access_token, INTERACTIVE, **known_repo_args(encoded, repo_args))
+    await job.wait()
+    if job.status == 'failed':
+        raise job.exception
+    return job.result, False
+
+
+def can_read(request, repo_id: int, private: bool | None = True) -> bool:
+    """Whether the requester may see a repository: public ones, and private ones they built or have in their list
+
+    Payloads are shared by every user, a private one may have been built with another user's token. Payloads cached
+    before they carried `private` are checked as private.
+    """
+    if private is False:
+        return True
+    if GitHubRepositoryModel.objects.filter(id=repo_id, user_id=request.user.id).exists():
+        return True
+    profile_id = request.session.get('profile_id')
+    return profile_id is not None and GitHubProfileRepositoryModel.objects.filter(profile_id=profile_id, repo_id=repo_id).exists()
+
+
+def not_found() -> JsonResponse:
+    return JsonResponse({'error': 'Repository not found'}, status=404)
 
-        if (repo_id == 0):
-            repo_owner = request.POST.get('repo_owner')
-            repo_name = request.POST.get('repo_name')
-            repo = request_repository(request.user, access_token, repo_owner=repo_owner, repo_name=repo_name)
-            return JsonResponse(repo)
 
-        repo = request_repository(request.user, access_token, repo_id)
-        return JsonResponse(repo)
+def get_repo_args(request) -> dict:
+    """Get which repository a request refers to, by id or, if the id is 0, by owner and name"""
+    repo_id = int(request.POST.get('repo_id'))
+    if repo_id == 0:
+        return {'repo_owner': request.POST.get('repo_owner'), 'repo_name': request.POST.get('repo_name')}
+    return {'repo_id': repo_id}
+
+
+async def load_request(request):
+    """Load the session and user of a request off the event loop, async views can then read them freely"""
+    await sync_to_async(lambda: (request.session.keys(), request.user.is_authenticated))()
+
+
+async def choose_repo(request):
+    if request.method == 'POST':
+        await load_request(request)
+        access_token = request.session["access_token"]
+        try:
+            encoded, stale = await request_repository(request.user, access_token, **get_repo_args(request))
+        except RateLimitExceeded as e:
+            return JsonResponse({'error': str(e)}, status=429)
+        if not await sync_to_async(can_read)(request, encoded['id'], encoded.get('private')):
+            return not_found()
+        return payload_response(request, encoded, stale)
         # return JsonResponse({'error': 'Repository not found'})
 
     return JsonResponse({'error': 'Invalid request'})
 
 
-def finish_login(request, access_token):
-    # print(access_token)
-    print('Requesting Profile')
-    gh, gh_usr, request.session["profile"] = request_profile(access_token=access_token)
-    print('Done')
+def refresh_repo(request):
+    """Start or attach to a background refresh of a repository, returning immediately
+
+    The payload itself is served by `choose_repo`, `cached` tells whether there is a snapshot worth showing meanwhile.
+    """
+    if request.method != 'POST' or "access_token" not in request.session:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    repo_args = get_repo_args(request)
+    encoded = get_cached_payload(**repo_args)
+
+    if encoded and is_fresh(encoded['cached_at']):
+        return JsonResponse({'job_id': None, 'status': 'done', 'cached': True})
+
+    # The user is waiting on this one
+    job = refresh_in_background(request.user, request.session["access_token"], INTERACTIVE, **known_repo_args(encoded, repo_args))
+    response = job.dump()
+    # Past the max staleness the snapshot is not worth showing, the client waits for the job instead
+    response['cached'] = bool(encoded) and cache_age(encoded['cached_at']) <= settings.CACHE_MAX_STALE
+    return JsonResponse(response, status=202)
+
+
+def repo_payload(request, repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None):
+    """Cacheable GET resource of a repository, answering revalidations with a 304
+
+    A repository that isn't cached yet is built in the background, answering 202 with the job to poll.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({'error': 'Invalid request'}, status=405)
+    if "access_token" not in request.session:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+
+    repo_args = {'repo_owner': repo_owner, 'repo_name': repo_name} if repo_owner else {'repo_id': repo_id}
+    encoded = get_cached_payload(**repo_args)
+    if encoded and not can_read(request, encoded['id'], encoded.get('private')):
+        return not_found()
+    if encoded and cache_age(encoded['cached_at']) <= settings.CACHE_MAX_STALE:
+        stale = not is_fresh(encoded['cached_at'])
+        if stale:
+            refresh_in_background(request.user, request.session["access_token"], **known_repo_args(encoded, repo_args))
+        return payload_response(request, encoded, stale)
+
+    job = refresh_in_background(request.user, request.session["access_token"], INTERACTIVE, **known_repo_args(encoded, repo_args))
+    response = JsonResponse({**job.dump(), 'cached': False}, status=202)
+    patch_cache_control(response, no_store=True)
+    return response
+
+
+def stream_event(event: str, data) -> bytes:
+    """One line of a repository stream"""
+    return dumps({'event': event, 'data': data}) + b'\n'
+
+
+def stream_payload(encoded: dict, stale: bool) -> bytes:
+    """Line of a repository stream carrying a whole payload, spliced from its encoded body"""
+    body = encoded['bodies']['identity']
+    if stale:
+        body = STALE_PREFIX + body[len(FRESH_PREFIX):]
+    return b'{"event":"repo","data":' + body + b'}\n'
+
+
+def repo_stream(request, repo_id: int | None = None, repo_owner: str | None = None, repo_name: str | None = None):
+    """Stream a repository as newline delimited JSON events, each section of a rebuild as soon as it is fetched
+
+    Events are `{"event": name, "data": ...}`, with sections named as in `SECTIONS` and carrying their keys of the
+    payload. `repo` events carry a whole payload, a stale one first if cached, and the rebuilt one last.
+    """
+    if "access_token" not in request.session:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+
+    repo_args = {'repo_owner': repo_owner, 'repo_name': repo_name} if repo_owner else {'repo_id': repo_id}
+    encoded = get_cached_payload(**repo_args)
+    if encoded and not can_read(request, encoded['id'], encoded.get('private')):
+        return not_found()
+    job = None
+    if not encoded or not is_fresh(encoded['cached_at']):
+        job = refresh_in_background(request.user, request.session["access_token"], INTERACTIVE, **known_repo_args(encoded, repo_args))
+
+    def head():
+        if encoded and cache_age(encoded['cached_at']) <= settings.CACHE_MAX_STALE:
+            yield stream_payload(encoded, job is not None)
+
+    def tail():
+        if job.status == 'done':
+            yield stream_payload(job.result, False)
+        else:
+            yield stream_event('error', job.error)
+
+    # A job may be another user's build, the metadata section comes first and tells whether the repo is private
+    def denied(event: str, data) -> bool:
+        return event == 'metadata' and not can_read(request, data['id'], data['private'])
+
+    def events():
+        yield from head()
+        if job is not None:
+            for event, data in job.iter_events():
+                if denied(event, data):
+                    yield stream_event('error', 'Repository not found')
+                    return
+                yield stream_event(event, data)
+            yield from tail()
+
+    # Under ASGI waiting for the job must not hold a thread
+    async def aevents():
+        for line in head():
+            yield line
+        if job is not None:
+            async for event, data in job.aiter_events():
+                if await sync_to_async(denied)(event, data):
+                    yield stream_event('error', 'Repository not found')
+                    return
+                yield stream_event(event, data)
+            for line in tail():
+                yield line
+
+    response = StreamingHttpResponse(aevents() if isinstance(request, ASGIRequest) else events(), content_type='application/x-ndjson')
+    patch_cache_control(response, no_store=True)
+    # Don't let nginx hold back the sections
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def repo_job(request, job_id: str):
+    """Poll a background refresh started by `refresh_repo`"""
+    job = JOBS.get(job_id)
+    if job is None or not job.readable_by(request.user.id):
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(job.dump())
+
+
+def repo_series(request, repo_id: int):
+    """Chart data of a cached repository, windowed to a time range, bucketed and downsampled"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+
+    private = GitHubRepositoryModel.objects.filter(id=repo_id).values_list('private', flat=True).first()
+    if private is None or not can_read(request, repo_id, private):
+        return JsonResponse({'error': 'Repository not cached'}, status=404)
+
+    metric = request.GET.get('metric', 'commit_activity')
+    size = request.GET.get('bucket') or None
+    try:
+        seconds = int(request.GET.get('range', 999999999999))
+        max_points = int(request.GET.get('points', settings.SERIES_POINTS))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    # Downsampling keeps the first and last points and at least one in between
+    max_points = max(3, min(max_points, settings.SERIES_MAX_POINTS))
+    if size not in BUCKETS + [None]:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    if metric == 'commits':
+        commits = GitHubCommitModel.objects.filter(repo_id=repo_id)
+        last = commits.aggregate(last=Max('timestamp'))['last'] or 0
+        points = commits_series(list(commits.in_range(start=last - seconds).values_list('timestamp', flat=True)))
+        native = 'day'
+    elif metric in ('commit_activity', 'code_freq'):
+        # Only the one column is loaded, not the whole row
+        raw = GitHubRepositoryModel.objects.filter(id=repo_id).values_list(metric, flat=True).first()
+        if raw is None:
+            return JsonResponse({'error': 'Repository not cached'}, status=404)
+        raw = GitHubRepositoryModel._meta.get_field(metric).to_python(raw)
+        if metric == 'commit_activity':
+            points, native = commit_activity_series(raw), 'day'
+        else:
+            points, native = code_freq_series(raw), 'week'
+    else:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    size, points = prepare(points, seconds, max_points, size, native)
+    return JsonResponse({
+        'metric': metric,
+        'bucket': size,
+        'labels': [x[0] for x in points],
+        'series': [list(x) for x in zip(*[x[1] for x in points])],
+    })
+
+
+def rate_limit(request):
+    """Known GitHub rate limit budget and usage of the current user's token"""
+    if "access_token" not in request.session:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+    return JsonResponse(SCHEDULER.report(request.session["access_token"]))
+
+
+def profile_repos(request):
+    """A page of the logged in user's repositories, newest first, or best match first when searched with `q`"""
+    profile_id = request.session.get("profile_id")
+    if not request.user.is_authenticated or profile_id is None:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    query = request.GET.get('q', '')
+    repos, has_next = get_profile_repos(profile_id, page, settings.PROFILE_REPOS_PAGE_SIZE, query)
+    profile = get_profile(profile_id) or {}
+    return JsonResponse({'repos': repos, 'page': page, 'has_next': has_next, 'q': query,
+                         'count': profile.get('repo_count', 0)})
+
+
+def login_github_user(request, username: str):
     try:
-        # IMPROVE: update periodically, instead on each logon
-        user = User.objects.get(username=gh_usr.login)
+        user = User.objects.get(username=username)
         usr_str = f"User {user.username} already exists, Authenticated {user.is_authenticated}"
         print(usr_str)
         login(request, user)
 
     except Exception as e:
         print(f"ERROR: {e}")
-        user = User.objects.create_user(gh_usr.login)
+        user = User.objects.create_user(username)
         usr_str = f"User {user.username} is created, Authenticated {user.is_authenticated}?"
         print(usr_str)
         login(request, user)
 
 
-def github_login(request):
+async def finish_login(request, access_token):
+    # print(access_token)
+    # The user is resolved first, the snapshot is stored by user. GitHub answers a 304 when the response cache has it
+    user_id = (await get_json(access_token, '/user')).json()['id']
+    profile = await sync_to_async(get_snapshot)(user_id, access_token)
+    if profile is None:
+        print('Requesting Profile')
+        fetch = request_profile_graphql_async if settings.GITHUB_GRAPHQL else request_profile_async
+        profile = await fetch(access_token)
+        await sync_to_async(store_profile)(profile, access_token)
+    else:
+        print('Serving Profile snapshot')
+    await sync_to_async(touch_profile)(profile["id"])
+    PROFILE_REFRESHER.start()
+    request.session["profile_id"] = profile["id"]
+    # Sessions of earlier versions held the whole profile
+    request.session.pop("profile", None)
+    print('Done')
+    await sync_to_async(login_github_user)(request, profile["login"])
+    if settings.WARM_REPOS > 0:
+        WARMUP.submit(warm_repositories, request.user, access_token, profile["id"])
+
+
+async def github_login(request):
     """Contact GitHub to authenticate"""
+    await load_request(request)
 
     if settings.CURRENT_TOKEN:
-        finish_login(request, settings.CURRENT_TOKEN)
+        await finish_login(request, settings.CURRENT_TOKEN)
         request.session["access_token"] = settings.CURRENT_TOKEN
         return HttpResponseRedirect(reverse("home:index"))
 
@@ -122,6 +551,8 @@ def github_login(request):
 
 def logout_request(request):
     """Request view to log out"""
+    if request.session.get("access_token") != settings.CURRENT_TOKEN:
+        CLIENTS.evict(request.session.get("access_token"))
     logout(request)
     # messages.add_message(request, messages.SUCCESS, "You are successfully logged out")
     return HttpResponseRedirect(reverse("home:index"))
@@ -163,7 +594,8 @@ class CallbackView(TemplateView):
 
     #     return render(request, 'index.html', context)
 
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
+        await load_request(self.request)
         # Retrieve these data from the URL
         data = self.request.GET
 
@@ -202,13 +634,11 @@ class CallbackView(TemplateView):
         )
 
         # Post a request at GitHub's token_url
-        # Returns requests.Response object
-        response = requests.post(token_url, data=data, timeout=5000)  # TODO: handle timeout
-        client.parse_request_body_response(response.text)
+        client.parse_request_body_response(await exchange_code(token_url, data))
         access_token = client.token["access_token"]
         self.request.session["access_token"] = access_token
 
-        finish_login(self.request, access_token)
+        await finish_login(self.request, access_token)
 
         # Redirect response to hide the callback url in browser
         return HttpResponseRedirect(reverse("home:index"))